@@ -0,0 +1,100 @@
+"""
+Benchmark of the required activity extraction used by the activity and video completion reports.
+
+Usage:
+    python -m benchmarks.bench_required_activity --users 50000 --activities 100
+"""
+from argparse import ArgumentParser
+import json
+import random
+from time import perf_counter
+
+from proversity_reports_script.report_backend.util import (
+    compile_required_activity_extractor,
+    get_required_activity_dict,
+)
+
+ACTIVITY_NAMES = ['Video', 'Multiple Choice', 'Image Explorer', 'Free Text Response', 'Drag and Drop']
+ACTIVITY_STATES = ['completed', 'not_completed']
+
+
+def build_course_users(total_users, total_activities, seed):
+    """
+    Return a list of synthetic users sharing the same required activities.
+
+    Args:
+        total_users: Number of users to create.
+        total_activities: Number of required activities per user.
+        seed: Random seed.
+    Returns:
+        List of user data dicts.
+    """
+    random_generator = random.Random(seed)
+    activity_names = [random_generator.choice(ACTIVITY_NAMES) for _ in range(total_activities)]
+    course_users = []
+
+    for user_number in range(total_users):
+        user_data = {
+            'email': 'user-{}@example.com'.format(user_number),
+            'total_activities': total_activities,
+        }
+
+        for activity_number, activity_name in enumerate(activity_names, 1):
+            user_data['required_activity_{}'.format(activity_number)] = random_generator.choice(ACTIVITY_STATES)
+            user_data['required_activity_{}_name'.format(activity_number)] = activity_name
+
+        course_users.append(user_data)
+
+    return course_users
+
+
+def run_benchmark(total_users, total_activities, pool_size, seed):
+    """
+    Time the per-user and the compiled activity extraction over the same users.
+
+    The users are taken from a pool of distinct users, to keep the memory usage of
+    the benchmark low for large user counts.
+
+    Returns:
+        Dict containing the timings in seconds.
+    """
+    user_pool = build_course_users(min(pool_size, total_users), total_activities, seed)
+    course_users = [user_pool[index % len(user_pool)] for index in range(total_users)]
+
+    start = perf_counter()
+    expected = [get_required_activity_dict(user_data) for user_data in course_users]
+    per_user_seconds = perf_counter() - start
+
+    start = perf_counter()
+    extract_required_activities = compile_required_activity_extractor(course_users[0])
+    compiled = [extract_required_activities(user_data) for user_data in course_users]
+    compiled_seconds = perf_counter() - start
+
+    if compiled != expected:
+        raise AssertionError('The compiled extractor does not match get_required_activity_dict.')
+
+    return {
+        'users': total_users,
+        'activities': total_activities,
+        'get_required_activity_dict_seconds': round(per_user_seconds, 4),
+        'compiled_extractor_seconds': round(compiled_seconds, 4),
+        'speedup': round(per_user_seconds / compiled_seconds, 2) if compiled_seconds else None,
+    }
+
+
+def main():
+    """
+    Run the benchmark and print the results as json.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--activities', type=int, default=100)
+    parser.add_argument('--pool-size', type=int, default=1000, help='Number of distinct synthetic users.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.users, args.activities, args.pool_size, args.seed), indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Benchmark of the one-pass time spent per user, per team and per cohort report data.
+
+Usage:
+    python -m benchmarks.bench_time_spent_views --users 5000 --units 50
+"""
+from argparse import ArgumentParser
+from collections import OrderedDict
+import functools
+import json
+import random
+from time import perf_counter
+
+from benchmarks.generators import time_spent_per_user_report
+from proversity_reports_script.report_backend.time_spent_per_user_report import build_time_spent_views
+
+
+def build_time_spent_report_data(course_data):
+    """
+    Returns a dict containing the essential data to generate the time spent csv report.
+    Previous per user walk of the report backend, the reference of build_time_spent_views.
+
+    Args:
+        course_data: List with the course structure by subsection data.
+    Returns:
+        List containing the data to generate the report.
+        [{
+            section: Course section string name.
+            subsection: Course subsection string name.
+            page_views: Total of subsection views.
+            time_on_page: Total of the average time on page.
+        }]
+    """
+    report_course_data = []
+
+    for user_data in course_data:
+        course_blocks = user_data.get('blocks', [])
+        user_report_data = OrderedDict()
+        user_report_data['Student'] = user_data.get('username', '')
+        user_report_data['Cohort'] = user_data.get('user_cohort', '')
+        user_report_data['Teams'] = user_data.get('user_teams', '')
+
+        for course_block_index, course_block in enumerate(course_blocks):
+            vertical_name = course_block.get('vertical_name', '')
+
+            if vertical_name in user_report_data.keys():
+                vertical_name = '{}-{}'.format(vertical_name, course_block_index)
+
+            user_report_data.update({
+                vertical_name: course_block.get('average_time_spent', 0),
+            })
+
+        report_course_data.append(user_report_data)
+
+    return report_course_data
+
+
+def grouping_report_data_by_key(course_data, grouping_key):
+    """
+    Groups the report data by the key provided (user_cohort/user_teams)
+    to obtain the total time spent by all the team/cohort members in each unit.
+    Previous per group walk of the report backend, the reference of build_time_spent_views.
+
+    Args:
+        course_data: List with the course structure by unit data.
+        grouping_key: Name of the key to group the data.
+    Returns:
+        List containing the data to generate the report.
+        [{
+            section_position: Chapter position in the course structure.
+            section: Course chapter string name.
+            subsection_position: Subsection position in the course structure.
+            subsection: Course subsection string name.
+            vertical_position: Unit position in the course structure.
+            vertical_name: Course unit string name.
+            group/cohort name: Value of the time spent by team/cohort members in seconds.
+            ...
+        }]
+    """
+    course_groups = set([data.get(grouping_key, '') for data in course_data])
+    # Sort the list to maintain the order of the groups in the report data.
+    course_groups = sorted(course_groups)
+    group_report_data = []
+
+    for group in course_groups:
+        block_groups = []
+
+        # Group identical blocks of the users in the same group.
+        # [
+        #   ({'block': 'A-block'},{'block': 'A-block'},{'block': 'A-block'}),
+        #   ({'block': 'B-block'},{'block': 'B-block'},{'block': 'B-block'}),
+        #   ...
+        # ]
+        for user in course_data:
+            if user.get(grouping_key, '') == group:
+                for index, course_block in enumerate(user.get('blocks', [])):
+                    try:
+                        current = block_groups.pop(index)
+                    except IndexError:
+                        current = ()
+
+                    block_groups.insert(index, current + (course_block, ))
+
+        # Reduce the identical blocks to only one block.
+        for block_group_index, block_group in enumerate(block_groups):
+            course_teams_dict = {course_team: 0 for course_team in course_groups}
+            course_teams_dict = OrderedDict(
+                sorted(
+                    course_teams_dict.items(),
+                    key=lambda g: g[0],
+                )
+            )
+
+            try:
+                current_block = block_group[0]
+            except IndexError:
+                continue
+
+            block_data = OrderedDict()
+            block_data['section_position'] = current_block.get('chapter_position', '')
+            block_data['section'] = current_block.get('chapter_name', '')
+            block_data['subsection_position'] = current_block.get('sequential_position', '')
+            block_data['subsection'] = current_block.get('sequential_name', '')
+            block_data['vertical_position'] = current_block.get('vertical_position', '')
+            block_data['vertical_name'] = current_block.get('vertical_name', '')
+
+            # Sum all the average_time_spent.
+            course_teams_dict[group] = functools.reduce(
+                lambda x, y: x + y,
+                [average.get('average_time_spent', 0) for average in block_group],
+            )
+
+            block_data.update(course_teams_dict)
+
+            # Reduce the course structure to only one structure with the total time spent by team/cohort members.
+            try:
+                current = group_report_data.pop(block_group_index)
+
+                for group_value in course_groups:
+                    block_data[group_value] += current.get(group_value, 0)
+            except IndexError:
+                pass
+
+            group_report_data.insert(block_group_index, block_data)
+
+    return group_report_data
+
+
+def build_course_data(total_users, total_units, total_groups, seed):
+    """
+    Return the synthetic time spent data of one course.
+
+    Some users have fewer blocks and no team, as the learners that have not visited every unit,
+    so the group report data also covers the groups without some blocks.
+    """
+    payload = time_spent_per_user_report(users=total_users, units=total_units, groups=total_groups, seed=seed)
+    course_data = next(iter(payload['result'].values()))
+    random_generator = random.Random(seed)
+
+    for user_data in course_data[::7]:
+        user_data['blocks'] = user_data['blocks'][:random_generator.randrange(len(user_data['blocks']) + 1)]
+
+    for user_data in course_data[::11]:
+        user_data.pop('user_teams')
+
+    return course_data
+
+
+def run_benchmark(total_users, total_units, total_groups, seed):
+    """
+    Time the three walks of the course data and the one-pass build over the same course.
+
+    Returns:
+        Dict containing the timings in seconds.
+    """
+    course_data = build_course_data(total_users, total_units, total_groups, seed)
+
+    start = perf_counter()
+    expected = (
+        build_time_spent_report_data(course_data),
+        grouping_report_data_by_key(course_data, 'user_teams'),
+        grouping_report_data_by_key(course_data, 'user_cohort'),
+    )
+    three_walks_seconds = perf_counter() - start
+
+    start = perf_counter()
+    views = build_time_spent_views(course_data)
+    one_pass_seconds = perf_counter() - start
+
+    if views != expected:
+        raise AssertionError('The one-pass build does not match the three walks of the course data.')
+
+    return {
+        'users': total_users,
+        'units': total_units,
+        'groups': total_groups,
+        'three_walks_seconds': round(three_walks_seconds, 4),
+        'one_pass_seconds': round(one_pass_seconds, 4),
+        'speedup': round(three_walks_seconds / one_pass_seconds, 2) if one_pass_seconds else None,
+    }
+
+
+def main():
+    """
+    Run the benchmark and print the results as json.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--units', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(json.dumps(run_benchmark(args.users, args.units, args.groups, args.seed), indent=4))
+
+
+if __name__ == '__main__':
+    main()
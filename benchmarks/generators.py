@@ -0,0 +1,296 @@
+"""
+Seeded synthetic generators of the LMS report payloads consumed by every report backend.
+
+All the generators receive the same parameters, so the same benchmark size can be used for
+every report:
+    courses: Number of courses.
+    users: Number of learners per course.
+    units: Number of course units (verticals) per course.
+    groups: Number of cohorts and teams per course.
+    pages: Number of result pages (only used by the paginated API v1 reports).
+    seed: Random seed, the same seed always produces the same payload.
+"""
+from datetime import datetime, timedelta
+import random
+
+ACTIVITY_NAMES = ['Video', 'Multiple Choice', 'Image Explorer', 'Free Text Response', 'Drag and Drop']
+BASE_DATE = datetime(2019, 1, 1)
+
+
+def course_ids(courses):
+    """
+    Return the synthetic course ids.
+    """
+    return ['course-v1:Proversity+BENCH{}+2019'.format(course_number) for course_number in range(courses)]
+
+
+def course_structure(random_generator, units):
+    """
+    Return a list of units with their section and subsection data.
+    """
+    structure = []
+    units_per_subsection = 4
+    subsections_per_section = 3
+
+    for unit_number in range(units):
+        subsection_number = unit_number // units_per_subsection
+        section_number = subsection_number // subsections_per_section
+
+        structure.append({
+            'chapter_position': section_number + 1,
+            'chapter_name': 'Section {}'.format(section_number + 1),
+            'sequential_position': subsection_number + 1,
+            'sequential_name': 'Subsection {}'.format(subsection_number + 1),
+            'vertical_position': unit_number + 1,
+            'vertical_name': 'Unit {}'.format(random_generator.randint(1, max(units // 2, 1))),
+            'vertical_id': 'block-v1:Proversity+BENCH+2019+type@vertical+block@{:032x}'.format(
+                random_generator.getrandbits(128),
+            ),
+        })
+
+    return structure
+
+
+def random_date(random_generator, days=365):
+    """
+    Return a date string in the LMS format.
+    """
+    date = BASE_DATE + timedelta(seconds=random_generator.randint(0, days * 24 * 3600))
+
+    return date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def completion_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the completion report.
+    """
+    random_generator = random.Random(seed)
+    result = {}
+
+    for course_id in course_ids(courses):
+        structure = course_structure(random_generator, units)
+        course_data = []
+
+        for user_number in range(users):
+            course_data.append({
+                'username': 'user{}'.format(user_number),
+                'user_id': user_number,
+                'cohort': 'Cohort {}'.format(random_generator.randrange(groups)),
+                'team': 'Team {}'.format(random_generator.randrange(groups)),
+                'vertical': [
+                    {
+                        'section_number': unit['chapter_position'],
+                        'section_name': unit['chapter_name'],
+                        'subsection_number': unit['sequential_position'],
+                        'subsection_name': unit['sequential_name'],
+                        'number': unit['vertical_position'],
+                        'name': unit['vertical_name'],
+                        'complete': random_generator.random() < 0.6,
+                    }
+                    for unit in structure
+                ],
+            })
+
+        result[course_id] = course_data
+
+    return {'result': result}
+
+
+def time_spent_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the time spent report, the users value is used as the number of analytics rows per unit.
+    """
+    random_generator = random.Random(seed)
+    time_spent_data = {}
+
+    for course_id in course_ids(courses):
+        structure = course_structure(random_generator, units)
+        analytics_data = []
+
+        for unit in structure:
+            for _ in range(max(users // max(units, 1), 1)):
+                analytics_data.append({
+                    'page_path': '/courses/{}/jump_to/{}'.format(course_id, unit['vertical_id']),
+                    'page_views': str(random_generator.randint(1, 50)),
+                    'avg_time_on_page': str(random_generator.uniform(5, 600)),
+                })
+
+        time_spent_data[course_id] = {
+            'analytics_data': analytics_data,
+            'course_structure': structure,
+        }
+
+    return {'result': {'time_spent_data': time_spent_data}}
+
+
+def time_spent_per_user_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the time spent per user report.
+    """
+    random_generator = random.Random(seed)
+    result = {}
+
+    for course_id in course_ids(courses):
+        structure = course_structure(random_generator, units)
+        course_data = []
+
+        for user_number in range(users):
+            blocks = []
+
+            for unit in structure:
+                block = dict(unit)
+                block['average_time_spent'] = round(random_generator.uniform(0, 900), 2)
+                blocks.append(block)
+
+            course_data.append({
+                'username': 'user{}'.format(user_number),
+                'user_cohort': 'Cohort {}'.format(random_generator.randrange(groups)),
+                'user_teams': 'Team {}'.format(random_generator.randrange(groups)),
+                'blocks': blocks,
+            })
+
+        result[course_id] = course_data
+
+    return {'result': result}
+
+
+def enrollment_per_site_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the enrollment per site report, a list of API v1 pages.
+    """
+    random_generator = random.Random(seed)
+    report_pages = []
+    users_per_page = max(users // max(pages, 1), 1)
+
+    for course_id in course_ids(courses):
+        for page_number in range(pages):
+            enrollment_data = []
+
+            for user_number in range(users_per_page):
+                enrollment_data.append({
+                    'username': 'user{}-{}'.format(page_number, user_number),
+                    'email': 'user{}-{}@example.com'.format(page_number, user_number),
+                    'role': 'student',
+                    'date_of_registration': random_date(random_generator),
+                    'date_of_enrollment': random_date(random_generator),
+                    'date_of_first_access_to_course': random_date(random_generator),
+                    'time_spent': random_generator.randint(0, 100000),
+                })
+
+            report_pages.append({
+                'status': 'SUCCESS',
+                'result': {
+                    'course': course_id,
+                    'registered_users': users,
+                    'data': enrollment_data,
+                },
+            })
+
+    return report_pages
+
+
+def last_page_accessed_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the last page accessed report.
+    """
+    random_generator = random.Random(seed)
+    last_page_data = {}
+    exit_count_data = {}
+
+    for course_id in course_ids(courses):
+        structure = course_structure(random_generator, units)
+        last_page_data[course_id] = [
+            {
+                'username': 'user{}'.format(user_number),
+                'user_cohort': 'Cohort {}'.format(random_generator.randrange(groups)),
+                'user_teams': 'Team {}'.format(random_generator.randrange(groups)),
+                'last_time_accessed': random_date(random_generator),
+                'last_page_viewed': random_generator.choice(structure)['vertical_name'],
+            }
+            for user_number in range(users)
+        ]
+        exit_count_data[course_id] = [
+            {
+                'page_title': unit['vertical_name'],
+                'exit_count': random_generator.randint(0, users),
+                'vertical_position': unit['vertical_position'],
+                'chapter_name': unit['chapter_name'],
+            }
+            for unit in structure
+        ]
+
+    return {'result': {'last_page_data': last_page_data, 'exit_count_data': exit_count_data}}
+
+
+def activity_completion_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the activity completion report, the units value is used as the number of required activities.
+    """
+    random_generator = random.Random(seed)
+    result = {}
+
+    for course_id in course_ids(courses):
+        activity_names = [random_generator.choice(ACTIVITY_NAMES) for _ in range(units)]
+        course_data = []
+
+        for user_number in range(users):
+            user_data = {
+                'email': 'user{}@example.com'.format(user_number),
+                'first_name': 'First{}'.format(user_number),
+                'last_name': 'Last{}'.format(user_number),
+                'student_enrollment_id': user_number,
+                'course_is_complete': random_generator.random() < 0.3,
+                'total_activities': units,
+            }
+
+            for activity_number, activity_name in enumerate(activity_names, 1):
+                user_data['required_activity_{}'.format(activity_number)] = random_generator.choice(
+                    ['completed', 'not_completed'],
+                )
+                user_data['required_activity_{}_name'.format(activity_number)] = activity_name
+
+            course_data.append(user_data)
+
+        result[course_id] = course_data
+
+    return {'result': result}
+
+
+def video_completion_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):
+    """
+    Payload of the video completion report, same shape of the activity completion report.
+    """
+    return activity_completion_report(courses, users, units, groups, pages, seed)
+
+
+def last_login_report(courses=1, users=100, units=20, groups=4, pages=1, seed=0):  # pylint: disable=unused-argument
+    """
+    Payload of the last login report.
+    """
+    random_generator = random.Random(seed)
+    result = {}
+
+    for course_id in course_ids(courses):
+        result[course_id] = [
+            {
+                'username': 'user{}'.format(user_number),
+                'email': 'user{}@example.com'.format(user_number),
+                'last_login_date': random_date(random_generator),
+                'date_of_registration': random_date(random_generator),
+            }
+            for user_number in range(users)
+        ]
+
+    return {'result': result}
+
+
+GENERATORS = {
+    'completion_report': completion_report,
+    'time_spent_report': time_spent_report,
+    'time_spent_per_user_report': time_spent_per_user_report,
+    'enrollment_per_site_report': enrollment_per_site_report,
+    'last_page_accessed': last_page_accessed_report,
+    'activity_completion_report': activity_completion_report,
+    'video_completion_report': video_completion_report,
+    'last_login_report': last_login_report,
+}
@@ -0,0 +1,125 @@
+"""
+Import time budget of the fetch_report.py startup.
+
+It imports fetch_report and every report backend module in a new interpreter with
+python -X importtime, and fails when the total import time exceeds the budget or when
+one of the heavy SDKs (boto3, googleapiclient...) is imported before it's used.
+The best of several runs is taken, so a busy machine does not fail the check.
+
+Usage:
+    python -m benchmarks.import_time --budget-ms 250
+"""
+from argparse import ArgumentParser
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.run_benchmarks import BACKENDS
+
+ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+STARTUP_MODULES = ['fetch_report'] + sorted({backend.split(':')[0] for backend in BACKENDS.values()}) + [
+    'proversity_reports_script.sinks.s3',
+    'proversity_reports_script.sinks.google_sheets',
+]
+LAZY_MODULES = (
+    'boto3',
+    'botocore',
+    'googleapiclient',
+    'google.auth',
+    'google.oauth2',
+    'google_auth_oauthlib',
+    'pyarrow',
+)
+
+
+def measure_import_time():
+    """
+    Import the startup modules in a new interpreter.
+
+    Returns:
+        total_ms: Total import time in milliseconds, python startup modules excluded.
+        slowest_modules: List of the (cumulative ms, module name) of the slowest imports.
+        loaded_lazy_modules: List of the LAZY_MODULES that were imported.
+
+    Exits with status 1, printing the error of the interpreter, when the modules cannot be imported.
+    """
+    import_statement = ';'.join('import {}'.format(module) for module in STARTUP_MODULES)
+    check_statement = 'import json, sys; print(json.dumps([m for m in {} if m in sys.modules]))'.format(
+        list(LAZY_MODULES),
+    )
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', '{};{}'.format(import_statement, check_statement)],
+        cwd=ROOT_PATH,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    if process.returncode != 0:
+        print('The startup modules cannot be imported:')
+        # The import time lines are left out, so only the traceback is printed.
+        print('\n'.join(line for line in process.stderr.splitlines() if not line.startswith('import time:')))
+        sys.exit(1)
+
+    startup_imports = []
+    pending_imports = []
+
+    # The imports are logged after their nested imports, the nested ones are kept until the top level
+    # import is found, so the interpreter startup imports (site, encodings...) are left out.
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        _, cumulative, module_name = line[len('import time:'):].split('|')
+        pending_imports.append((int(cumulative) / 1000.0, module_name.strip(), module_name.startswith('  ')))
+
+        if module_name.startswith('  '):
+            continue
+
+        if module_name.strip() in STARTUP_MODULES:
+            startup_imports.extend(pending_imports)
+
+        pending_imports = []
+
+    total_ms = sum(cumulative_ms for cumulative_ms, _, nested in startup_imports if not nested)
+    slowest_modules = sorted(
+        [(cumulative_ms, module_name) for cumulative_ms, module_name, _ in startup_imports],
+        reverse=True,
+    )
+
+    return total_ms, slowest_modules[:10], json.loads(process.stdout.splitlines()[-1])
+
+
+def main():
+    """
+    Check the import time budget, exits with status 1 when it's exceeded.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--budget-ms', type=float, default=250, help='Maximum total import time.')
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs, the best one is checked.')
+    args = parser.parse_args()
+
+    results = [measure_import_time() for _ in range(args.runs)]
+    total_ms, slowest_modules, loaded_lazy_modules = min(results, key=lambda result: result[0])
+
+    print('Import time: {:.1f} ms (budget {:.1f} ms)'.format(total_ms, args.budget_ms))
+
+    for cumulative_ms, module_name in slowest_modules:
+        print('    {:8.1f} ms  {}'.format(cumulative_ms, module_name))
+
+    failed = False
+
+    if loaded_lazy_modules:
+        print('These modules must be imported lazily: {}'.format(', '.join(loaded_lazy_modules)))
+        failed = True
+
+    if total_ms > args.budget_ms:
+        print('The import time budget was exceeded.')
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
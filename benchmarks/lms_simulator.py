@@ -0,0 +1,369 @@
+"""
+Local stand-in of the LMS proversity reports API.
+
+It serves the generate-*-report and get-report-data?task_id= endpoints of the API v0 and v1,
+with configurable task latency, task workers, task failures, paging, payload size, 5xx/504 errors and
+rate limiting. The report payloads come from benchmarks.generators.
+
+Usage:
+    python -m benchmarks.lms_simulator --port 8000 --report completion_report --task-latency 3
+"""
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import heapq
+import json
+import random
+import threading
+from time import monotonic
+from urllib.parse import parse_qs, urlparse
+import uuid
+
+from benchmarks.generators import GENERATORS, course_ids as synthetic_course_ids
+
+
+class LMSSimulator(object):
+    """
+    Report API simulator running a threaded HTTP server.
+    """
+
+    def __init__(self, report_name, host='127.0.0.1', port=0, **kwargs):
+        """
+        Args:
+            report_name: Key of benchmarks.generators.GENERATORS used to build the payloads.
+            host: Host to bind.
+            port: Port to bind, 0 picks a free port.
+        Keyword args:
+            task_latency: Seconds before a task leaves the PENDING state.
+            task_failure_rate: Probability of a task ending with FAILURE.
+            error_rate: Probability of answering any request with a 500, 502 or 503 status.
+            gateway_timeout_rate: Probability of answering any request with a 504 status.
+            rate_limit: Maximum requests per second, the rest get a 429 status. 0 disables it.
+            max_generation_courses: Generation requests with more courses get a 504 status. 0 disables it.
+            task_workers: Number of LMS workers running the tasks in their creation order,
+                          0 runs every task from its creation.
+            course_skew: The task latency and the users of every course are multiplied by a weight
+                         between 1 and course_skew, fixed per course id. 1 disables it.
+            pages_per_course: Number of pages per course of the API v1.
+            users: Number of users per page (API v1) or per course (API v0).
+            units: Number of units per course.
+            groups: Number of cohorts and teams per course.
+            seed: Random seed.
+        """
+        self.report_name = report_name
+        self.task_latency = kwargs.get('task_latency', 0)
+        self.task_failure_rate = kwargs.get('task_failure_rate', 0)
+        self.error_rate = kwargs.get('error_rate', 0)
+        self.gateway_timeout_rate = kwargs.get('gateway_timeout_rate', 0)
+        self.rate_limit = kwargs.get('rate_limit', 0)
+        self.max_generation_courses = kwargs.get('max_generation_courses', 0)
+        self.course_skew = max(kwargs.get('course_skew', 1), 1)
+        self.task_workers = [0.0] * kwargs.get('task_workers', 0)
+        self.pages_per_course = kwargs.get('pages_per_course', 1)
+        self.payload_size = {
+            'users': kwargs.get('users', 100),
+            'units': kwargs.get('units', 20),
+            'groups': kwargs.get('groups', 4),
+        }
+        self.random_generator = random.Random(kwargs.get('seed', 0))
+        self.tasks = {}
+        self.stats = {
+            'requests': 0,
+            'bytes_sent': 0,
+            'bytes_received': 0,
+            'status_codes': {},
+        }
+        self.lock = threading.Lock()
+        self.rate_limit_tokens = float(self.rate_limit)
+        self.rate_limit_updated_at = monotonic()
+        self.server = ThreadingHTTPServer((host, port), self.get_handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """
+        Return the base url of the simulator, it's the LMS_URL value of the configuration.
+        """
+        host, port = self.server.server_address[:2]
+
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """
+        Start serving in a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_handler_class(self):
+        """
+        Return the request handler class bound to this simulator.
+        """
+        simulator = self
+
+        class SimulatorRequestHandler(BaseHTTPRequestHandler):
+            """
+            Request handler of the simulator.
+            """
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """
+                Handle the report generation requests.
+                """
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                simulator.handle(self, body)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """
+                Handle the report data requests.
+                """
+                simulator.handle(self, b'')
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                """
+                Silence the request log.
+                """
+                pass
+
+        return SimulatorRequestHandler
+
+    def handle(self, request_handler, body):
+        """
+        Route the request and send the response.
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['bytes_received'] += len(body)
+
+        status_code, response_data = self.get_injected_error()
+
+        if not status_code:
+            parsed_url = urlparse(request_handler.path)
+
+            if request_handler.command == 'POST' and 'generate-' in parsed_url.path:
+                status_code, response_data = self.generate_report(parsed_url.path, body)
+            elif request_handler.command == 'GET' and parsed_url.path.endswith('get-report-data'):
+                status_code, response_data = self.get_report_data(
+                    parse_qs(parsed_url.query).get('task_id', [''])[0],
+                )
+            else:
+                status_code, response_data = 404, {'detail': 'Not found.'}
+
+        response_body = json.dumps(response_data).encode('utf-8')
+
+        with self.lock:
+            self.stats['bytes_sent'] += len(response_body)
+            self.stats['status_codes'][status_code] = self.stats['status_codes'].get(status_code, 0) + 1
+
+        request_handler.send_response(status_code)
+        request_handler.send_header('Content-Type', 'application/json')
+        request_handler.send_header('Content-Length', str(len(response_body)))
+        request_handler.end_headers()
+        request_handler.wfile.write(response_body)
+
+    def get_injected_error(self):
+        """
+        Return the rate limit or the random error response of the request, if any.
+        """
+        with self.lock:
+            if self.rate_limit:
+                now = monotonic()
+                self.rate_limit_tokens = min(
+                    float(self.rate_limit),
+                    self.rate_limit_tokens + (now - self.rate_limit_updated_at) * self.rate_limit,
+                )
+                self.rate_limit_updated_at = now
+
+                if self.rate_limit_tokens < 1:
+                    return 429, {'detail': 'Request was throttled.'}
+
+                self.rate_limit_tokens -= 1
+
+            error_draw = self.random_generator.random()
+
+        if error_draw < self.gateway_timeout_rate:
+            return 504, {'detail': 'Gateway Time-out'}
+
+        if error_draw < self.gateway_timeout_rate + self.error_rate:
+            return self.random_generator.choice([500, 502, 503]), {'detail': 'Server error.'}
+
+        return None, None
+
+    def generate_report(self, path, body):
+        """
+        Create the report tasks, one task for API v0 and one task per page and course for API v1.
+        """
+        try:
+            request_data = json.loads(body.decode('utf-8') or '{}')
+        except ValueError:
+            return 400, {'detail': 'Invalid json body.'}
+
+        course_ids = request_data.get('course_ids', [])
+
+        if self.max_generation_courses and len(course_ids) > self.max_generation_courses:
+            return 504, {'detail': 'Gateway Time-out'}
+
+        api_prefix = path[:path.index('/generate-')]
+
+        if '/v0/' in path or path.endswith('/v0'):
+            task_id = self.create_task(course_ids, page=None)
+
+            return 202, {
+                'message': 'The task with id = {} has been initialize.'.format(task_id),
+                'state_url': '{}{}/get-report-data?task_id={}'.format(self.base_url, api_prefix, task_id),
+                'success': True,
+            }
+
+        report_urls = {}
+
+        for course_id in course_ids:
+            report_urls[course_id] = [
+                '{}{}/get-report-data?task_id={}'.format(
+                    self.base_url,
+                    api_prefix,
+                    self.create_task([course_id], page=page),
+                )
+                for page in range(self.pages_per_course)
+            ]
+
+        return 202, {'data': report_urls}
+
+    def create_task(self, course_ids, page):
+        """
+        Register a new task and return its id.
+        """
+        task_id = uuid.uuid4().hex
+        weight = max(self.get_course_weight(course_id) for course_id in course_ids) if course_ids else 1
+
+        with self.lock:
+            started_at = monotonic()
+
+            if self.task_workers:
+                # The task waits for the first free worker.
+                started_at = max(started_at, heapq.heappop(self.task_workers))
+                heapq.heappush(self.task_workers, started_at + self.task_latency * weight)
+
+            self.tasks[task_id] = {
+                'course_ids': course_ids,
+                'page': page,
+                'finished_at': started_at + self.task_latency * weight,
+                'fails': self.random_generator.random() < self.task_failure_rate,
+                'seed': self.random_generator.randint(0, 2 ** 31),
+                'weight': weight,
+            }
+
+        return task_id
+
+    def get_course_weight(self, course_id):
+        """
+        Return the size weight of the course, the same one for every run.
+        """
+        return 1 + (self.course_skew - 1) * random.Random(course_id).random()
+
+    def get_report_data(self, task_id):
+        """
+        Return the task state, and the report data when the task is done.
+        """
+        task = self.tasks.get(task_id)
+
+        if not task:
+            return 404, {'detail': 'Task not found.'}
+
+        if monotonic() < task['finished_at']:
+            return 200, {'status': 'PENDING'}
+
+        if task['fails']:
+            return 200, {'status': 'FAILURE'}
+
+        return 200, self.build_payload(task)
+
+    def build_payload(self, task):
+        """
+        Return the report data of the task for the requested course ids.
+        """
+        payload = GENERATORS[self.report_name](
+            courses=len(task['course_ids']),
+            pages=1,
+            seed=task['seed'],
+            users=int(self.payload_size['users'] * task['weight']),
+            units=self.payload_size['units'],
+            groups=self.payload_size['groups'],
+        )
+        # The generators use synthetic course ids, replace them with the requested ones.
+        payload_string = json.dumps(payload)
+
+        for synthetic_course_id, course_id in zip(synthetic_course_ids(len(task['course_ids'])), task['course_ids']):
+            payload_string = payload_string.replace(json.dumps(synthetic_course_id), json.dumps(course_id))
+
+        payload = json.loads(payload_string)
+
+        if isinstance(payload, list):
+            # Paginated reports return one page per task.
+            return payload[0] if payload else {'status': 'SUCCESS', 'result': {}}
+
+        payload['status'] = 'SUCCESS'
+
+        return payload
+
+
+def main():
+    """
+    Run the simulator until it's interrupted.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--report', required=True, choices=sorted(GENERATORS))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--task-latency', type=float, default=0)
+    parser.add_argument('--task-failure-rate', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--gateway-timeout-rate', type=float, default=0)
+    parser.add_argument('--rate-limit', type=float, default=0)
+    parser.add_argument('--max-generation-courses', type=int, default=0)
+    parser.add_argument('--task-workers', type=int, default=0)
+    parser.add_argument('--course-skew', type=float, default=1)
+    parser.add_argument('--pages-per-course', type=int, default=1)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--units', type=int, default=20)
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    simulator = LMSSimulator(
+        args.report,
+        host=args.host,
+        port=args.port,
+        task_latency=args.task_latency,
+        task_failure_rate=args.task_failure_rate,
+        error_rate=args.error_rate,
+        gateway_timeout_rate=args.gateway_timeout_rate,
+        rate_limit=args.rate_limit,
+        max_generation_courses=args.max_generation_courses,
+        task_workers=args.task_workers,
+        course_skew=args.course_skew,
+        pages_per_course=args.pages_per_course,
+        users=args.users,
+        units=args.units,
+        groups=args.groups,
+        seed=args.seed,
+    )
+
+    print('LMS simulator listening on {}'.format(simulator.base_url))
+
+    try:
+        simulator.server.serve_forever()
+    except KeyboardInterrupt:
+        simulator.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
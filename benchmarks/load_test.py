@@ -0,0 +1,175 @@
+"""
+Load test of the report fetch pipeline against the local LMS simulator.
+
+It runs the generation and polling stages of FetchReportData (the report backend is not run)
+and reports the wall time, the number of requests and the transferred bytes.
+
+Usage:
+    python -m benchmarks.load_test --report completion_report --api-version v1 --courses 20 --pages-per-course 3
+"""
+from argparse import ArgumentParser, Namespace
+import json
+import os
+import tempfile
+from time import perf_counter
+
+from benchmarks.generators import course_ids as synthetic_course_ids
+from benchmarks.lms_simulator import LMSSimulator
+from benchmarks.run_benchmarks import BACKENDS
+from proversity_reports_script.request_module import ReportRequestError
+from proversity_reports_script.request_report import FetchReportData
+
+
+def write_configuration_file(report_name, api_version, lms_url, courses, extra_settings=None):
+    """
+    Write a configuration file pointing to the simulator and return its path.
+    """
+    settings = {
+        'LMS_URL': lms_url,
+        'OPEN_EDX_OAUTH_TOKEN': 'load-test-token',
+        'AWS_ACCESS_KEY_ID': '',
+        'AWS_SECRET_ACCESS_KEY': '',
+        'SUPPORTED_REPORTS': [report_name],
+        'COURSES': courses,
+        report_name.upper(): {
+            'REPORT_URL': '/proversity-reports/api/{}/generate-{}'.format(
+                api_version,
+                report_name.replace('_', '-'),
+            ),
+            'BACKEND_REPORT': BACKENDS[report_name],
+        },
+    }
+
+    for key, value in (extra_settings or {}).items():
+        if isinstance(value, dict) and isinstance(settings.get(key), dict):
+            settings[key].update(value)
+        else:
+            settings[key] = value
+
+    file_descriptor, configuration_file_path = tempfile.mkstemp(prefix='load-test-', suffix='.json')
+
+    with os.fdopen(file_descriptor, 'w') as configuration_file:
+        json.dump(settings, configuration_file)
+
+    return configuration_file_path
+
+
+def run_load_test(report_name, api_version, courses, simulator_options, extra_settings=None):
+    """
+    Run the fetch stages of the pipeline against a new simulator.
+
+    Returns:
+        Dict containing the load test results.
+    """
+    simulator = LMSSimulator(report_name, **simulator_options).start()
+    configuration_file_path = write_configuration_file(
+        report_name,
+        api_version,
+        simulator.base_url,
+        synthetic_course_ids(courses),
+        extra_settings,
+    )
+    os.environ['CONFIGURATION_FILE_PATH'] = configuration_file_path
+    report_data = None
+    fetch_report_data = None
+    aborted = False
+    start = perf_counter()
+
+    try:
+        fetch_report_data = FetchReportData(
+            report_name=report_name,
+            extra_arguments=Namespace(),
+            api_version=api_version,
+        )
+        report_data = fetch_report_data.get_report_data(
+            report_generation_request_response=fetch_report_data.get_report_generation_data(),
+            request_headers=fetch_report_data.get_request_headers(),
+        )
+    except (SystemExit, ReportRequestError):
+        aborted = True
+    finally:
+        wall_time = perf_counter() - start
+        simulator.stop()
+        os.remove(configuration_file_path)
+
+    if isinstance(report_data, list):
+        pages = len(report_data)
+        failed_pages = len([page for page in report_data if not page])
+    else:
+        pages = 1 if report_data is not None else 0
+        failed_pages = 0 if report_data else pages
+
+    return {
+        'report': report_name,
+        'api_version': api_version,
+        'courses': courses,
+        'simulator': simulator_options,
+        'aborted': aborted,
+        'wall_time_seconds': round(wall_time, 3),
+        'requests': simulator.stats['requests'],
+        'bytes_sent_by_lms': simulator.stats['bytes_sent'],
+        'bytes_received_by_lms': simulator.stats['bytes_received'],
+        'status_codes': simulator.stats['status_codes'],
+        'pages': pages,
+        'failed_pages': failed_pages,
+        'failed_courses': sorted(fetch_report_data.failed_courses) if fetch_report_data else [],
+    }
+
+
+def main():
+    """
+    Run the load test and print the results as json.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--report', default='completion_report', choices=sorted(BACKENDS))
+    parser.add_argument('--api-version', default='v1', choices=['v0', 'v1'])
+    parser.add_argument('--courses', type=int, default=10)
+    parser.add_argument('--task-latency', type=float, default=0)
+    parser.add_argument('--task-failure-rate', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--gateway-timeout-rate', type=float, default=0)
+    parser.add_argument('--rate-limit', type=float, default=0)
+    parser.add_argument('--max-generation-courses', type=int, default=0)
+    parser.add_argument('--task-workers', type=int, default=0)
+    parser.add_argument('--course-skew', type=float, default=1)
+    parser.add_argument('--pages-per-course', type=int, default=1)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--units', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--settings',
+        help='Json string with additional configuration settings, e.g. the report EXTRA_DATA.',
+    )
+    parser.add_argument('--output', help='File to write the results json.')
+    args = parser.parse_args()
+
+    results = run_load_test(
+        args.report,
+        args.api_version,
+        args.courses,
+        {
+            'task_latency': args.task_latency,
+            'task_failure_rate': args.task_failure_rate,
+            'error_rate': args.error_rate,
+            'gateway_timeout_rate': args.gateway_timeout_rate,
+            'rate_limit': args.rate_limit,
+            'max_generation_courses': args.max_generation_courses,
+            'task_workers': args.task_workers,
+            'course_skew': args.course_skew,
+            'pages_per_course': args.pages_per_course,
+            'users': args.users,
+            'units': args.units,
+            'seed': args.seed,
+        },
+        json.loads(args.settings) if args.settings else None,
+    )
+
+    print(json.dumps(results, indent=4))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+End-to-end benchmarks of the report backends.
+
+Every benchmark case runs generate_report of one backend over a synthetic payload from
+benchmarks.generators, with S3 and Google Sheets replaced by the fake sinks. Each case runs in its own
+process, so the recorded peak RSS belongs to that case only.
+
+Usage:
+    python -m benchmarks.run_benchmarks --users 5000 --units 50 --output bench.json
+    python -m benchmarks.run_benchmarks --case completion_report --compare bench.json
+    python -m benchmarks.run_benchmarks --courses 20 --spreadsheet-layout shared
+"""
+from argparse import SUPPRESS, ArgumentParser
+from datetime import datetime
+from importlib import import_module
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmarks.generators import GENERATORS
+
+BACKENDS = {
+    'completion_report': 'proversity_reports_script.report_backend.completion_report:CompletionReportBackend',
+    'time_spent_report': 'proversity_reports_script.report_backend.time_spent_report:TimeSpentReportBackend',
+    'time_spent_per_user_report': (
+        'proversity_reports_script.report_backend.time_spent_per_user_report:TimeSpentPerUserReportBackend'
+    ),
+    'enrollment_per_site_report': (
+        'proversity_reports_script.report_backend.enrollment_per_site_report:EnrollmentPerSiteReport'
+    ),
+    'last_page_accessed': 'proversity_reports_script.report_backend.last_page_accessed:LastPageAccessedReportBackend',
+    'activity_completion_report': (
+        'proversity_reports_script.report_backend.activity_completion_report:ActivityCompletionReportBackend'
+    ),
+    'video_completion_report': (
+        'proversity_reports_script.report_backend.video_completion_report:VideoCompletionReportBackend'
+    ),
+    'last_login_report': 'proversity_reports_script.report_backend.last_login_report:LastLoginReportBackend',
+}
+SIZE_PARAMETERS = ('courses', 'users', 'units', 'groups', 'pages', 'seed')
+
+
+SPREADSHEET_LAYOUTS = ('per-course', 'shared')
+
+
+def get_course_ids(case_name, payload):
+    """
+    Return the course ids of the payload.
+    """
+    if case_name == 'enrollment_per_site_report':
+        return []
+
+    result = payload['result']
+
+    if case_name == 'time_spent_report':
+        return list(result['time_spent_data'])
+
+    if case_name == 'last_page_accessed':
+        return list(result['last_page_data'])
+
+    return list(result)
+
+
+def get_spreadsheet_data(backend_class, course_ids, spreadsheet_layout):
+    """
+    Return the SPREADSHEET_DATA of the backend, so every report file is written to the fake sheets sink.
+
+    Args:
+        backend_class: Report backend class, its spreadsheet_keys are routed.
+        course_ids: Course ids of the payload.
+        spreadsheet_layout: 'per-course' for a spreadsheet per course, or 'shared' for one spreadsheet
+                            per spreadsheet key with a tab per course.
+    """
+    spreadsheet_data = {}
+
+    for spreadsheet_key in backend_class.spreadsheet_keys:
+        if spreadsheet_layout == 'shared' or not course_ids:
+            spreadsheet_data[spreadsheet_key] = 'benchmark-{}'.format(spreadsheet_key)
+        else:
+            spreadsheet_data[spreadsheet_key] = {
+                course_id: 'benchmark-{}-{}'.format(spreadsheet_key, position)
+                for position, course_id in enumerate(course_ids)
+            }
+
+    return spreadsheet_data
+
+
+def count_rows(case_name, payload):
+    """
+    Return the number of learner rows in the payload.
+    """
+    if case_name == 'enrollment_per_site_report':
+        return sum(len(page['result']['data']) for page in payload)
+
+    result = payload['result']
+
+    if case_name == 'time_spent_report':
+        return sum(len(course['analytics_data']) for course in result['time_spent_data'].values())
+
+    if case_name == 'last_page_accessed':
+        return sum(len(course_data) for course_data in result['last_page_data'].values())
+
+    return sum(len(course_data) for course_data in result.values())
+
+
+def peak_rss_mb():
+    """
+    Return the peak RSS of this process and its finished children in MB.
+    """
+    self_usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in kilobytes on Linux.
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+    return round(max(self_usage, children_usage) / float(divisor), 2)
+
+
+def run_case(
+    case_name,
+    size,
+    max_workers=1,
+    storage_latency=0,
+    sheets_latency=0,
+    spreadsheet_layout=SPREADSHEET_LAYOUTS[0],
+):
+    """
+    Generate the payload of the case and time the backend generate_report call.
+
+    Args:
+        case_name: Key of BACKENDS.
+        size: Dict with the generator size parameters.
+        max_workers: MAX_WORKERS value of the backend.
+        storage_latency: Seconds per request of the fake storage sink.
+        sheets_latency: Seconds per request of the fake sheets sink.
+        spreadsheet_layout: One of SPREADSHEET_LAYOUTS, see get_spreadsheet_data.
+    Returns:
+        Dict containing the case results.
+    """
+    payload = GENERATORS[case_name](**size)
+    payload_rss = peak_rss_mb()
+    module_name, class_name = BACKENDS[case_name].split(':')
+    backend_class = getattr(import_module(module_name), class_name)
+    backend = backend_class(extra_data={
+        'SPREADSHEET_DATA': get_spreadsheet_data(
+            backend_class,
+            get_course_ids(case_name, payload),
+            spreadsheet_layout,
+        ),
+        'MAX_WORKERS': max_workers,
+        'STORAGE_SINK': 'proversity_reports_script.sinks.fake:FakeStorageSink',
+        'STORAGE_SINK_OPTIONS': {'latency': storage_latency, 'keep_contents': False},
+        'SHEETS_SINK': 'proversity_reports_script.sinks.fake:FakeSheetsSink',
+        'SHEETS_SINK_OPTIONS': {'latency': sheets_latency, 'keep_values': False},
+    })
+
+    start = perf_counter()
+
+    if case_name == 'video_completion_report':
+        # The user list report comes from S3, half of the learners are in the list.
+        user_list_data = frozenset(
+            user_data['email']
+            for course_data in payload['result'].values()
+            for user_data in course_data[::2]
+        )
+        backend.json_report_to_csv(payload, user_list_data=user_list_data)
+    else:
+        backend.generate_report(payload)
+
+    seconds = perf_counter() - start
+    rows = count_rows(case_name, payload)
+
+    return {
+        'case': case_name,
+        'size': size,
+        'max_workers': max_workers,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 2) if seconds else None,
+        'payload_peak_rss_mb': payload_rss,
+        'peak_rss_mb': peak_rss_mb(),
+        'storage_requests': backend.storage_sink.stats['requests'],
+        'storage_bytes': backend.storage_sink.stats['bytes'],
+        'sheets_requests': backend.sheets_sink.stats['requests'],
+        'sheets_bytes': backend.sheets_sink.stats['bytes'],
+    }
+
+
+def run_case_in_subprocess(case_name, args):
+    """
+    Run the case in a new python process and return its results.
+    """
+    file_descriptor, output_path = tempfile.mkstemp(prefix='benchmark-', suffix='.json')
+    os.close(file_descriptor)
+    command = [
+        sys.executable, '-m', 'benchmarks.run_benchmarks',
+        '--case', case_name,
+        '--single-output', output_path,
+        '--max-workers', str(args.max_workers),
+        '--storage-latency', str(args.storage_latency),
+        '--sheets-latency', str(args.sheets_latency),
+        '--spreadsheet-layout', args.spreadsheet_layout,
+    ]
+
+    for parameter in SIZE_PARAMETERS:
+        command.extend(['--{}'.format(parameter), str(getattr(args, parameter))])
+
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+        with open(output_path, 'r') as output_file:
+            return json.load(output_file)
+    finally:
+        os.remove(output_path)
+
+
+def get_git_commit():
+    """
+    Return the current git commit, or an empty string when it's not available.
+    """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare_results(baseline, results, threshold):
+    """
+    Print the time and memory ratios against a previous benchmark file.
+
+    Returns:
+        True if any case is slower or uses more memory than the threshold allows.
+    """
+    baseline_cases = {case['case']: case for case in baseline.get('cases', [])}
+    regression = False
+
+    print('Comparing against commit {}'.format(baseline.get('commit', '') or 'unknown'))
+
+    for case in results['cases']:
+        baseline_case = baseline_cases.get(case['case'])
+
+        if not baseline_case or baseline_case.get('size') != case['size']:
+            print('{:<30} no comparable baseline'.format(case['case']))
+            continue
+
+        time_ratio = case['seconds'] / baseline_case['seconds'] if baseline_case['seconds'] else 0
+        memory_ratio = case['peak_rss_mb'] / baseline_case['peak_rss_mb'] if baseline_case['peak_rss_mb'] else 0
+        case_regression = time_ratio > 1 + threshold or memory_ratio > 1 + threshold
+        regression = regression or case_regression
+
+        print('{:<30} time x{:.2f}  rss x{:.2f}{}'.format(
+            case['case'],
+            time_ratio,
+            memory_ratio,
+            '  REGRESSION' if case_regression else '',
+        ))
+
+    return regression
+
+
+def main():
+    """
+    Run the benchmark cases and write the results as json.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--case', action='append', choices=sorted(BACKENDS), help='Case to run, defaults to all.')
+    parser.add_argument('--courses', type=int, default=1)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--units', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=5)
+    parser.add_argument('--pages', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-workers', type=int, default=1)
+    parser.add_argument('--storage-latency', type=float, default=0, help='Seconds per fake S3 request.')
+    parser.add_argument('--sheets-latency', type=float, default=0, help='Seconds per fake Sheets request.')
+    parser.add_argument(
+        '--spreadsheet-layout',
+        choices=SPREADSHEET_LAYOUTS,
+        default=SPREADSHEET_LAYOUTS[0],
+        help='A spreadsheet per course, or a shared spreadsheet with a tab per course.',
+    )
+    parser.add_argument('--output', help='File to write the results json.')
+    parser.add_argument('--compare', help='Previous results json to compare with.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Allowed slowdown ratio, 0.1 means 10%%.')
+    parser.add_argument('--single-output', help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single_output:
+        size = {parameter: getattr(args, parameter) for parameter in SIZE_PARAMETERS}
+
+        with open(args.single_output, 'w') as output_file:
+            json.dump(
+                run_case(
+                    args.case[0],
+                    size,
+                    args.max_workers,
+                    args.storage_latency,
+                    args.sheets_latency,
+                    args.spreadsheet_layout,
+                ),
+                output_file,
+            )
+
+        return
+
+    results = {
+        'commit': get_git_commit(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': [],
+    }
+
+    for case_name in args.case or sorted(BACKENDS):
+        case_results = run_case_in_subprocess(case_name, args)
+        results['cases'].append(case_results)
+        print('{:<30} {:>10.3f}s {:>12.1f} rows/s {:>9.1f} MB'.format(
+            case_name,
+            case_results['seconds'],
+            case_results['rows_per_second'] or 0,
+            case_results['peak_rss_mb'],
+        ))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if compare_results(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,8 +19,31 @@ def main():
         required=True,
     )
     parser.add_argument('--config-file', '-c', help='Path to configuration file.', required=True)
-    parser.add_argument('--oauth-config-file', help='Path to the Google oAuth configuration file.', required=True)
+    parser.add_argument(
+        '--oauth-config-file',
+        help='Path to the Google oAuth configuration file, not needed with a service account '
+        '(see GOOGLE_SHEETS_CREDENTIALS).',
+    )
     parser.add_argument('--api-version', help='Version of the reports API.', default='v0')
+    parser.add_argument('--metrics-file', help='Path to the json lines file of the pipeline stage metrics.')
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='all',
+        help='Profile the report backend per course: all (default) or a comma separated list of '
+        'cprofile, tracemalloc and sampling. The files are written to result/profile/.',
+    )
+    parser.add_argument('--shard', help='Only run the courses of the shard i of N, in the i/N format, e.g. 2/4.')
+    parser.add_argument(
+        '--work-queue',
+        help='Path to the SQLite work queue file, the processes of the run take the courses from it.',
+    )
+    parser.add_argument('--shard-run', help='Name of the sharded run, the current UTC date by default.')
+    parser.add_argument(
+        '--merge-shards',
+        action='store_true',
+        help='Build a cross-course report from the partial files of the shards of the run.',
+    )
 
     know_arguments, unknown_arguments = parser.parse_known_args()  # pylint: disable=unused-variable
 
@@ -31,7 +54,9 @@ def main():
     args = parser.parse_args()
 
     os.environ['CONFIGURATION_FILE_PATH'] = args.config_file
-    os.environ['OAUTH_CONFIGURATION_FILE'] = args.oauth_config_file
+
+    if args.oauth_config_file:
+        os.environ['OAUTH_CONFIGURATION_FILE'] = args.oauth_config_file
 
     FetchReportData(
         report_name=args.report,
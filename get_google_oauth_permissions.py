@@ -10,18 +10,14 @@ This is a one time operation to give those user permission to the
 provided Google oAuth credentials (client-id and client-secret).
 """
 from argparse import ArgumentParser
-import json
-import os
 
 from google_auth_oauthlib.flow import InstalledAppFlow
 
 from proversity_reports_script.get_settings import get_settings
+from proversity_reports_script.google_apis.credentials import GoogleApiCredentialsError, store_credentials_as_dict
 
 # SCOPE for read, create, delete and update Google Spreadsheets data.
 SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-REQUIRED_CREDENTIALS = [
-    'token', 'refresh_token', 'token_uri', 'client_id', 'client_secret', 'scopes',
-]
 
 
 def main():
@@ -33,9 +29,7 @@ def main():
     parser.add_argument('--config-file', '-c', help='Path to configuration file.', required=True)
     args = parser.parse_args()
 
-    os.environ['CONFIGURATION_FILE_PATH'] = args.config_file
-
-    global_settings = get_settings(should_set_environment_settings=False)
+    global_settings = get_settings(args.config_file)
     google_oauth_credentials = global_settings.get('GOOGLE_OAUTH_CREDENTIALS', None)
 
     if not google_oauth_credentials:
@@ -58,40 +52,5 @@ def main():
         raise error
 
 
-def store_credentials_as_dict(file_name, credentials):
-    """
-    Saves a file containing the dict object as json with the required information.
-
-    Args:
-        file_name: File name to store the credentials.
-        credentials: google.oauth2.credentials.Credentials Object.
-    Raises:
-        GoogleApiCredentialsError: When some of the required fields is missing from the credentials object.
-    """
-    required_data = {}
-
-    for field in REQUIRED_CREDENTIALS:
-        credential_field = getattr(credentials, field, None)
-
-        if not credential_field:
-            error_message = 'Credential field is missing. {}'.format(field)
-            raise GoogleApiCredentialsError(error_message)
-
-        required_data.update({
-            field: credential_field
-        })
-
-    with open(file_name, 'w') as json_file:
-        json.dump(required_data, json_file, sort_keys=True)
-
-
-class GoogleApiCredentialsError(Exception):
-    """
-    Exception class raised when a Google oAuth credentials
-    is missing, empty, or there is other problem related to Google credentials object.
-    """
-    pass
-
-
 if __name__ == '__main__':
     main()
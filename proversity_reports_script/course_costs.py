@@ -0,0 +1,92 @@
+"""
+Local store of the cost of every course, the size in bytes of its report data in the previous runs.
+
+It's used to size the API v1 generation requests and to schedule the most expensive courses
+first, and it's kept per report since the payload of a course depends on the report.
+"""
+import json
+import os
+import tempfile
+
+DEFAULT_COURSE_COST_FILE = os.path.join(os.path.dirname(__file__), 'result', 'course-costs.json')
+
+
+class CourseCostStore(object):
+    """
+    Course costs of one report, stored in a json file.
+    """
+
+    def __init__(self, report_name, file_path=None):
+        """
+        Args:
+            report_name: Name of the report.
+            file_path: Path of the json file, defaults to result/course-costs.json.
+        """
+        self.report_name = report_name
+        self.file_path = file_path or DEFAULT_COURSE_COST_FILE
+        self.costs = self.load().get(report_name, {})
+        self.updated_costs = {}
+
+    def load(self):
+        """
+        Return the costs of every report from the file.
+        """
+        if not os.path.exists(self.file_path):
+            return {}
+
+        with open(self.file_path, 'r') as cost_file:
+            try:
+                return json.load(cost_file)
+            except ValueError:
+                print('The course cost file {} cannot be parsed into json.'.format(self.file_path))
+                return {}
+
+    def get(self, course_id, default=None):
+        """
+        Return the cost of the course, or the default value if it's unknown.
+        """
+        return self.costs.get(course_id, default)
+
+    def get_default_cost(self):
+        """
+        Return the cost used for unknown courses: the average of the known costs, 0 if there are none.
+        """
+        if not self.costs:
+            return 0
+
+        return sum(self.costs.values()) / float(len(self.costs))
+
+    def sort_by_cost(self, course_ids):
+        """
+        Return the course ids sorted by cost, the most expensive first.
+
+        The unknown courses cost the average of the known ones, and the courses with
+        the same cost keep their order.
+        """
+        default_cost = self.get_default_cost()
+
+        return sorted(course_ids, key=lambda course_id: self.get(course_id, default_cost), reverse=True)
+
+    def update(self, course_id, cost):
+        """
+        Set the cost of the course.
+        """
+        self.costs[course_id] = cost
+        self.updated_costs[course_id] = cost
+
+    def save(self):
+        """
+        Write the updated costs into the file, keeping the costs of the other reports and
+        the costs saved by the other processes of a sharded run.
+        """
+        all_costs = self.load()
+        all_costs.setdefault(self.report_name, {}).update(self.updated_costs)
+        file_descriptor, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.file_path)),
+            prefix='.course-costs-',
+        )
+
+        with os.fdopen(file_descriptor, 'w') as cost_file:
+            json.dump(all_costs, cost_file, sort_keys=True)
+
+        os.replace(temporary_path, self.file_path)
@@ -0,0 +1,230 @@
+"""
+Local SQLite store of the previous runs, used by the delta mode of the reports.
+
+It keeps:
+    - The hash of every row written to a spreadsheet range, so only the changed rows are written again.
+    - The report data of every user, so the data of the users changed since the last run
+      (the 'since' request field) can be merged into the data of the other users.
+    - The start time of the last complete run of every report, the 'since' value of the next run.
+"""
+from contextlib import closing
+import hashlib
+import json
+import os
+import sqlite3
+
+DEFAULT_DELTA_STORE_FILE = os.path.join(os.path.dirname(__file__), 'result', 'delta-store.sqlite3')
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS sheet_rows (
+        spreadsheet_id TEXT NOT NULL,
+        range_name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        row_hash TEXT NOT NULL,
+        PRIMARY KEY (spreadsheet_id, range_name, position)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS course_users (
+        report TEXT NOT NULL,
+        course_id TEXT NOT NULL,
+        user_key TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (report, course_id, position)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS runs (
+        report TEXT PRIMARY KEY,
+        started_at TEXT NOT NULL
+    )
+    ''',
+)
+# The users of the stores created before course_users were keyed by their user key, so the users
+# without a key could not be stored, they are moved to course_users when the store is opened.
+LEGACY_USERS_TABLE = 'user_rows'
+
+
+class DeltaStore(object):
+    """
+    Delta mode store of one report, the connections are opened per operation so
+    the store can be sent to the worker processes.
+    """
+
+    def __init__(self, report_name, file_path=None):
+        """
+        Args:
+            report_name: Name of the report.
+            file_path: Path of the SQLite file, defaults to result/delta-store.sqlite3.
+        """
+        self.report_name = report_name
+        self.file_path = file_path or DEFAULT_DELTA_STORE_FILE
+
+        with closing(self.connect()) as connection:
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+
+                self.migrate_legacy_users(connection)
+
+    def migrate_legacy_users(self, connection):
+        """
+        Move the users of the legacy users table to course_users and drop it.
+        """
+        legacy_table = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (LEGACY_USERS_TABLE,),
+        ).fetchone()
+
+        if not legacy_table:
+            return
+
+        connection.execute(
+            'INSERT OR REPLACE INTO course_users (report, course_id, user_key, position, data) '
+            'SELECT report, course_id, user_key, position, data FROM {}'.format(LEGACY_USERS_TABLE)
+        )
+        connection.execute('DROP TABLE {}'.format(LEGACY_USERS_TABLE))
+
+    def connect(self):
+        """
+        Return a new connection to the store.
+        """
+        return sqlite3.connect(self.file_path, timeout=30)
+
+    def get_row_hashes(self, spreadsheet_id, range_name):
+        """
+        Return the list of row hashes of the last write of the spreadsheet range, header included.
+        """
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                'SELECT row_hash FROM sheet_rows WHERE spreadsheet_id = ? AND range_name = ? ORDER BY position',
+                (spreadsheet_id, range_name),
+            ).fetchall()
+
+        return [row_hash for row_hash, in rows]
+
+    def save_row_hashes(self, spreadsheet_id, range_name, row_hashes):
+        """
+        Replace the row hashes of the spreadsheet range.
+        """
+        with closing(self.connect()) as connection:
+            with connection:
+                connection.execute(
+                    'DELETE FROM sheet_rows WHERE spreadsheet_id = ? AND range_name = ?',
+                    (spreadsheet_id, range_name),
+                )
+                connection.executemany(
+                    'INSERT INTO sheet_rows (spreadsheet_id, range_name, position, row_hash) VALUES (?, ?, ?, ?)',
+                    (
+                        (spreadsheet_id, range_name, position, row_hash)
+                        for position, row_hash in enumerate(row_hashes)
+                    ),
+                )
+
+    def merge_course_users(self, course_id, users, user_key, merge=True):
+        """
+        Merge the changed users of the course into the users of the previous runs, and store the result.
+
+        The changed users replace the previous data of the same user and keep their position,
+        the new users are added at the end. The users without a user key value cannot be matched,
+        so they are always added. When merge is False the users are stored as they are.
+
+        Args:
+            course_id: Course key value.
+            users: List of user data dicts, only the users changed since the last run.
+            user_key: Key of the user data dicts that identifies the user, e.g. 'username'.
+            merge: False to replace the stored users, when users has every user of the course.
+        Returns:
+            List with the data of every user of the course.
+        """
+        with closing(self.connect()) as connection:
+            if merge:
+                merged_users = [
+                    json.loads(data) for data, in connection.execute(
+                        'SELECT data FROM course_users WHERE report = ? AND course_id = ? ORDER BY position',
+                        (self.report_name, course_id),
+                    )
+                ]
+                user_positions = {}
+
+                for position, user in enumerate(merged_users):
+                    user_key_value = get_user_key_value(user, user_key)
+
+                    if user_key_value:
+                        user_positions[user_key_value] = position
+
+                for user in users:
+                    user_key_value = get_user_key_value(user, user_key)
+                    position = user_positions.get(user_key_value) if user_key_value else None
+
+                    if position is None:
+                        if user_key_value:
+                            user_positions[user_key_value] = len(merged_users)
+
+                        merged_users.append(user)
+                    else:
+                        merged_users[position] = user
+            else:
+                merged_users = list(users)
+
+            with connection:
+                connection.execute(
+                    'DELETE FROM course_users WHERE report = ? AND course_id = ?',
+                    (self.report_name, course_id),
+                )
+                connection.executemany(
+                    'INSERT INTO course_users (report, course_id, user_key, position, data) VALUES (?, ?, ?, ?, ?)',
+                    (
+                        (self.report_name, course_id, get_user_key_value(user, user_key), position, json.dumps(user))
+                        for position, user in enumerate(merged_users)
+                    ),
+                )
+
+        return merged_users
+
+    def get_last_run(self):
+        """
+        Return the start time of the last complete run of the report, None if there is none.
+        """
+        with closing(self.connect()) as connection:
+            row = connection.execute('SELECT started_at FROM runs WHERE report = ?', (self.report_name,)).fetchone()
+
+        return row[0] if row else None
+
+    def save_run(self, started_at):
+        """
+        Save the start time of a complete run of the report.
+        """
+        with closing(self.connect()) as connection:
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO runs (report, started_at) VALUES (?, ?)',
+                    (self.report_name, started_at),
+                )
+
+
+def get_user_key_value(user, user_key):
+    """
+    Return the user key value of the user data as a string, an empty string when it's missing.
+    """
+    user_key_value = user.get(user_key)
+
+    return '' if user_key_value is None else str(user_key_value)
+
+
+def get_row_hash(row):
+    """
+    Return the hash of a csv row.
+    """
+    return hashlib.sha1('\x1f'.join(row).encode('utf-8')).hexdigest()
+
+
+def get_delta_store(report_name, delta_settings):
+    """
+    Return the DeltaStore of the EXTRA_DATA['DELTA'] settings, None when the delta mode is disabled.
+    """
+    if not isinstance(delta_settings, dict):
+        return None
+
+    return DeltaStore(report_name, delta_settings.get('FILE'))
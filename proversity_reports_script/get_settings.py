@@ -1,45 +1,381 @@
 """
 Main module to get config settings from the config json file.
+
+The settings are loaded once per process and configuration file, and they can be overlaid
+with environment variables prefixed with PROVERSITY_REPORTS_, the nested keys are separated
+with two underscores and the values are parsed as json when possible, e.g.:
+
+    PROVERSITY_REPORTS_OPEN_EDX_OAUTH_TOKEN=token
+    PROVERSITY_REPORTS_COMPLETION_REPORT__EXTRA_DATA__MAX_WORKERS=8
 """
+from importlib.util import find_spec
 import json
 import os
 
+from proversity_reports_script.google_apis.credentials import CREDENTIAL_PROVIDERS, SERVICE_ACCOUNT_PROVIDER
+
+ENVIRONMENT_PREFIX = 'PROVERSITY_REPORTS_'
+ENVIRONMENT_SEPARATOR = '__'
+# Expected type of the optional settings, the report settings are checked by validate_report_settings.
+SETTINGS_TYPES = {
+    'LMS_URL': str,
+    'OPEN_EDX_OAUTH_TOKEN': str,
+    'AWS_ACCESS_KEY_ID': str,
+    'AWS_SECRET_ACCESS_KEY': str,
+    'SUPPORTED_REPORTS': list,
+    'COURSES': list,
+    'GOOGLE_OAUTH_CREDENTIALS': dict,
+    'GOOGLE_SHEETS_CREDENTIALS': dict,
+    'METRICS': dict,
+    'REQUEST_RETRY': dict,
+    'REQUEST_LIMITS': dict,
+    'TIMEOUTS': dict,
+    'SHARDING': dict,
+}
+REPORT_SETTINGS_TYPES = {
+    'REPORT_URL': str,
+    'BACKEND_REPORT': str,
+    'SPREADSHEET_DATA': dict,
+    'EXTRA_DATA': dict,
+    'EXTRA_REQUEST_DATA': dict,
+}
+EXTRA_DATA_TYPES = {
+    'MAX_WORKERS': int,
+    'MAX_POLL_WORKERS': int,
+    'MAX_UPLOAD_WORKERS': int,
+    'MAX_COURSES_PER_REQUEST': int,
+    'SPREADSHEET_DATA': dict,
+    'OUTPUT_FORMATS': list,
+    'OUTPUT_OPTIONS': dict,
+    'DELTA': dict,
+    'ADAPTIVE_BATCHING': dict,
+}
 
-def get_settings(should_set_environment_settings):
+_settings_cache = {}
+
+
+class SettingsError(Exception):
+    """
+    Raised when the configuration file cannot be loaded or it's not valid.
     """
-    Returns and set environment settings in order to use them,
-    during the report fecth and generation.
 
-    Returns:
-        Dict with the settings defined in the config file.
+
+class SpreadsheetData(dict):
     """
-    configuration_file_path = os.getenv('CONFIGURATION_FILE_PATH', None)
+    Index of the spreadsheet ids of a report, keyed by '{spreadsheet key}_{course id}'.
 
-    if not configuration_file_path:
-        print('Configuration file path was not provided.')
-        exit()
+    It's built once from the SPREADSHEET_DATA of the report settings and of its EXTRA_DATA,
+    and the spreadsheet ids can also be grouped per spreadsheet key, e.g.:
+
+        "SPREADSHEET_DATA": {
+            "completion_sheet_id": {
+                "course-v1:edX+DemoX+Demo_Course": "spreadsheet id"
+            },
+            "general_course_sheet_id_course-v1:edX+DemoX+Demo_Course": "spreadsheet id"
+        }
+    """
+
+    def __init__(self, *spreadsheet_data_dicts):
+        super(SpreadsheetData, self).__init__()
+
+        for spreadsheet_data in spreadsheet_data_dicts:
+            for key, value in (spreadsheet_data or {}).items():
+                # The dicts with a spreadsheet_id are routes (see spreadsheet_routing), not groups.
+                if isinstance(value, dict) and 'spreadsheet_id' not in value:
+                    for course_id, spreadsheet_id in value.items():
+                        self['{}_{}'.format(key, course_id)] = spreadsheet_id
+                else:
+                    self[key] = value
+
+
+class Settings(dict):
+    """
+    Settings of the configuration file, with the environment overlays applied.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Settings, self).__init__(*args, **kwargs)
+        self._report_settings = {}
+
+    @classmethod
+    def load(cls, configuration_file_path, environ=None):
+        """
+        Return the settings of the configuration file.
+
+        Args:
+            configuration_file_path: Path to the json configuration file.
+            environ: Environment variables dict, defaults to os.environ.
+        Raises:
+            SettingsError: When the file cannot be read or parsed into a json object.
+        """
+        try:
+            with open(configuration_file_path, 'r') as config_file:
+                settings = json.load(config_file)
+        except (IOError, OSError) as error:
+            raise SettingsError('The configuration file cannot be read. {}'.format(error))
+        except ValueError as json_error:
+            raise SettingsError('The configuration file {} cannot be parsed into json. {}'.format(
+                configuration_file_path,
+                json_error,
+            ))
+
+        if not isinstance(settings, dict):
+            raise SettingsError('The configuration file {} must contain a json object.'.format(
+                configuration_file_path,
+            ))
+
+        apply_environment_overlays(settings, os.environ if environ is None else environ)
+
+        return cls(settings)
+
+    @property
+    def lms_url(self):
+        """
+        Return the base URL of the LMS.
+        """
+        return self.get('LMS_URL', '')
+
+    @property
+    def courses(self):
+        """
+        Return the list of course ids of the reports.
+        """
+        return self.get('COURSES', [])
+
+    @property
+    def supported_reports(self):
+        """
+        Return the list of the report names that can be run.
+        """
+        return self.get('SUPPORTED_REPORTS', [])
+
+    def get_report_settings(self, report_name):
+        """
+        Return the settings of the report, with the SPREADSHEET_DATA index in its EXTRA_DATA.
+        """
+        if report_name not in self._report_settings:
+            report_settings = dict(self.get(report_name.upper()) or {})
+            extra_data = dict(report_settings.get('EXTRA_DATA') or {})
+            extra_data['SPREADSHEET_DATA'] = SpreadsheetData(
+                report_settings.get('SPREADSHEET_DATA'),
+                extra_data.get('SPREADSHEET_DATA'),
+            )
+            report_settings['EXTRA_DATA'] = extra_data
+            self._report_settings[report_name] = report_settings
+
+        return self._report_settings[report_name]
+
+    def get_storage_credentials(self):
+        """
+        Return the S3 client arguments of the AWS keys of the settings, empty when they are not set
+        so boto3 looks for the credentials in its default locations.
+        """
+        if not self.get('AWS_ACCESS_KEY_ID') or not self.get('AWS_SECRET_ACCESS_KEY'):
+            return {}
+
+        return {
+            'aws_access_key_id': self['AWS_ACCESS_KEY_ID'],
+            'aws_secret_access_key': self['AWS_SECRET_ACCESS_KEY'],
+        }
+
+    def get_sheets_credentials(self):
+        """
+        Return the Google Sheets sink arguments of the GOOGLE_SHEETS_CREDENTIALS settings, e.g.:
+
+            "GOOGLE_SHEETS_CREDENTIALS": {
+                "PROVIDER": "service_account",
+                "SERVICE_ACCOUNT_FILE": "path-to-service-account-key.json"
+            }
+
+        They are empty for the default 'oauth' provider, which uses the --oauth-config-file argument.
+        """
+        sheets_credentials = self.get('GOOGLE_SHEETS_CREDENTIALS') or {}
+
+        if sheets_credentials.get('PROVIDER') != SERVICE_ACCOUNT_PROVIDER:
+            return {}
+
+        return {
+            'credentials_provider': SERVICE_ACCOUNT_PROVIDER,
+            'credentials_file': sheets_credentials.get('SERVICE_ACCOUNT_FILE'),
+        }
+
+    def validate(self, report_name):
+        """
+        Check the settings of the report run, without any request and without importing the backend.
+
+        Raises:
+            SettingsError: With every problem found.
+        """
+        errors = get_type_errors(self, SETTINGS_TYPES, '')
+
+        if not self.courses:
+            errors.append('Course id list was not provided.')
+
+        if isinstance(self.get('GOOGLE_SHEETS_CREDENTIALS'), dict):
+            errors.extend(validate_sheets_credentials(self['GOOGLE_SHEETS_CREDENTIALS']))
+
+        if report_name not in self.supported_reports:
+            errors.append('Report is not configured.')
+        elif not isinstance(self.get(report_name.upper()), dict) or not self.get(report_name.upper()):
+            errors.append('Missing report configuration.')
+        else:
+            errors.extend(validate_report_settings(self[report_name.upper()], report_name.upper()))
+
+        if errors:
+            raise SettingsError('\n'.join(errors))
+
+
+def validate_report_settings(report_settings, report_key):
+    """
+    Return the list of problems of the report settings.
+    """
+    errors = get_type_errors(report_settings, REPORT_SETTINGS_TYPES, '{}.'.format(report_key))
+    errors.extend(get_type_errors(
+        report_settings.get('EXTRA_DATA') or {},
+        EXTRA_DATA_TYPES,
+        '{}.EXTRA_DATA.'.format(report_key),
+    ))
+
+    if not report_settings.get('REPORT_URL'):
+        errors.append('Report URL was not provided.')
 
-    with open(configuration_file_path, 'r') as config_file:
-        config_data = config_file.read()
+    backend_report = report_settings.get('BACKEND_REPORT')
 
+    if not backend_report:
+        errors.append('BACKEND_REPORT was not provided.')
+    elif isinstance(backend_report, str):
+        module_name, _, class_name = backend_report.partition(':')
+
+        if not class_name:
+            errors.append('{}.BACKEND_REPORT must be in the module:class format.'.format(report_key))
+        elif not module_exists(module_name):
+            errors.append('{}.BACKEND_REPORT module {} cannot be found.'.format(report_key, module_name))
+
+    return errors
+
+
+def validate_sheets_credentials(sheets_credentials):
+    """
+    Return the list of problems of the GOOGLE_SHEETS_CREDENTIALS settings.
+    """
+    provider = sheets_credentials.get('PROVIDER')
+
+    if provider is not None and provider not in CREDENTIAL_PROVIDERS:
+        return ['GOOGLE_SHEETS_CREDENTIALS.PROVIDER must be one of {}.'.format(', '.join(CREDENTIAL_PROVIDERS))]
+
+    if provider == SERVICE_ACCOUNT_PROVIDER and not sheets_credentials.get('SERVICE_ACCOUNT_FILE'):
+        return ['GOOGLE_SHEETS_CREDENTIALS.SERVICE_ACCOUNT_FILE was not provided.']
+
+    return []
+
+
+def get_type_errors(settings, settings_types, prefix):
+    """
+    Return the list of settings that do not have the expected type.
+    The int settings can also be strings of integers, they are converted where they are used.
+    """
+    errors = []
+
+    for key, expected_type in settings_types.items():
+        value = settings.get(key)
+
+        if value is None or (isinstance(value, expected_type) and not isinstance(value, bool)):
+            continue
+
+        if not (expected_type is int and isinstance(value, str) and value.strip().lstrip('-').isdigit()):
+            errors.append('{}{} must be of type {}, got {}.'.format(
+                prefix,
+                key,
+                expected_type.__name__,
+                type(value).__name__,
+            ))
+
+    return errors
+
+
+def module_exists(module_name):
+    """
+    Return True if the module can be imported, without importing it (only its parent packages).
+    """
     try:
-        settings = json.loads(config_data)
+        return find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
 
-        if should_set_environment_settings:
-            set_environment_settings(settings)
-    except ValueError as json_error:
-        print(json_error.message)
-        quit()
 
-    return settings
+def apply_environment_overlays(settings, environ):
+    """
+    Set the settings of the PROVERSITY_REPORTS_ environment variables.
+
+    The keys of the nested settings are matched case-insensitively, so the existing keys keep their case.
+    """
+    for variable, value in sorted(environ.items()):
+        if not variable.startswith(ENVIRONMENT_PREFIX) or len(variable) == len(ENVIRONMENT_PREFIX):
+            continue
 
+        keys = variable[len(ENVIRONMENT_PREFIX):].split(ENVIRONMENT_SEPARATOR)
+        parent = settings
 
-def set_environment_settings(settings):
+        for key in keys[:-1]:
+            key = get_existing_key(parent, key)
+
+            if not isinstance(parent.get(key), dict):
+                parent[key] = {}
+
+            parent = parent[key]
+
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+
+        parent[get_existing_key(parent, keys[-1])] = value
+
+
+def get_existing_key(settings, key):
+    """
+    Return the key of the settings dict that matches the key case-insensitively, or the key itself.
+    """
+    if key in settings:
+        return key
+
+    for existing_key in settings:
+        if existing_key.upper() == key.upper():
+            return existing_key
+
+    return key
+
+
+def get_settings(configuration_file_path=None):
     """
-    Set environment keys from config file.
+    Returns the settings of the configuration file, loaded once per process.
 
     Args:
-        settings: Settings dict from the config file.
+        configuration_file_path: Path to the json configuration file,
+                                 defaults to the CONFIGURATION_FILE_PATH environment variable.
+    Returns:
+        Settings object, a dict with the settings defined in the config file.
     """
-    os.environ['AWS_ACCESS_KEY_ID'] = settings.get('AWS_ACCESS_KEY_ID', '')
-    os.environ['AWS_SECRET_ACCESS_KEY'] = settings.get('AWS_SECRET_ACCESS_KEY')
+    configuration_file_path = configuration_file_path or os.getenv('CONFIGURATION_FILE_PATH', None)
+
+    if not configuration_file_path:
+        print('Configuration file path was not provided.')
+        exit()
+
+    try:
+        file_stat = os.stat(configuration_file_path)
+    except OSError as error:
+        print('The configuration file cannot be read. {}'.format(error))
+        exit()
+
+    # The file is loaded again if it has been modified, e.g. by the load test of every run.
+    cache_key = (os.path.abspath(configuration_file_path), file_stat.st_mtime_ns, file_stat.st_size)
+
+    if cache_key not in _settings_cache:
+        try:
+            _settings_cache[cache_key] = Settings.load(configuration_file_path)
+        except SettingsError as error:
+            print(error)
+            exit()
+
+    return _settings_cache[cache_key]
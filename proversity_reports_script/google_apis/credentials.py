@@ -0,0 +1,286 @@
+"""
+Helpers to store the Google oAuth credentials.
+
+The credentials file can be shared by the threads of a run, by its worker processes and by other cron jobs,
+so the credentials are refreshed by CredentialManager under an advisory lock of the file, and the file is
+always replaced atomically.
+
+The credentials can also be the json key of a Google service account (the 'service_account' provider):
+the requests are then signed with self-signed JWTs, without token requests nor a shared file to update.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import fcntl
+import json
+import os
+import tempfile
+import threading
+
+REQUIRED_CREDENTIALS = [
+    'token', 'refresh_token', 'token_uri', 'client_id', 'client_secret', 'scopes',
+]
+EXPIRY_FORMAT = '%Y-%m-%dT%H:%M:%S'
+OAUTH_PROVIDER = 'oauth'
+SERVICE_ACCOUNT_PROVIDER = 'service_account'
+CREDENTIAL_PROVIDERS = (OAUTH_PROVIDER, SERVICE_ACCOUNT_PROVIDER)
+# Audience of the self-signed JWTs of the service accounts.
+SHEETS_API_AUDIENCE = 'https://sheets.googleapis.com/'
+# The credentials are refreshed when they expire in less than this, so a request never gets an expired token.
+DEFAULT_REFRESH_MARGIN_SECONDS = 300
+
+_credential_managers = {}
+_credential_managers_lock = threading.Lock()
+_service_account_credentials = {}
+
+
+def store_credentials_as_dict(file_name, credentials):
+    """
+    Saves a file containing the dict object as json with the required information.
+
+    Args:
+        file_name: File name to store the credentials.
+        credentials: google.oauth2.credentials.Credentials Object.
+    Raises:
+        GoogleApiCredentialsError: When some of the required fields is missing from the credentials object.
+    """
+    required_data = {}
+
+    for field in REQUIRED_CREDENTIALS:
+        credential_field = getattr(credentials, field, None)
+
+        if not credential_field:
+            error_message = 'Credential field is missing. {}'.format(field)
+            raise GoogleApiCredentialsError(error_message)
+
+        required_data.update({
+            field: credential_field
+        })
+
+    if getattr(credentials, 'expiry', None):
+        # The expiry lets the next runs reuse the token instead of refreshing it.
+        required_data['expiry'] = credentials.expiry.strftime(EXPIRY_FORMAT)
+
+    write_json_file(file_name, required_data)
+
+
+def write_json_file(file_name, data):
+    """
+    Write the data as json into a temporary file that replaces the file, so the file is never read half written.
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.credentials-')
+
+    try:
+        with os.fdopen(file_descriptor, 'w') as json_file:
+            json.dump(data, json_file, sort_keys=True)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+
+        os.replace(temporary_path, file_name)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def read_credentials_file(file_name):
+    """
+    Return the credentials dict of the file, with the expiry as a naive UTC datetime.
+
+    Raises:
+        GoogleApiCredentialsError: When the file cannot be read or parsed into json.
+    """
+    try:
+        with open(file_name, 'r') as json_file:
+            credentials_data = json.load(json_file)
+    except (IOError, OSError) as error:
+        raise GoogleApiCredentialsError('oAuth config file cannot be read. {}'.format(error))
+    except ValueError:
+        raise GoogleApiCredentialsError('oAuth config file contents cannot be parsed into json.')
+
+    if not credentials_data:
+        raise GoogleApiCredentialsError('Google oAuth settings were not provided.')
+
+    if credentials_data.get('expiry'):
+        credentials_data['expiry'] = datetime.strptime(credentials_data['expiry'], EXPIRY_FORMAT)
+
+    return credentials_data
+
+
+@contextmanager
+def file_lock(file_name):
+    """
+    Hold an exclusive advisory lock of the file while the context is open.
+
+    The lock is taken on a separate '.lock' file, since the file itself is replaced when it's written.
+    """
+    with open('{}.lock'.format(file_name), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class CredentialManager(object):
+    """
+    Google oAuth credentials of a credentials file, cached in memory until they are about to expire.
+
+    The refresh is done under the lock of the file and after reading it again, so when several threads
+    or processes need a new token, only the first one refreshes it and the others use the stored one.
+    """
+
+    def __init__(self, file_name, refresh_margin_seconds=DEFAULT_REFRESH_MARGIN_SECONDS):
+        """
+        Args:
+            file_name: Path of the credentials file, see store_credentials_as_dict.
+            refresh_margin_seconds: The credentials are refreshed when they expire in less than this.
+        """
+        self.file_name = file_name
+        self.refresh_margin = timedelta(seconds=refresh_margin_seconds)
+        self.refreshes = 0
+        self._credentials = None
+        self._lock = threading.Lock()
+
+    def needs_refresh(self, credentials):
+        """
+        Return True if the credentials expire within the refresh margin, or if their expiry is not known.
+        """
+        if not credentials.token or not credentials.expiry:
+            return True
+
+        return credentials.expiry - self.refresh_margin <= datetime.utcnow()
+
+    def load_credentials(self):
+        """
+        Return a new google.oauth2.credentials.Credentials object with the credentials of the file.
+
+        Raises:
+            GoogleApiCredentialsError: When the file is not valid or the object cannot be created.
+        """
+        # The Google client libraries take a long time to import, they are loaded on the first Sheets request.
+        from google.auth.exceptions import GoogleAuthError
+        from google.oauth2.credentials import Credentials
+
+        credentials_data = read_credentials_file(self.file_name)
+        expiry = credentials_data.pop('expiry', None)
+
+        try:
+            credentials = Credentials(**credentials_data)
+        except (GoogleAuthError, TypeError) as goo_error:
+            raise GoogleApiCredentialsError('Unable to create the Credentials object. {}'.format(goo_error))
+
+        credentials.expiry = expiry
+
+        return credentials
+
+    def get_credentials(self):
+        """
+        Return the credentials, refreshed when they are about to expire.
+
+        Raises:
+            GoogleApiCredentialsError: When the credentials cannot be loaded or refreshed.
+        """
+        with self._lock:
+            if self._credentials is not None and not self.needs_refresh(self._credentials):
+                return self._credentials
+
+            with file_lock(self.file_name):
+                # Another process may have refreshed the credentials while this one waited for the lock.
+                credentials = self.load_credentials()
+
+                if self.needs_refresh(credentials):
+                    self.refresh_credentials(credentials)
+
+            self._credentials = credentials
+
+            return credentials
+
+    def refresh_credentials(self, credentials):
+        """
+        Refresh the credentials and store them for the next runs, the file lock must be held.
+        """
+        from google.auth.exceptions import GoogleAuthError
+        from google.auth.transport.requests import Request
+
+        if not credentials.refresh_token:
+            raise GoogleApiCredentialsError('The credentials are expired and they cannot be refreshed.')
+
+        print('Google oAuth credentials are being updated.')
+
+        try:
+            credentials.refresh(Request())
+        except GoogleAuthError as goo_error:
+            raise GoogleApiCredentialsError('Unable to refresh the credentials. {}'.format(goo_error))
+
+        self.refreshes += 1
+        store_credentials_as_dict(self.file_name, credentials)
+        print('Google oAuth credentials were updated.')
+
+
+def get_credential_manager(file_name):
+    """
+    Return the CredentialManager of the file, shared by the threads of the process.
+    """
+    file_name = os.path.abspath(file_name)
+
+    with _credential_managers_lock:
+        if file_name not in _credential_managers:
+            _credential_managers[file_name] = CredentialManager(file_name)
+
+        return _credential_managers[file_name]
+
+
+def get_service_account_credentials(file_name):
+    """
+    Return the google.auth.jwt.Credentials of the service account key file, loaded once per process.
+
+    The JWTs are signed with the private key of the service account when they expire, so every process
+    and thread uses its own tokens.
+
+    Raises:
+        GoogleApiCredentialsError: When the key file cannot be read or it's not a service account key.
+    """
+    file_name = os.path.abspath(file_name)
+
+    with _credential_managers_lock:
+        if file_name not in _service_account_credentials:
+            # The Google client libraries take a long time to import, they are loaded on the first Sheets request.
+            from google.auth import jwt
+
+            try:
+                _service_account_credentials[file_name] = jwt.Credentials.from_service_account_file(
+                    file_name,
+                    audience=SHEETS_API_AUDIENCE,
+                )
+            except (IOError, OSError, ValueError) as error:
+                raise GoogleApiCredentialsError('The service account key file cannot be loaded. {}'.format(error))
+
+        return _service_account_credentials[file_name]
+
+
+def get_credentials(credentials_provider, file_name):
+    """
+    Return the Google credentials of the provider.
+
+    Args:
+        credentials_provider: One of CREDENTIAL_PROVIDERS.
+        file_name: oAuth credentials file or service account key file.
+    Raises:
+        GoogleApiCredentialsError: When the credentials cannot be obtained.
+    """
+    if credentials_provider == SERVICE_ACCOUNT_PROVIDER:
+        return get_service_account_credentials(file_name)
+
+    if credentials_provider == OAUTH_PROVIDER:
+        return get_credential_manager(file_name).get_credentials()
+
+    raise GoogleApiCredentialsError('Unknown credentials provider {}.'.format(credentials_provider))
+
+
+class GoogleApiCredentialsError(Exception):
+    """
+    Exception class raised when a Google oAuth credentials
+    is missing, empty, or there is other problem related to Google credentials object.
+    """
+    pass
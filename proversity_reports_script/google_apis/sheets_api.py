@@ -2,59 +2,53 @@
 Main module to get access to the Google Sheets API.
 """
 import csv
+import io
 import json
+import mmap
 import os
 
-from google.auth.exceptions import GoogleAuthError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from proversity_reports_script.delta_store import get_row_hash
+from proversity_reports_script.google_apis.credentials import (
+    OAUTH_PROVIDER,
+    GoogleApiCredentialsError,
+    get_credentials,
+)
+from proversity_reports_script.metrics import stage
+from proversity_reports_script.sinks.base import DEFAULT_SHEETS_SINK, load_sink
 
-from get_google_oauth_permissions import store_credentials_as_dict
+# Size of the csv blocks, every block is written with one request.
+CSV_BLOCK_BYTES = 4 * 1024 ** 2
 
 
-def get_sheets_api_service():
+def get_sheets_api_service(credentials_provider=OAUTH_PROVIDER, credentials_file=None):
     """
     Returns the Google Sheet API service.
 
-    Attempts to get the Google oAuth credentials from the provided file.
+    Attempts to get the Google oAuth credentials from the provided file, they are shared by the
+    threads of the process and only refreshed when they are about to expire, see CredentialManager.
 
+    Keyword args:
+        credentials_provider: 'oauth' or 'service_account', see google_apis.credentials.
+        credentials_file: Path of the oAuth credentials file or of the service account key file,
+                          the oAuth file defaults to the OAUTH_CONFIGURATION_FILE environment variable.
     Returns:
         None if some problem to get the service is raised.
         spreadsheets() service object.
     """
-    oauth_file_path = os.getenv('OAUTH_CONFIGURATION_FILE', None)
+    # The Google client libraries take a long time to import, they are loaded on the first Sheets request.
+    from googleapiclient.discovery import build
 
-    if not oauth_file_path:
-        print('oAuth config file was not provided.')
-        return None
+    if credentials_provider == OAUTH_PROVIDER:
+        credentials_file = credentials_file or os.getenv('OAUTH_CONFIGURATION_FILE', None)
 
-    google_oauth_credentials = get_settings_from_file(oauth_file_path)
-
-    if not google_oauth_credentials:
-        print('Google oAuth settings were not provided.')
+    if not credentials_file:
+        print('oAuth config file was not provided.')
         return None
 
     try:
-        oauth_credentials = Credentials(**google_oauth_credentials)
-    except GoogleAuthError as goo_error:
-        print('Unable to create the Credentials object. {}'.format(goo_error))
-        return None
-
-    if (oauth_credentials and
-            not oauth_credentials.valid
-            and oauth_credentials.expired
-            and oauth_credentials.refresh_token):
-
-        oauth_credentials.refresh(Request())
-
-        print('Google oAuth credentials are being updated.')
-
-        # Save the credentials for the next run.
-        store_credentials_as_dict(oauth_file_path, oauth_credentials)
-        print('Google oAuth credentials were updated.')
-    elif not oauth_credentials:
-        print('The credentials cannot be obtained or are not valid.')
+        oauth_credentials = get_credentials(credentials_provider, credentials_file)
+    except GoogleApiCredentialsError as credentials_error:
+        print('The credentials cannot be obtained or are not valid. {}'.format(credentials_error))
         return None
 
     try:
@@ -101,20 +95,56 @@ def get_data_from_csv(file_path):
     """
 
     if os.path.exists(file_path):
-        with open(file_path, 'r') as csvfile:
-            report_reader = csv.reader(csvfile)
-
-            for row in report_reader:
+        for rows, _ in get_csv_blocks(file_path):
+            for row in rows:
                 yield row
     else:
         print('The csv file does not exists. {}'.format(file_path))
         yield []
 
 
-def update_sheets_data(file_path, spreadsheet_id, spreadsheet_range_name='Sheet1'):
+def get_csv_blocks(file_path, block_bytes=CSV_BLOCK_BYTES):
+    """
+    Reads the csv through a memory map and yields its rows in blocks of about block_bytes.
+
+    The blocks end at a line break outside of the quoted values: the number of quotes
+    before a record end is always even, so only the quotes of the block are counted.
+
+    Args:
+        file_path: csv file path.
+        block_bytes: Minimum size of a block, the last one can be smaller.
+    Returns:
+        Yields (list of rows, block size in bytes) tuples.
+    """
+    with open(file_path, 'rb') as csv_file:
+        if not os.fstat(csv_file.fileno()).st_size:
+            return
+
+        with mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as csv_map:
+            file_size = len(csv_map)
+            block_start = 0
+
+            while block_start < file_size:
+                block_end = csv_map.find(b'\n', min(block_start + block_bytes, file_size) - 1) + 1 or file_size
+                block = csv_map[block_start:block_end]
+
+                while block.count(b'"') % 2 and block_end < file_size:
+                    next_block_end = csv_map.find(b'\n', block_end) + 1 or file_size
+                    block += csv_map[block_end:next_block_end]
+                    block_end = next_block_end
+
+                yield list(csv.reader(io.StringIO(block.decode('utf-8'), newline=''))), len(block)
+                block_start = block_end
+
+
+def update_sheets_data(file_path, spreadsheet_id, spreadsheet_range_name='Sheet1', sheets_sink=None, delta_store=None):
     """
     Updates the report data on the provided spreadsheet id.
 
+    The csv file is read and written in blocks (see get_csv_blocks and SheetsRangeWriter), so the
+    whole file is never loaded. With a delta store (EXTRA_DATA['DELTA']), the blocks are compared
+    with the row hashes of the last update of the range, and only the changed rows are written.
+
     Google Sheets reference: https://developers.google.com/sheets/api/reference/rest/v4/spreadsheets.values
 
     Args:
@@ -123,43 +153,267 @@ def update_sheets_data(file_path, spreadsheet_id, spreadsheet_range_name='Sheet1
         spreadsheet_range_name: Range name to update the spreadsheet file in A notation:
         https://developers.google.com/sheets/api/guides/concepts#a1_notation
         Defaults to Sheet1 as name of the first spreadsheet tab.
+        sheets_sink: Sheets sink to write the data, defaults to a new GoogleSheetsSink.
+        delta_store: DeltaStore with the row hashes of the previous updates.
     Returns:
         None: if there is a problem updating the report.
     """
-    csv_data = list(get_data_from_csv(file_path))
-
-    if not csv_data:
-        print('The report data is empty and it was not updated on Google Sheets.')
-        return None
-
     if not spreadsheet_id:
         print('Spreadsheet id was not provided and the report cannot be updated on Google Sheets.')
         return None
 
-    value_input_option = 'USER_ENTERED'
-    body = {
-        'values': csv_data,
-    }
-    api_service = get_sheets_api_service()
+    return update_spreadsheet_ranges(
+        spreadsheet_id,
+        [(file_path, spreadsheet_range_name)],
+        sheets_sink=sheets_sink,
+        delta_store=delta_store,
+    )
 
-    if not api_service:
-        print('Unable to obtain the Google Sheets API service, the report was not updated.')
-        return None
 
-    try:
-        api_service.values().clear(
-            spreadsheetId=spreadsheet_id,
-            range=spreadsheet_range_name,
-        ).execute()
-
-        api_service.values().update(
-            spreadsheetId=spreadsheet_id,
-            range=spreadsheet_range_name,
-            valueInputOption=value_input_option,
-            body=body,
-        ).execute()
-    except Exception as error:  # pylint: disable=broad-except
-        print('There was an error updating report on Google Sheet. {}'.format(error))
+def update_spreadsheet_ranges(spreadsheet_id, file_ranges, sheets_sink=None, delta_store=None, sheet_titles=()):
+    """
+    Updates the report data of several files on the provided spreadsheet id, with batch requests.
+
+    Every file is written into its range by a SheetsRangeWriter, and the clears and the writes of
+    every range are sent together (see SheetsRequestBatch), e.g. the tabs of the courses that share
+    a spreadsheet are written with one batch request.
+
+    Args:
+        spreadsheet_id: Google Sheet report ID.
+        file_ranges: List of (report file data path, range name) tuples.
+        sheets_sink: Sheets sink to write the data, defaults to a new GoogleSheetsSink.
+        delta_store: DeltaStore with the row hashes of the previous updates.
+        sheet_titles: Titles of the sheets to add when they don't exist, e.g. the tabs per course.
+    Returns:
+        True if the report data was updated, None if there is a problem updating the report.
+    """
+    file_ranges = [
+        (file_path, range_name) for file_path, range_name in file_ranges
+        if os.path.exists(file_path) and os.path.getsize(file_path)
+    ]
+
+    if not file_ranges:
+        print('The report data is empty and it was not updated on Google Sheets.')
         return None
 
+    if not sheets_sink:
+        sheets_sink = load_sink(None, DEFAULT_SHEETS_SINK)
+
+    request_batch = SheetsRequestBatch(sheets_sink, spreadsheet_id)
+    range_writers = []
+
+    with stage(
+            'sheets_update',
+            spreadsheet_id=spreadsheet_id,
+            range=file_ranges[0][1] if len(file_ranges) == 1 else '{} ranges'.format(len(file_ranges)),
+    ) as sheets_stage:
+        sheets_stage.bytes = sum(os.path.getsize(file_path) for file_path, _ in file_ranges)
+
+        try:
+            if sheet_titles:
+                sheets_sink.add_sheets(spreadsheet_id, sheet_titles)
+
+            for file_path, range_name in file_ranges:
+                range_writer = SheetsRangeWriter(
+                    request_batch,
+                    range_name,
+                    delta_store.get_row_hashes(spreadsheet_id, range_name) if delta_store else None,
+                )
+                range_writers.append(range_writer)
+
+                for rows, block_bytes in get_csv_blocks(file_path):
+                    range_writer.write_block(rows, block_bytes)
+
+                range_writer.finish()
+
+            request_batch.flush()
+        except Exception as error:  # pylint: disable=broad-except
+            sheets_stage.labels['error'] = type(error).__name__
+            print('There was an error updating report on Google Sheet. {}'.format(error))
+            return None
+        finally:
+            sheets_stage.rows = sum(range_writer.written_rows for range_writer in range_writers)
+            sheets_stage.labels['delta'] = any(range_writer.delta for range_writer in range_writers)
+
+    if delta_store:
+        for range_writer in range_writers:
+            delta_store.save_row_hashes(spreadsheet_id, range_writer.range_name, range_writer.row_hashes)
+
     print('The report data was successfully updated on Google Sheets.')
+
+    return True
+
+
+class SheetsRequestBatch(object):
+    """
+    Pending clears and writes of the ranges of one spreadsheet.
+
+    The writes are sent with batch requests of up to max_request_bytes of csv data, one range
+    is written with a single update request. The pending clears are sent before the writes,
+    so a range is always cleared before it's written.
+    """
+
+    def __init__(self, sheets_sink, spreadsheet_id, max_request_bytes=CSV_BLOCK_BYTES):
+        """
+        Args:
+            sheets_sink: Sheets sink to write the data.
+            spreadsheet_id: Google Sheet report ID.
+            max_request_bytes: Maximum csv size of the rows of a batch request.
+        """
+        self.sheets_sink = sheets_sink
+        self.spreadsheet_id = spreadsheet_id
+        self.max_request_bytes = max_request_bytes
+        self.pending_clears = []
+        self.pending_ranges = []
+        self.pending_bytes = 0
+
+    def clear(self, range_name):
+        """
+        Clear the range before the next writes.
+        """
+        self.pending_clears.append(range_name)
+
+    def add(self, range_name, rows, rows_bytes):
+        """
+        Add the rows of the range to the next request, the pending writes are sent when it's full.
+        """
+        if self.pending_ranges and self.pending_bytes + rows_bytes > self.max_request_bytes:
+            self.flush()
+
+        self.pending_ranges.append((range_name, rows))
+        self.pending_bytes += rows_bytes
+
+    def flush(self):
+        """
+        Send the pending clears and writes.
+        """
+        if len(self.pending_clears) == 1:
+            self.sheets_sink.clear_values(self.spreadsheet_id, self.pending_clears[0])
+        elif self.pending_clears:
+            self.sheets_sink.batch_clear_values(self.spreadsheet_id, self.pending_clears)
+
+        if len(self.pending_ranges) == 1:
+            self.sheets_sink.update_values(self.spreadsheet_id, *self.pending_ranges[0])
+        elif self.pending_ranges:
+            self.sheets_sink.batch_update_values(self.spreadsheet_id, self.pending_ranges)
+
+        self.pending_clears = []
+        self.pending_ranges = []
+        self.pending_bytes = 0
+
+
+class SheetsRangeWriter(object):
+    """
+    Writes the csv row blocks of a report file into a spreadsheet range.
+
+    The range is cleared and the blocks are written as they are read, one request per block.
+    With the row hashes of the previous update, the rows are compared by position, since they
+    are written by position: the unchanged blocks are skipped, the changed rows are written with
+    batch requests of targeted ranges, and the rows left by the previous update are cleared.
+    The whole range is written again when the header changed.
+
+    When the range name is not a sheet name (e.g. 'Sheet1!B2:F'), the rows cannot be positioned,
+    so they are written with one request at the end.
+    """
+
+    def __init__(self, request_batch, range_name, previous_row_hashes=None):
+        """
+        Args:
+            request_batch: SheetsRequestBatch of the spreadsheet.
+            range_name: Range name of the update.
+            previous_row_hashes: List of the row hashes of the previous update, header included.
+                                 None to not compute the row hashes.
+        """
+        self.request_batch = request_batch
+        self.range_name = range_name
+        self.sheet_name = None if '!' in range_name else range_name
+        self.previous_row_hashes = previous_row_hashes
+        self.row_hashes = []
+        self.row_count = 0
+        self.written_rows = 0
+        self.delta = None
+        self.range_rows = []
+        self.range_bytes = 0
+
+    def write_block(self, rows, block_bytes):
+        """
+        Write the next block of rows.
+        """
+        block_start = self.row_count
+        self.row_count += len(rows)
+        block_hashes = []
+
+        if self.previous_row_hashes is not None:
+            block_hashes = [get_row_hash(row) for row in rows]
+            self.row_hashes.extend(block_hashes)
+
+        if self.delta is None:
+            self.delta = bool(
+                self.sheet_name and self.previous_row_hashes and block_hashes
+                and self.previous_row_hashes[0] == block_hashes[0]
+            )
+
+            if not self.delta:
+                self.request_batch.clear(self.range_name)
+
+        if not self.sheet_name:
+            self.range_rows.extend(rows)
+            self.range_bytes += block_bytes
+            return
+
+        if not self.delta:
+            self.add_range(block_start, rows, block_bytes)
+            return
+
+        row_bytes = block_bytes / float(len(rows) or 1)
+
+        for start, end in get_changed_row_ranges(self.previous_row_hashes, block_hashes, block_start):
+            self.add_range(start, rows[start - block_start:end - block_start], row_bytes * (end - start))
+
+    def add_range(self, start, rows, rows_bytes):
+        """
+        Add the rows starting at the row index start to the request batch.
+        """
+        self.request_batch.add('{}!A{}'.format(self.sheet_name, start + 1), rows, rows_bytes)
+        self.written_rows += len(rows)
+
+    def finish(self):
+        """
+        Add the pending rows and clear the rows left by the previous update.
+        """
+        if not self.sheet_name:
+            self.written_rows = len(self.range_rows)
+            self.request_batch.add(self.range_name, self.range_rows, self.range_bytes)
+            return
+
+        if self.delta and len(self.previous_row_hashes) > self.row_count:
+            self.request_batch.clear(
+                '{}!{}:{}'.format(self.sheet_name, self.row_count + 1, len(self.previous_row_hashes)),
+            )
+
+
+def get_changed_row_ranges(previous_row_hashes, row_hashes, offset=0):
+    """
+    Return the (start, end) row index ranges of the rows whose hash changed, end excluded.
+
+    Args:
+        previous_row_hashes: List of the row hashes of the previous update.
+        row_hashes: List of the new row hashes of a block.
+        offset: Row index of the first row of the block.
+    """
+    changed_row_ranges = []
+    start = None
+
+    for position, row_hash in enumerate(row_hashes, offset):
+        changed = position >= len(previous_row_hashes) or previous_row_hashes[position] != row_hash
+
+        if changed and start is None:
+            start = position
+        elif not changed and start is not None:
+            changed_row_ranges.append((start, position))
+            start = None
+
+    if start is not None:
+        changed_row_ranges.append((start, offset + len(row_hashes)))
+
+    return changed_row_ranges
@@ -0,0 +1,305 @@
+"""
+Per-stage instrumentation of the report pipeline.
+
+Every instrumented stage (generation request, poll, json decode, backend transform, csv write,
+S3 upload and Sheets update) writes one json line to the metrics file with its duration, bytes,
+rows, retries and the peak memory of the process. At the end of the run the stage totals can be
+exported to a Prometheus textfile and/or pushed to a Prometheus pushgateway.
+
+Metrics are disabled unless a metrics file is configured, e.g.:
+
+    "METRICS": {
+        "FILE": "/var/log/proversity-reports/metrics.jsonl",
+        "PROMETHEUS_TEXTFILE": "/var/lib/node_exporter/proversity_reports.prom",
+        "PUSHGATEWAY_URL": "http://pushgateway:9091"
+    }
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import resource
+import sys
+import threading
+from time import perf_counter
+import uuid
+
+METRIC_PREFIX = 'proversity_report'
+
+_recorder = None
+
+
+class StageMetrics(object):
+    """
+    Values of one stage, the instrumented code sets bytes, rows and retries.
+    """
+
+    def __init__(self, stage_name, labels):
+        self.stage_name = stage_name
+        self.labels = labels
+        self.bytes = 0
+        self.rows = 0
+        self.retries = 0
+
+
+class MetricsRecorder(object):
+    """
+    Writes the stage metrics as json lines and exports the run totals.
+    """
+
+    def __init__(self, metrics_file, report_name='', prometheus_textfile='', pushgateway_url='', run_id=''):
+        self.metrics_file = metrics_file
+        self.report_name = report_name
+        self.prometheus_textfile = prometheus_textfile
+        self.pushgateway_url = pushgateway_url
+        self.run_id = run_id or uuid.uuid4().hex
+        self.lock = threading.Lock()
+
+    def record(self, stage_metrics, started_at, duration):
+        """
+        Append the stage metrics to the metrics file.
+        """
+        metrics_line = {
+            'run_id': self.run_id,
+            'report': self.report_name,
+            'stage': stage_metrics.stage_name,
+            'started_at': started_at.isoformat(),
+            'duration_seconds': round(duration, 6),
+            'bytes': stage_metrics.bytes,
+            'rows': stage_metrics.rows,
+            'retries': stage_metrics.retries,
+            'peak_rss_mb': peak_rss_mb(),
+            'pid': os.getpid(),
+        }
+        metrics_line.update(stage_metrics.labels)
+
+        with self.lock:
+            # One write per line in append mode, so the lines of the worker processes are not mixed.
+            with open(self.metrics_file, 'a') as metrics_file:
+                metrics_file.write(json.dumps(metrics_line, default=str) + '\n')
+
+    def get_run_totals(self):
+        """
+        Return the totals per stage of the current run, including the lines of the worker processes.
+
+        Returns:
+            Dict of stage name to dict with count, duration_seconds, bytes, rows and retries.
+        """
+        stage_totals = {}
+
+        if not os.path.exists(self.metrics_file):
+            return stage_totals
+
+        with open(self.metrics_file, 'r') as metrics_file:
+            for line in metrics_file:
+                try:
+                    metrics_line = json.loads(line)
+                except ValueError:
+                    continue
+
+                if metrics_line.get('run_id') != self.run_id:
+                    continue
+
+                totals = stage_totals.setdefault(metrics_line['stage'], {
+                    'count': 0,
+                    'duration_seconds': 0,
+                    'bytes': 0,
+                    'rows': 0,
+                    'retries': 0,
+                })
+                totals['count'] += 1
+
+                for key in ('duration_seconds', 'bytes', 'rows', 'retries'):
+                    totals[key] += metrics_line.get(key, 0) or 0
+
+        return stage_totals
+
+    def get_prometheus_text(self):
+        """
+        Return the run totals in the Prometheus text exposition format.
+
+        The totals belong to the last run only, every run replaces them, so they are gauges.
+        """
+        metric_lines = []
+        metric_types = (
+            ('stage_duration_seconds_sum', 'duration_seconds', 'gauge'),
+            ('stage_duration_seconds_count', 'count', 'gauge'),
+            ('stage_bytes_total', 'bytes', 'gauge'),
+            ('stage_rows_total', 'rows', 'gauge'),
+            ('stage_retries_total', 'retries', 'gauge'),
+        )
+        stage_totals = self.get_run_totals()
+
+        for metric_name, total_key, metric_type in metric_types:
+            metric_lines.append('# TYPE {}_{} {}'.format(METRIC_PREFIX, metric_name, metric_type))
+
+            for stage_name, totals in sorted(stage_totals.items()):
+                metric_lines.append('{}_{}{{report="{}",stage="{}"}} {}'.format(
+                    METRIC_PREFIX,
+                    metric_name,
+                    self.report_name,
+                    stage_name,
+                    round(totals[total_key], 6),
+                ))
+
+        metric_lines.append('# TYPE {}_peak_rss_megabytes gauge'.format(METRIC_PREFIX))
+        metric_lines.append('{}_peak_rss_megabytes{{report="{}"}} {}'.format(
+            METRIC_PREFIX,
+            self.report_name,
+            peak_rss_mb(),
+        ))
+        metric_lines.append('# TYPE {}_last_run_timestamp_seconds gauge'.format(METRIC_PREFIX))
+        metric_lines.append('{}_last_run_timestamp_seconds{{report="{}"}} {}'.format(
+            METRIC_PREFIX,
+            self.report_name,
+            int(datetime.now().timestamp()),
+        ))
+
+        return '\n'.join(metric_lines) + '\n'
+
+    def export(self):
+        """
+        Write the Prometheus textfile and push the metrics to the pushgateway, when they are configured.
+        """
+        if not self.prometheus_textfile and not self.pushgateway_url:
+            return
+
+        prometheus_text = self.get_prometheus_text()
+
+        if self.prometheus_textfile:
+            # The node exporter could read a partial file, so it's written with a rename.
+            temporary_file = '{}.{}.tmp'.format(self.prometheus_textfile, os.getpid())
+
+            with open(temporary_file, 'w') as textfile:
+                textfile.write(prometheus_text)
+
+            os.replace(temporary_file, self.prometheus_textfile)
+
+        if self.pushgateway_url:
+            import requests
+
+            try:
+                requests.put(
+                    '{}/metrics/job/proversity_reports/report/{}'.format(
+                        self.pushgateway_url.rstrip('/'),
+                        self.report_name or 'unknown',
+                    ),
+                    data=prometheus_text.encode('utf-8'),
+                    timeout=10,
+                )
+            except requests.RequestException as error:
+                print('Unable to push the metrics to the pushgateway. {}'.format(error))
+
+
+def configure_metrics(metrics_settings, report_name, metrics_file=None):
+    """
+    Enable the metrics of the process.
+
+    Args:
+        metrics_settings: Dict with the METRICS settings from the config file.
+        report_name: Name of the report being generated.
+        metrics_file: Metrics file path, overrides METRICS['FILE'].
+    Returns:
+        MetricsRecorder, or None if there is no metrics file configured.
+    """
+    global _recorder  # pylint: disable=global-statement
+
+    metrics_settings = metrics_settings or {}
+    metrics_file = metrics_file or metrics_settings.get('FILE', '')
+
+    if not metrics_file:
+        _recorder = None
+        return None
+
+    _recorder = MetricsRecorder(
+        metrics_file=metrics_file,
+        report_name=report_name,
+        prometheus_textfile=metrics_settings.get('PROMETHEUS_TEXTFILE', ''),
+        pushgateway_url=metrics_settings.get('PUSHGATEWAY_URL', ''),
+    )
+
+    return _recorder
+
+
+def get_recorder():
+    """
+    Return the metrics recorder of the process, None when metrics are disabled.
+    """
+    return _recorder
+
+
+def get_worker_metrics():
+    """
+    Return the picklable settings that configure_worker_metrics needs to record the stages
+    of a worker process in the current run, None when metrics are disabled.
+
+    Returns:
+        Tuple of (metrics file, report name, run id), or None.
+    """
+    if _recorder is None:
+        return None
+
+    return (_recorder.metrics_file, _recorder.report_name, _recorder.run_id)
+
+
+def configure_worker_metrics(worker_metrics):
+    """
+    Enable the metrics of a worker process with the settings of get_worker_metrics.
+
+    The worker processes started with spawn or forkserver do not inherit the recorder of the
+    parent process, and their stage lines must have the run id of the parent to be in its totals.
+    """
+    global _recorder  # pylint: disable=global-statement
+
+    if not worker_metrics:
+        _recorder = None
+        return
+
+    metrics_file, report_name, run_id = worker_metrics
+    _recorder = MetricsRecorder(metrics_file=metrics_file, report_name=report_name, run_id=run_id)
+
+
+@contextmanager
+def stage(stage_name, **labels):
+    """
+    Measure the stage and record its metrics.
+
+    Usage:
+        with stage('csv_write', course=course_id) as stage_metrics:
+            ...
+            stage_metrics.rows = len(rows)
+
+    Args:
+        stage_name: Name of the pipeline stage.
+        labels: Additional values of the metrics line, e.g. course or url.
+    Yields:
+        StageMetrics object.
+    """
+    stage_metrics = StageMetrics(stage_name, labels)
+    recorder = _recorder
+
+    if recorder is None:
+        yield stage_metrics
+        return
+
+    started_at = datetime.now()
+    start = perf_counter()
+
+    try:
+        yield stage_metrics
+    except BaseException as error:
+        stage_metrics.labels['error'] = type(error).__name__
+        raise
+    finally:
+        recorder.record(stage_metrics, started_at, perf_counter() - start)
+
+
+def peak_rss_mb():
+    """
+    Return the peak resident memory of the process in MB.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS and in kilobytes on Linux.
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+    return round(usage / float(divisor), 2)
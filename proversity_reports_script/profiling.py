@@ -0,0 +1,223 @@
+"""
+Profiling mode of the report backend stage.
+
+Enabled with the --profile argument of fetch_report.py, every course processed by the backend
+writes its profile files to result/profile/, named after the report and the course:
+
+    cprofile: {report}-{course}.pstats, loadable with pstats or snakeviz, and a -pstats.txt summary.
+    tracemalloc: {report}-{course}-tracemalloc.txt with the top allocating lines.
+    sampling: {report}-{course}.folded, the sampled stacks in the folded format
+    read by flamegraph.pl and speedscope.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+
+PROFILE_MODES = ('cprofile', 'tracemalloc', 'sampling')
+PROFILE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'result', 'profile')
+SAMPLING_INTERVAL = 0.005
+TOP_STATS_LIMIT = 40
+TRACEMALLOC_FRAMES = 10
+
+
+class StackSampler(object):
+    """
+    Samples the stack of one thread from a background thread.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLING_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Start sampling.
+        """
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stop sampling and wait for the sampling thread.
+        """
+        self.stop_event.set()
+        self.thread.join()
+
+    def run(self):
+        """
+        Take a sample every interval until it's stopped.
+        """
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)  # pylint: disable=protected-access
+            stack = []
+
+            while frame is not None:
+                stack.append('{} ({}:{})'.format(
+                    frame.f_code.co_name,
+                    os.path.basename(frame.f_code.co_filename),
+                    frame.f_code.co_firstlineno,
+                ))
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_folded_stacks(self, file_path):
+        """
+        Write the samples in the folded stacks format: one 'root;...;leaf count' line per stack.
+        """
+        with open(file_path, 'w') as folded_file:
+            for stack, count in self.stacks.most_common():
+                folded_file.write('{} {}\n'.format(stack, count))
+
+
+class ProfiledCourseTask(object):
+    """
+    Picklable wrapper of a course task that profiles every call.
+    """
+
+    def __init__(self, course_task, report_name, profile_modes):
+        self.course_task = course_task
+        self.report_name = report_name
+        self.profile_modes = profile_modes
+
+    def __call__(self, course_id, course_data):
+        with profile(self.report_name, course_id, self.profile_modes):
+            return self.course_task(course_id, course_data)
+
+
+def parse_profile_modes(profile_argument):
+    """
+    Return the list of profile modes of the --profile argument.
+
+    Args:
+        profile_argument: Comma separated profile modes, or 'all'.
+    Returns:
+        List of profile modes, empty if profiling is disabled.
+    """
+    if not profile_argument:
+        return []
+
+    if profile_argument == 'all':
+        return list(PROFILE_MODES)
+
+    profile_modes = [mode.strip() for mode in profile_argument.split(',') if mode.strip()]
+    unknown_modes = [mode for mode in profile_modes if mode not in PROFILE_MODES]
+
+    if unknown_modes:
+        print('Profile modes {} are not supported. Supported modes: {}.'.format(
+            ', '.join(unknown_modes),
+            ', '.join(PROFILE_MODES),
+        ))
+        exit()
+
+    return profile_modes
+
+
+@contextmanager
+def profile(report_name, tag, profile_modes, profile_directory=PROFILE_DIRECTORY):
+    """
+    Profile the code of the block with the given modes and write the results.
+
+    Args:
+        report_name: Name of the report, prefix of the profile files.
+        tag: Profile tag, e.g. the course id.
+        profile_modes: List of PROFILE_MODES values.
+        profile_directory: Folder to write the profile files.
+    """
+    if not profile_modes:
+        yield
+        return
+
+    os.makedirs(profile_directory, exist_ok=True)
+    file_prefix = os.path.join(
+        profile_directory,
+        re.sub(r'[^A-Za-z0-9_.+-]', '_', '{}-{}'.format(report_name, tag)),
+    )
+    profiler = cProfile.Profile() if 'cprofile' in profile_modes else None
+    sampler = StackSampler(threading.get_ident()).start() if 'sampling' in profile_modes else None
+    start_tracemalloc = 'tracemalloc' in profile_modes and not tracemalloc.is_tracing()
+
+    if start_tracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    if profiler:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+
+        if sampler:
+            sampler.stop()
+
+        # The snapshot is taken before writing the other files, so their allocations are not traced.
+        if 'tracemalloc' in profile_modes and tracemalloc.is_tracing():
+            write_tracemalloc_stats(tracemalloc.take_snapshot(), file_prefix)
+
+            if start_tracemalloc:
+                tracemalloc.stop()
+
+        if profiler:
+            write_pstats(profiler, file_prefix)
+
+        if sampler:
+            sampler.write_folded_stacks('{}.folded'.format(file_prefix))
+
+        print('Profile files written to: {}*'.format(file_prefix))
+
+
+def write_pstats(profiler, file_prefix):
+    """
+    Dump the profiler stats and write the top functions by cumulative and own time.
+    """
+    profiler.dump_stats('{}.pstats'.format(file_prefix))
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+
+    stats.sort_stats('cumulative').print_stats(TOP_STATS_LIMIT)
+    stats.sort_stats('tottime').print_stats(TOP_STATS_LIMIT)
+
+    with open('{}-pstats.txt'.format(file_prefix), 'w') as summary_file:
+        summary_file.write(summary.getvalue())
+
+
+def write_tracemalloc_stats(snapshot, file_prefix):
+    """
+    Write the top allocating lines and tracebacks of the snapshot.
+    """
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+    current_size, peak_size = tracemalloc.get_traced_memory()
+
+    with open('{}-tracemalloc.txt'.format(file_prefix), 'w') as tracemalloc_file:
+        tracemalloc_file.write('Traced memory: {:.1f} MiB, peak: {:.1f} MiB\n\n'.format(
+            current_size / 1024.0 ** 2,
+            peak_size / 1024.0 ** 2,
+        ))
+        tracemalloc_file.write('Top {} lines\n'.format(TOP_STATS_LIMIT))
+
+        for statistic in snapshot.statistics('lineno')[:TOP_STATS_LIMIT]:
+            tracemalloc_file.write('{}\n'.format(statistic))
+
+        tracemalloc_file.write('\nTop {} tracebacks\n'.format(TOP_STATS_LIMIT // 4))
+
+        for statistic in snapshot.statistics('traceback')[:TOP_STATS_LIMIT // 4]:
+            tracemalloc_file.write('\n{}\n'.format(statistic))
+            tracemalloc_file.write('\n'.join(statistic.traceback.format()) + '\n')
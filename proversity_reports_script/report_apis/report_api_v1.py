@@ -1,7 +1,7 @@
 """
 Module containing common functions for requesting API V1 reports.
 """
-from proversity_reports_script.request_module import request_handler
+from proversity_reports_script.request_module import ReportRequestError, RequestTimeoutError, request_handler
 
 
 def get_report_generation_data(*args, **kwargs):
@@ -13,12 +13,18 @@ def get_report_generation_data(*args, **kwargs):
     determined by EXTRA_DATA['MAX_COURSES_PER_REQUEST'] from the report configuration.
     Each response data is collected into one object.
 
+    With EXTRA_DATA['ADAPTIVE_BATCHING'], the groups are sized by AdaptiveCourseBatcher.
+    The most expensive courses of the previous runs are requested first, so their tasks start first.
+
     Keyword args:
         request_data: Dict containing the complete list of courses and other information.
         request_url: Request API URL.
         report_settings: Dict containing the report settings from the config file.
         request_headers: Dict containing some HTTP request headers to perform the request.
         extra_request_data: Dict containing some additional data to add to the request.
+        failed_courses: Dict to collect the courses whose generation request failed, with the error message.
+        deadline: Deadline of the generation requests.
+        course_costs: CourseCostStore with the course costs of the previous runs.
     Returns:
         {
             "data": [
@@ -35,56 +41,166 @@ def get_report_generation_data(*args, **kwargs):
     report_generation_request_data = kwargs.get('request_data', {})
     initial_report_request_url = kwargs.get('request_url', '')
     report_generation_data = {}
-    course_groups = get_course_groups(
-        courses=report_generation_request_data.get('course_ids', []),
-        max_courses_per_request=kwargs.get(
-            'report_settings', {},
-        ).get('EXTRA_DATA', {}).get('MAX_COURSES_PER_REQUEST', 10),
+    failed_courses = kwargs.get('failed_courses', {})
+    extra_data = kwargs.get('report_settings', {}).get('EXTRA_DATA', {})
+    course_costs = kwargs.get('course_costs')
+    courses = report_generation_request_data.get('course_ids', [])
+    course_batcher = AdaptiveCourseBatcher(
+        courses=course_costs.sort_by_cost(courses) if course_costs else courses,
+        max_courses_per_request=extra_data.get('MAX_COURSES_PER_REQUEST', 10),
+        batching_settings=extra_data.get('ADAPTIVE_BATCHING'),
+        course_costs=course_costs,
     )
+    course_group = course_batcher.next_batch()
 
-    for course_group in course_groups:
+    while course_group:
         report_generation_request_data.update({
             'course_ids': course_group,
         })
 
         existing_report_data = report_generation_data.get('data', {})
+        response_stats = {}
 
         print('Report generation requested to: {}'.format(initial_report_request_url))
 
-        response_data = request_handler(
-            request_url=initial_report_request_url,
-            request_data=report_generation_request_data,
-            request_type='POST',
-            request_headers=kwargs.get('request_headers', {}),
-            query_params=kwargs.get('extra_request_data', {}).get('query_params', {}),
-        )
+        try:
+            response_data = request_handler(
+                request_url=initial_report_request_url,
+                request_data=report_generation_request_data,
+                request_type='POST',
+                request_headers=kwargs.get('request_headers', {}),
+                query_params=kwargs.get('extra_request_data', {}).get('query_params', {}),
+                deadline=kwargs.get('deadline'),
+                retry_timeouts=not course_batcher.can_split(course_group),
+                response_stats=response_stats,
+            )
+        except RequestTimeoutError as error:
+            print('Report generation timed out for {} courses, they are requested in smaller groups. {}'.format(
+                len(course_group),
+                error,
+            ))
+            course_batcher.record_timeout(course_group)
+            course_group = course_batcher.next_batch()
+            continue
+        except ReportRequestError as error:
+            # The other course groups are still requested.
+            print('Report generation failed for the courses {}. {}'.format(', '.join(course_group), error))
+            failed_courses.update({course_id: str(error) for course_id in course_group})
+            course_group = course_batcher.next_batch()
+            continue
 
+        course_batcher.record_response(course_group, response_stats['seconds'])
         existing_report_data.update(response_data.get('data', {}))
         report_generation_data.update({
             'data': existing_report_data,
         })
+        course_group = course_batcher.next_batch()
 
     return report_generation_data
 
 
-def get_course_groups(courses, max_courses_per_request):
+class AdaptiveCourseBatcher(object):
     """
-    Return a list of course lists
-    in groups determined by max_courses_per_request value.
+    Splits the courses into the groups of the generation requests.
 
-    Args:
-        courses: Complete list of courses.
-        max_courses_per_request: Maximum number of courses per group.
-    Returns:
-        List of list:
-            [
-                ['course one', 'course two', 'course three', 'course four'],
-                ['course one', ...], ...
-            ]
+    Without batching settings, the groups have max_courses_per_request courses. With them:
+    - A group is also limited by the sum of the course costs of the previous runs (MAX_COST),
+      the unknown courses cost the average of the known ones.
+    - A group that times out (504 or read timeout) is split in half and requested again,
+      the group limits are reduced to the half and they will not grow back to the size of that group.
+    - While the responses take less than FAST_RESPONSE_SECONDS, the group limits are doubled,
+      up to MAX_COURSES courses and MAX_COST.
     """
-    course_groups = []
 
-    for cursor_index in range(0, len(courses), max_courses_per_request):
-        course_groups.append(courses[cursor_index:cursor_index + max_courses_per_request])
+    def __init__(self, courses, max_courses_per_request, batching_settings=None, course_costs=None):
+        """
+        Args:
+            courses: List of course ids.
+            max_courses_per_request: Number of courses of the first group.
+            batching_settings: Dict with the EXTRA_DATA['ADAPTIVE_BATCHING'] settings.
+            course_costs: CourseCostStore with the course costs of the previous runs.
+        """
+        self.pending_courses = list(courses)
+        self.adaptive = batching_settings is not None
+        batching_settings = batching_settings or {}
+        self.batch_size = max(int(max_courses_per_request), 1)
+        self.max_batch_size = max(int(batching_settings.get('MAX_COURSES', self.batch_size * 10)), self.batch_size)
+        self.max_batch_cost = batching_settings.get('MAX_COST')
+        self.batch_cost = self.max_batch_cost
+        # Cost of the cheapest group that timed out, the groups must cost less than it.
+        self.timeout_cost = None
+        self.fast_response_seconds = float(batching_settings.get('FAST_RESPONSE_SECONDS', 5))
+        self.course_costs = course_costs if self.adaptive else None
+        self.default_cost = course_costs.get_default_cost() if self.course_costs else 0
+
+    def get_course_cost(self, course_id):
+        """
+        Return the cost of the course from the previous runs.
+        """
+        if not self.course_costs:
+            return 0
+
+        return self.course_costs.get(course_id, self.default_cost)
+
+    def next_batch(self):
+        """
+        Return the next group of courses, an empty list when there are no courses left.
+        """
+        course_group = []
+        course_group_cost = 0
+
+        while self.pending_courses and len(course_group) < self.batch_size:
+            course_cost = self.get_course_cost(self.pending_courses[0])
+
+            if course_group and not self.fits_batch_cost(course_group_cost + course_cost):
+                break
+
+            course_group.append(self.pending_courses.pop(0))
+            course_group_cost += course_cost
+
+        return course_group
+
+    def fits_batch_cost(self, course_group_cost):
+        """
+        Return True if a group of the given cost is within the cost limits.
+        """
+        if self.batch_cost is not None and course_group_cost > self.batch_cost:
+            return False
+
+        return self.timeout_cost is None or course_group_cost < self.timeout_cost
+
+    def can_split(self, course_group):
+        """
+        Return True if the group is split instead of retried when it times out.
+        """
+        return self.adaptive and len(course_group) > 1
+
+    def record_timeout(self, course_group):
+        """
+        Put back the courses of the group and reduce the group limits to the half of the group.
+        """
+        self.pending_courses[0:0] = course_group
+        self.batch_size = max(len(course_group) // 2, 1)
+        self.max_batch_size = max(min(self.max_batch_size, len(course_group) - 1), 1)
+        course_group_cost = sum(self.get_course_cost(course_id) for course_id in course_group)
+
+        if course_group_cost:
+            self.batch_cost = course_group_cost / 2.0
+
+            if self.timeout_cost is None or course_group_cost < self.timeout_cost:
+                self.timeout_cost = course_group_cost
+
+    def record_response(self, course_group, seconds):
+        """
+        Double the group limits when the response was fast.
+        """
+        if not self.adaptive or seconds > self.fast_response_seconds:
+            return
+
+        self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+
+        if self.batch_cost is not None:
+            self.batch_cost *= 2
 
-    return course_groups
+            if self.max_batch_cost is not None:
+                self.batch_cost = min(self.batch_cost, self.max_batch_cost)
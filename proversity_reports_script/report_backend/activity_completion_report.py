@@ -1,29 +1,26 @@
 """
 Acitivity completion report backend.
 """
-import csv
 import os
 from collections import OrderedDict
 from datetime import datetime
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
-from proversity_reports_script.report_backend.util import get_required_activity_dict
+from proversity_reports_script.report_backend.util import compile_required_activity_extractor
 
 
 class ActivityCompletionReportBackend(AbstractBaseReportBackend):
     """
     Backend for activity completion report.
     """
+    spreadsheet_keys = ('activity_completion_report',)
 
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
         self.bucket_name = extra_data.get('BUCKET_NAME', '')
         self.spreadsheet_range = extra_data.get('SPREADSHEET_RANGE_NAME', 'Sheet1')
 
-        super(ActivityCompletionReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(ActivityCompletionReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
 
     def generate_report(self, json_report_data):
@@ -37,60 +34,73 @@ class ActivityCompletionReportBackend(AbstractBaseReportBackend):
         """
         Process json data to convert into csv format.
         """
-        for course, course_data in iter(json_report_data.get('result', {}).items()):
-            csv_data = generate_csv_dict(course_data)
+        course_results = self.process_courses(
+            json_report_data.get('result', {}).items(),
+            self.build_course_csv_file,
+        )
+
+        sheet_updates = []
 
-            if not csv_data:
+        for course, path_file in course_results:
+            if not path_file:
                 continue
 
-            self.create_csv_file(
-                file_name=course,
-                body_dict=csv_data,
-                course_id=course,
-                headers=csv_data[0].keys(),
-            )
+            self.upload_file_to_storage(course, path_file)
+            sheet_updates.append((
+                path_file,
+                self.get_spreadsheet_route('activity_completion_report', course, self.spreadsheet_range),
+            ))
 
+        self.update_sheets(sheet_updates)
 
-    def create_csv_file(self, file_name, body_dict, course_id, headers, *args, **kwargs):
+
+    def build_course_csv_file(self, course, course_data):
+        """
+        Build the activity completion csv file of the course.
+
+        Returns:
+            Path of the csv file, None when there is no data to write.
+        """
+        csv_data = generate_csv_dict(course_data)
+
+        if not csv_data:
+            return None
+
+        return self.create_csv_file(
+            file_name=course,
+            body_dict=csv_data,
+            headers=csv_data[0].keys(),
+        )
+
+
+    def create_csv_file(self, file_name, body_dict, headers, *args, **kwargs):
         """
         Create the csv file with the passed arguments, and then save it locally.
+
+        Returns:
+            path_file: Path of the csv file.
         """
         path_file = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
             file_name=file_name,
         )
 
-        with open(path_file, mode='w', encoding='utf-8') as csv_file:
-            column_headers = headers
-            writer = csv.DictWriter(csv_file, fieldnames=column_headers)
-
-            writer.writeheader()
-
-            for row in body_dict:
-                writer.writerow(row)
-
-        self.upload_file_to_storage(file_name, path_file)
-        update_sheets_data(
-            file_path=path_file,
-            spreadsheet_id=self.spreadsheet_data.get('activity_completion_report_{}'.format(course_id)),
-            spreadsheet_range_name=self.spreadsheet_range,
-        )
+        return self.write_csv_file(path_file, headers, body_dict)
 
 
     def upload_file_to_storage(self, course, path_file):
         """
         Upload the csv report, to S3 storage.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket(self.bucket_name)
         now = datetime.now()
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            self.bucket_name,
             path_file,
             'reports/{course}/activity_completion_report/{date}.csv'.format(
                 course=course,
                 date=now,
-            )
+            ),
         )
 
 
@@ -99,6 +109,7 @@ def generate_csv_dict(course_data={}):  # pylint: disable=dangerous-default-valu
     Return a csv dict to write the csv file.
     """
     csv_data = []
+    extract_required_activities = compile_required_activity_extractor(course_data[0] if course_data else {})
 
     for user_data in course_data:
         email = user_data.get('email', '')
@@ -111,7 +122,7 @@ def generate_csv_dict(course_data={}):  # pylint: disable=dangerous-default-valu
         dict_writer_data['Last Name'] = last_name
         dict_writer_data['Email'] = email
 
-        dict_writer_data.update(get_required_activity_dict(user_data))
+        dict_writer_data.update(extract_required_activities(user_data))
 
         csv_data.append(dict_writer_data)
 
@@ -2,6 +2,32 @@
 Abstract base class for openedx-proversity-reports.
 """
 import abc
+from collections import OrderedDict
+import csv
+import json
+import os
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar
+
+from proversity_reports_script.delta_store import get_delta_store
+from proversity_reports_script.google_apis.sheets_api import update_spreadsheet_ranges
+from proversity_reports_script.metrics import configure_worker_metrics, get_worker_metrics, stage
+from proversity_reports_script.profiling import ProfiledCourseTask
+from proversity_reports_script.report_backend.output_formats import (
+    ColumnarWriter,
+    get_output_file_path,
+    parse_output_formats,
+)
+from proversity_reports_script.sinks.base import DEFAULT_SHEETS_SINK, DEFAULT_STORAGE_SINK, load_sink
+from proversity_reports_script.spreadsheet_routing import SpreadsheetRouter
+
+DEFAULT_MAX_UPLOAD_WORKERS = 4
+# Course of the course task being run, the report files are stored in the warehouse with it.
+current_course_id = ContextVar('current_course_id', default='')
+# Course task of the worker process, set once per worker process by init_course_worker.
+_worker_course_task = None
 
 
 class AbstractBaseReportBackend(object):
@@ -10,9 +36,52 @@ class AbstractBaseReportBackend(object):
     """
     __metaclass__ = abc.ABCMeta
     spreadsheet_data = []
+    # Spreadsheet keys of the SPREADSHEET_DATA routes of the report (see spreadsheet_routing).
+    spreadsheet_keys = ()
+    max_workers = 1
+    max_upload_workers = 1
+    profile_modes = []
+    course_costs = None
+    output_formats = []
+    delta_store = None
+    warehouse_sink = None
+    # The cross-course reports build one file with every course, the shards of a sharded run
+    # save their report data and the --merge-shards run builds the report (see sharding).
+    cross_course_report = False
 
-    def __init__(self, spreadsheet_data):
+    def __init__(self, spreadsheet_data, extra_data=None):
+        extra_data = extra_data or {}
         self.spreadsheet_data = spreadsheet_data
+        self.spreadsheet_router = SpreadsheetRouter(spreadsheet_data, self.spreadsheet_keys)
+        self.max_workers = int(extra_data.get('MAX_WORKERS', 1))
+        self.max_upload_workers = int(extra_data.get('MAX_UPLOAD_WORKERS', DEFAULT_MAX_UPLOAD_WORKERS))
+        self.report_name = extra_data.get('REPORT_NAME', '')
+        self.profile_modes = extra_data.get('PROFILE_MODES', [])
+        self.course_costs = extra_data.get('COURSE_COSTS')
+        self.output_formats = parse_output_formats(extra_data.get('OUTPUT_FORMATS'))
+        self.output_options = extra_data.get('OUTPUT_OPTIONS', {})
+        self.delta_store = get_delta_store(self.report_name, extra_data.get('DELTA'))
+        self.delta_user_key = (extra_data.get('DELTA') or {}).get('USER_KEY', 'username')
+        self.delta_since = extra_data.get('DELTA_SINCE')
+        self.storage_sink = load_sink(
+            extra_data.get('STORAGE_SINK'),
+            DEFAULT_STORAGE_SINK,
+            extra_data.get('STORAGE_SINK_OPTIONS'),
+        )
+        self.sheets_sink = load_sink(
+            extra_data.get('SHEETS_SINK'),
+            DEFAULT_SHEETS_SINK,
+            extra_data.get('SHEETS_SINK_OPTIONS'),
+        )
+        self.run_id = extra_data.get('RUN_ID') or uuid.uuid4().hex
+
+        if extra_data.get('WAREHOUSE_SINK'):
+            self.warehouse_sink = load_sink(
+                extra_data.get('WAREHOUSE_SINK'),
+                None,
+                extra_data.get('WAREHOUSE_SINK_OPTIONS'),
+            )
+            self.warehouse_sink.start_run(self.run_id, self.report_name)
 
 
     @abc.abstractmethod
@@ -46,3 +115,335 @@ class AbstractBaseReportBackend(object):
         """
         raise NotImplementedError()
 
+
+    def write_csv_file(self, file_path, headers, rows, csv_row_formatter=None):
+        """
+        Write the rows into the csv file, and into the EXTRA_DATA['OUTPUT_FORMATS'] files
+        and the EXTRA_DATA['WAREHOUSE_SINK'] in the same pass over the rows (see output_formats).
+
+        Args:
+            file_path: Path of the csv file.
+            headers: List with the csv column names.
+            rows: Iterable of dicts, one per csv row.
+            csv_row_formatter: Function that returns the csv values of a row, e.g. to
+                               replace the booleans. The columnar files get the original values.
+        Returns:
+            file_path: Path of the csv file.
+        """
+        headers = list(headers)
+        columnar_writer = None
+        warehouse_rows = [] if self.warehouse_sink else None
+
+        if self.output_formats:
+            columnar_writer = ColumnarWriter(headers, self.output_formats, self.output_options)
+
+        with stage('csv_write', file=os.path.basename(file_path)) as csv_stage:
+            with open(file_path, mode='w', encoding='utf-8') as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=headers)
+
+                writer.writeheader()
+
+                for row in rows:
+                    if columnar_writer:
+                        columnar_writer.add_row(row)
+
+                    if warehouse_rows is not None:
+                        warehouse_rows.append(row)
+
+                    writer.writerow(csv_row_formatter(row) if csv_row_formatter else row)
+                    csv_stage.rows += 1
+
+            csv_stage.bytes = os.path.getsize(file_path)
+
+        if columnar_writer:
+            with stage('columnar_write', file=os.path.basename(file_path)) as columnar_stage:
+                columnar_stage.rows = csv_stage.rows
+                columnar_stage.bytes = sum(
+                    os.path.getsize(output_file_path)
+                    for output_file_path in columnar_writer.write(file_path)
+                )
+
+        if warehouse_rows is not None:
+            course_id = current_course_id.get()
+            self.warehouse_sink.write_rows(
+                self.run_id,
+                self.report_name,
+                course_id,
+                get_table_name(file_path, course_id),
+                warehouse_rows,
+            )
+
+        return file_path
+
+    def upload_report_files(self, bucket_name, file_path, key):
+        """
+        Upload the csv file and its EXTRA_DATA['OUTPUT_FORMATS'] files to the storage,
+        the key of every format file has the extension of the format instead of .csv.
+
+        Args:
+            bucket_name: Name of the storage bucket.
+            file_path: Path of the csv file.
+            key: Storage key of the csv file.
+        """
+        self.storage_sink.upload_file(bucket_name, file_path, key)
+
+        for output_format in self.output_formats:
+            output_file_path = get_output_file_path(file_path, output_format)
+
+            if os.path.exists(output_file_path):
+                self.storage_sink.upload_file(
+                    bucket_name,
+                    output_file_path,
+                    get_output_file_path(key, output_format),
+                )
+
+    def upload_files(self, uploads):
+        """
+        Upload the report files with upload_file_to_storage, with up to MAX_UPLOAD_WORKERS concurrent uploads.
+
+        Args:
+            uploads: List of the argument tuples of upload_file_to_storage.
+        """
+        if self.max_upload_workers <= 1 or len(uploads) <= 1:
+            for upload_args in uploads:
+                self.upload_file_to_storage(*upload_args)
+
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.max_upload_workers, len(uploads))) as executor:
+            upload_futures = [executor.submit(self.upload_file_to_storage, *upload_args) for upload_args in uploads]
+
+            for upload_future in upload_futures:
+                # The first upload error is raised, as with the sequential uploads.
+                upload_future.result()
+
+    def get_spreadsheet_route(self, spreadsheet_key, course_id='', range_name='Sheet1'):
+        """
+        Return the SpreadsheetRoute of a report file, None when it has no spreadsheet.
+
+        Args:
+            spreadsheet_key: One of the spreadsheet_keys of the report.
+            course_id: Course of the report file, empty for the reports that are not per course.
+            range_name: Range name of the report file, used when the route does not set one.
+        """
+        return self.spreadsheet_router.get_route(spreadsheet_key, course_id, range_name)
+
+    def update_sheets(self, sheet_updates):
+        """
+        Write the report files into their spreadsheet ranges, the files of the same
+        spreadsheet are written together with batch requests (see update_spreadsheet_ranges).
+
+        Args:
+            sheet_updates: List of (csv file path, SpreadsheetRoute) tuples, the route can be None.
+        """
+        spreadsheet_updates = OrderedDict()
+
+        for file_path, route in sheet_updates:
+            if not route:
+                print('Spreadsheet id was not provided and the report cannot be updated on Google Sheets.')
+                continue
+
+            spreadsheet_updates.setdefault(route.spreadsheet_id, []).append((file_path, route))
+
+        for spreadsheet_id, file_routes in spreadsheet_updates.items():
+            update_spreadsheet_ranges(
+                spreadsheet_id,
+                [(file_path, route.range_name) for file_path, route in file_routes],
+                sheets_sink=self.sheets_sink,
+                delta_store=self.delta_store,
+                sheet_titles=[route.sheet_title for _, route in file_routes if route.sheet_title],
+            )
+
+    def merge_delta_users(self, report_data):
+        """
+        Return the report data with the users of every course merged into the users of the previous runs.
+
+        In delta mode, when the 'since' field is sent with the report request (see DELTA_SINCE),
+        the LMS only returns the users changed since the last run, they are merged into the
+        users stored by the previous runs so the report files still have every user.
+        The full runs (empty 'since' value) replace the stored users.
+
+        Args:
+            report_data: Dict of course id to the list of user data dicts.
+        Returns:
+            Dict of course id to the list of user data dicts.
+        """
+        if not self.delta_store or self.delta_since is None:
+            return report_data
+
+        return {
+            course_id: self.delta_store.merge_course_users(
+                course_id,
+                users,
+                self.delta_user_key,
+                merge=bool(self.delta_since),
+            )
+            for course_id, users in report_data.items()
+        }
+
+    def process_courses(self, course_items, course_task):
+        """
+        Run the course task for every course and return the results in the same order of the courses.
+
+        The courses are processed serially unless EXTRA_DATA['MAX_WORKERS'] is greater than 1,
+        in that case every course is processed by a worker process. The course task, with the
+        backend and its shared data, and the metrics settings of the run are sent once to every
+        worker process by the pool initializer, and for every course the course data is written
+        into a temporary json file and only the course id and its path are sent to the worker.
+
+        The course task should only build the local files, the uploads must be done by
+        the parent process with the returned results.
+
+        The worker processes get the most expensive courses first, by the course costs of
+        EXTRA_DATA['COURSE_COSTS'] or by the size of the course data when some cost is unknown,
+        so a big course does not start last and delay the whole report.
+
+        When EXTRA_DATA['PROFILE_MODES'] is set (see the --profile argument), every
+        course task is profiled.
+
+        Args:
+            course_items: Iterable of (course_id, course_data) tuples.
+            course_task: Picklable callable, it's called as course_task(course_id, course_data).
+        Returns:
+            List of (course_id, course task result) tuples.
+        """
+        course_items = list(course_items)
+
+        if self.profile_modes:
+            course_task = ProfiledCourseTask(course_task, self.report_name, self.profile_modes)
+
+        if self.max_workers <= 1 or len(course_items) <= 1:
+            return [
+                (course_id, run_instrumented_course_task(course_task, course_id, course_data))
+                for course_id, course_data in course_items
+            ]
+
+        course_futures = {}
+
+        with ProcessPoolExecutor(
+            max_workers=min(self.max_workers, len(course_items)),
+            initializer=init_course_worker,
+            initargs=(course_task, get_worker_metrics()),
+        ) as executor:
+            for item_index in self.get_course_schedule(course_items):
+                course_id, course_data = course_items[item_index]
+                course_futures[item_index] = executor.submit(
+                    run_course_task,
+                    course_id,
+                    dump_course_payload(course_data),
+                )
+
+            return [
+                (course_id, course_futures[item_index].result())
+                for item_index, (course_id, _) in enumerate(course_items)
+            ]
+
+    def get_course_schedule(self, course_items):
+        """
+        Return the indexes of the course items sorted by cost, the most expensive first.
+
+        Args:
+            course_items: List of (course_id, course_data) tuples.
+        Returns:
+            List of indexes of course_items.
+        """
+        course_costs = [
+            self.course_costs.get(course_id) if self.course_costs else None
+            for course_id, _ in course_items
+        ]
+
+        # The costs of different sources cannot be compared, so the data size is used for every course.
+        if None in course_costs:
+            course_costs = [get_course_data_size(course_data) for _, course_data in course_items]
+
+        return sorted(range(len(course_items)), key=lambda item_index: course_costs[item_index], reverse=True)
+
+
+def get_course_data_size(course_data):
+    """
+    Return an estimate of the size of the course data: the number of items of its lists and dicts.
+    """
+    if isinstance(course_data, dict):
+        return sum(get_course_data_size(value) for value in course_data.values()) or len(course_data)
+
+    if isinstance(course_data, (list, tuple)):
+        return len(course_data)
+
+    return 0
+
+
+def dump_course_payload(course_data):
+    """
+    Write the course data into a temporary json file.
+
+    Args:
+        course_data: Report json data of one course.
+    Returns:
+        payload_path: Path of the temporary file.
+    """
+    file_descriptor, payload_path = tempfile.mkstemp(prefix='course-payload-', suffix='.json')
+
+    with os.fdopen(file_descriptor, mode='w', encoding='utf-8') as payload_file:
+        json.dump(course_data, payload_file)
+
+    return payload_path
+
+
+def init_course_worker(course_task, worker_metrics=None):
+    """
+    Set the course task and the metrics of the worker process, it's the initializer of the worker processes.
+
+    Args:
+        course_task: Course task of the worker process.
+        worker_metrics: Metrics settings of the run, see get_worker_metrics.
+    """
+    global _worker_course_task  # pylint: disable=global-statement
+    _worker_course_task = course_task
+    configure_worker_metrics(worker_metrics)
+
+
+def run_course_task(course_id, payload_path):
+    """
+    Load the course data from the temporary file and run the course task of the worker on it.
+    This is the entry point of the worker processes.
+
+    Args:
+        course_id: Course key value.
+        payload_path: Path of the temporary file containing the course data.
+    Returns:
+        The course task result.
+    """
+    try:
+        with open(payload_path, mode='r', encoding='utf-8') as payload_file:
+            course_data = json.load(payload_file)
+    finally:
+        os.remove(payload_path)
+
+    return run_instrumented_course_task(_worker_course_task, course_id, course_data)
+
+
+def run_instrumented_course_task(course_task, course_id, course_data):
+    """
+    Run the course task recording the backend_transform stage metrics.
+    The stage includes the csv_write stages of the course files.
+    """
+    course_token = current_course_id.set(course_id)
+
+    try:
+        with stage('backend_transform', course=course_id):
+            return course_task(course_id, course_data)
+    finally:
+        current_course_id.reset(course_token)
+
+
+def get_table_name(file_path, course_id):
+    """
+    Return the warehouse table name of the report file: the file name without the course id
+    and the extension, e.g. 'teams' for '{course id}-teams.csv', 'report' for '{course id}.csv'.
+    """
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    if course_id:
+        file_name = file_name.replace(course_id, '').strip('-_')
+
+    return file_name or 'report'
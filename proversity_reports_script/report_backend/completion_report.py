@@ -1,14 +1,10 @@
 """
 Report backend for completion report.
 """
-import csv
 import os
 from collections import OrderedDict
 from datetime import datetime
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
 
 
@@ -16,10 +12,11 @@ class CompletionReportBackend(AbstractBaseReportBackend):
     """
     Backend for Completion report.
     """
+    spreadsheet_keys = ('completion_sheet_id', 'general_course_sheet_id')
 
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
-        super(CompletionReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(CompletionReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
     def generate_report(self, json_report_data):
         """
@@ -37,108 +34,125 @@ class CompletionReportBackend(AbstractBaseReportBackend):
             print('No report data...')
             exit()
 
-        course_list = report_data.keys()
-
-
-        for course in course_list:
-            course_data = report_data.get(course, [])
-            csv_data = []
-            general_course_data = {}
-
-            for user in course_data:
-                username = user.get('username', '')
-                user_id = user.get('user_id', '')
-                cohort = user.get('cohort', '')
-                team = user.get('team', '')
-                vertical_components = user.get('vertical', {})
-
-                vertical = OrderedDict()
-
-                for component in vertical_components:
-
-                    name = '{}-{}'.format(component.get('subsection_name'), component.get('name'))
-                    name = self._verify_name(name, vertical)
-                    vertical[name] = component.get('complete')
-
-                    unit = general_course_data.get(component.get('number'))
-
-                    if not unit:
-                        unit_data = OrderedDict()
-                        unit_data['Section Number'] = component.get('section_number')
-                        unit_data['Section'] = '{}-{}'.format(component.get('section_number'), component.get('section_name'))
-                        unit_data['Subsection Number'] = component.get('subsection_number')
-                        unit_data['Subsection'] = '{}-{}'.format(component.get('subsection_number'), component.get('subsection_name'))
-                        unit_data['Unit Number'] = component.get('number')
-                        unit_data['Unit'] = name
-                        unit_data['Complete'] = 1 if component.get('complete') else 0
-                        unit_data['Incomplete'] = 0 if component.get('complete') else 1
-                        general_course_data[component.get('number')] = unit_data
-                    else:
-                        unit['Complete'] = 1 + unit['Complete'] if component.get('complete') else unit['Complete']
-                        unit['Incomplete'] = unit['Incomplete'] if component.get('complete') else 1 + unit['Incomplete']
-
-                od = OrderedDict()
-                od['username'] = username
-                od['user_id'] = user_id
-                od['cohort'] = cohort
-                od['team'] = team
-                od.update(vertical)
-                csv_data.append(od)
-
-            self.create_csv_file(
-                course,
-                csv_data,
-                self.spreadsheet_data.get('completion_sheet_id_{}'.format(course)),
-            )
-            self.create_csv_file(
-                'general_course_data-{}'.format(course),
-                [general_course_data[key]for key in general_course_data],
-                self.spreadsheet_data.get('general_course_sheet_id_{}'.format(course)),
-            )
+        report_data = self.merge_delta_users(report_data)
+        course_results = self.process_courses(report_data.items(), self.build_course_csv_files)
+        sheet_updates = []
 
-    def create_csv_file(self, course, body_dict, spreadsheet_id):
+        for _, csv_files in course_results:
+            for file_name, path_file, spreadsheet_route in csv_files:
+                self.upload_file_to_storage(file_name, path_file)
+                sheet_updates.append((path_file, spreadsheet_route))
+
+        self.update_sheets(sheet_updates)
+
+    def build_course_csv_files(self, course, course_data):
+        """
+        Build the completion and the general course csv files of the course.
+
+        Args:
+            course: Course key value.
+            course_data: List with the completion data per user.
+        Returns:
+            List of (file name, csv file path, spreadsheet route) tuples.
+        """
+        csv_data = []
+        general_course_data = {}
+
+        for user in course_data:
+            username = user.get('username', '')
+            user_id = user.get('user_id', '')
+            cohort = user.get('cohort', '')
+            team = user.get('team', '')
+            vertical_components = user.get('vertical', {})
+
+            vertical = OrderedDict()
+
+            for component in vertical_components:
+
+                name = '{}-{}'.format(component.get('subsection_name'), component.get('name'))
+                name = self._verify_name(name, vertical)
+                vertical[name] = component.get('complete')
+
+                unit = general_course_data.get(component.get('number'))
+
+                if not unit:
+                    unit_data = OrderedDict()
+                    unit_data['Section Number'] = component.get('section_number')
+                    unit_data['Section'] = '{}-{}'.format(component.get('section_number'), component.get('section_name'))
+                    unit_data['Subsection Number'] = component.get('subsection_number')
+                    unit_data['Subsection'] = '{}-{}'.format(component.get('subsection_number'), component.get('subsection_name'))
+                    unit_data['Unit Number'] = component.get('number')
+                    unit_data['Unit'] = name
+                    unit_data['Complete'] = 1 if component.get('complete') else 0
+                    unit_data['Incomplete'] = 0 if component.get('complete') else 1
+                    general_course_data[component.get('number')] = unit_data
+                else:
+                    unit['Complete'] = 1 + unit['Complete'] if component.get('complete') else unit['Complete']
+                    unit['Incomplete'] = unit['Incomplete'] if component.get('complete') else 1 + unit['Incomplete']
+
+            od = OrderedDict()
+            od['username'] = username
+            od['user_id'] = user_id
+            od['cohort'] = cohort
+            od['team'] = team
+            od.update(vertical)
+            csv_data.append(od)
+
+        csv_files = []
+
+        for file_name, body_dict, spreadsheet_route in (
+                (
+                    course,
+                    csv_data,
+                    self.get_spreadsheet_route('completion_sheet_id', course),
+                ),
+                (
+                    'general_course_data-{}'.format(course),
+                    [general_course_data[key]for key in general_course_data],
+                    self.get_spreadsheet_route('general_course_sheet_id', course),
+                ),
+        ):
+            path_file = self.create_csv_file(file_name, body_dict)
+
+            if path_file:
+                csv_files.append((file_name, path_file, spreadsheet_route))
+
+        return csv_files
+
+    def create_csv_file(self, course, body_dict):
         """
         Creates the csv file with the passed arguments, and then save it locally.
+
+        Returns:
+            path_file: Path of the csv file, None when there is no data to write.
         """
         path_file = '{parent_folder}/result/{course}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
             course=course
         )
         if body_dict:
-            with open(path_file, mode='w', encoding='utf-8') as csv_file:
-                column_headers = body_dict[0].keys()
-                writer = csv.DictWriter(csv_file, fieldnames=column_headers)
-
-                writer.writeheader()
-                static_headers = ['user_id', 'username', 'cohort', 'team']
-
-                for row in body_dict:
-                    for key, value in row.items():
-                        if key not in static_headers:
-                            if not value and isinstance(value, bool):
-                                row[key] = ''
-                            elif isinstance(value, bool):
-                                row[key] = 'X'
-
-                    writer.writerow(row)
+            return self.write_csv_file(
+                path_file,
+                body_dict[0].keys(),
+                body_dict,
+                csv_row_formatter=format_completion_row,
+            )
 
-            self.upload_file_to_storage(course, path_file)
-            update_sheets_data(path_file, spreadsheet_id)
+        return None
 
     def upload_file_to_storage(self, course, path_file):
         """
         Uploads the csv report, to S3 storage.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket('proversity-custom-reports')
         now = datetime.now()
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            'proversity-custom-reports',
             path_file,
             'cabinet/{course}/completion_report/{date}.csv'.format(
                 course=course,
                 date=now
-            )
+            ),
         )
 
     def _verify_name(self, name, data):
@@ -156,3 +170,19 @@ class CompletionReportBackend(AbstractBaseReportBackend):
             name = self._verify_name(name, data)
 
         return name
+
+
+def format_completion_row(row):
+    """
+    Return the completion row with the boolean values replaced by 'X' or an empty string.
+    """
+    static_headers = ['user_id', 'username', 'cohort', 'team']
+    csv_row = OrderedDict()
+
+    for key, value in row.items():
+        if key not in static_headers and isinstance(value, bool):
+            value = 'X' if value else ''
+
+        csv_row[key] = value
+
+    return csv_row
@@ -1,14 +1,10 @@
 """
 Enrollment per site report backend.
 """
-import csv
 import os
 from collections import OrderedDict
 from datetime import datetime, timedelta
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
 
 
@@ -16,13 +12,16 @@ class EnrollmentPerSiteReport(AbstractBaseReportBackend):
     """
     Enrollment per site report class.
     """
+    spreadsheet_keys = ('enrollment_per_site',)
+    cross_course_report = True
+
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
         self.bucket_name = extra_data.get('BUCKET_NAME', '')
         self.site_name = getattr(extra_data.get('extra_arguments', {}), 'site_name', '')
         self.active_license_time = extra_data.get('ACTIVE_LICENSE_TIME_IN_DAYS', 365)
 
-        super(EnrollmentPerSiteReport, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(EnrollmentPerSiteReport, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
     def generate_report(self, json_report_data):
         """
@@ -67,16 +66,21 @@ class EnrollmentPerSiteReport(AbstractBaseReportBackend):
 
             report_data_per_courses.append(row_data)
 
-        self.create_csv_file(
-            file_name='enrollment-report',
-            body_dict=report_data,
-            spreadsheet_range_name='Sheet1',
-        )
-        self.create_csv_file(
-            file_name='enrollment-report-per-courses',
-            body_dict=report_data_per_courses,
-            spreadsheet_range_name='Sheet2',
-        )
+        self.update_sheets([
+            sheet_update for sheet_update in (
+                self.create_csv_file(
+                    file_name='enrollment-report',
+                    body_dict=report_data,
+                    spreadsheet_range_name='Sheet1',
+                ),
+                self.create_csv_file(
+                    file_name='enrollment-report-per-courses',
+                    body_dict=report_data_per_courses,
+                    spreadsheet_range_name='Sheet2',
+                ),
+            )
+            if sheet_update
+        ])
 
     def create_csv_file(self, file_name, body_dict, spreadsheet_range_name):
         """
@@ -87,6 +91,8 @@ class EnrollmentPerSiteReport(AbstractBaseReportBackend):
             body_dict: Dict with the data to write the csv file.
             spreadsheet_range_name: Range name to update the spreadsheet file in A notation:
             https://developers.google.com/sheets/api/guides/concepts#a1_notation
+        Returns:
+            Tuple with the csv file path and its spreadsheet route, None when there is no data to write.
         """
         file_path = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
@@ -98,20 +104,10 @@ class EnrollmentPerSiteReport(AbstractBaseReportBackend):
         except IndexError:
             return None
 
-        with open(file_path, mode='w', encoding='utf-8') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=headers)
-
-            writer.writeheader()
-
-            for row in body_dict:
-                writer.writerow(row)
-
+        self.write_csv_file(file_path, headers, body_dict)
         self.upload_file_to_storage(file_path, file_name)
-        update_sheets_data(
-            file_path,
-            self.spreadsheet_data.get('enrollment_per_site', ''),
-            spreadsheet_range_name,
-        )
+
+        return file_path, self.get_spreadsheet_route('enrollment_per_site', range_name=spreadsheet_range_name)
 
     def upload_file_to_storage(self, path_file, file_name_prefix):
         """
@@ -121,18 +117,17 @@ class EnrollmentPerSiteReport(AbstractBaseReportBackend):
             path_file: CSV report local file path.
             file_name_prefix: Name prefix of the CSV report file.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket(self.bucket_name)
 
         print('S3 Uploading file {} to {}'.format(path_file, self.bucket_name))
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            self.bucket_name,
             path_file,
             'enrollment_per_site_report/{site_name}/{prefix}-{date}.csv'.format(
                 site_name=self.site_name,
                 prefix=file_name_prefix,
                 date=datetime.now(),
-            )
+            ),
         )
 
 
@@ -1,14 +1,10 @@
 """
 Last login report backend.
 """
-import csv
 import os
 from collections import OrderedDict
 from datetime import datetime
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
 
 
@@ -16,6 +12,7 @@ class LastLoginReportBackend(AbstractBaseReportBackend):
     """
     Backend for last login report.
     """
+    spreadsheet_keys = ('last_login_report',)
 
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
@@ -23,7 +20,7 @@ class LastLoginReportBackend(AbstractBaseReportBackend):
         self.bucket_root_path = extra_data.get('BUCKET_ROOT_PATH', 'reports')
         self.spreadsheet_range = extra_data.get('SPREADSHEET_RANGE_NAME', 'Sheet1')
 
-        super(LastLoginReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(LastLoginReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
     def generate_report(self, json_report_data):
         """
@@ -42,21 +39,45 @@ class LastLoginReportBackend(AbstractBaseReportBackend):
             print('No report data...')
             exit()
 
-        for course_id, course_data in json_report_data.items():
-            self.create_csv_file(
-                file_name=course_id,
-                body_dict=build_csv_rows_data(course_data),
-                course_id=course_id,
-            )
+        course_results = self.process_courses(json_report_data.items(), self.build_course_csv_file)
+        sheet_updates = []
+
+        for course_id, file_path in course_results:
+            if not file_path:
+                continue
+
+            self.upload_file_to_storage(course_id, file_path)
+            sheet_updates.append((
+                file_path,
+                self.get_spreadsheet_route('last_login_report', course_id, self.spreadsheet_range),
+            ))
+
+        self.update_sheets(sheet_updates)
+
+    def build_course_csv_file(self, course_id, course_data):
+        """
+        Build the last login csv file of the course.
+
+        Args:
+            course_id: Course key value.
+            course_data: List with the last login data per user.
+        Returns:
+            Path of the csv file, None when there is no data to write.
+        """
+        return self.create_csv_file(
+            file_name=course_id,
+            body_dict=build_csv_rows_data(course_data),
+        )
 
-    def create_csv_file(self, file_name, body_dict, course_id):
+    def create_csv_file(self, file_name, body_dict):
         """
         Creates the csv file with the passed arguments, and then save it locally.
 
         Args:
             file_name: File string name.
             body_dict: Dict with the data to write the csv file.
-            course_id: Course key value.
+        Returns:
+            file_path: Path of the csv file, None when there is no data to write.
         """
         file_path = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
@@ -68,20 +89,7 @@ class LastLoginReportBackend(AbstractBaseReportBackend):
         except IndexError:
             return None
 
-        with open(file_path, mode='w', encoding='utf-8') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=headers)
-
-            writer.writeheader()
-
-            for row in body_dict:
-                writer.writerow(row)
-
-        self.upload_file_to_storage(course_id, file_path)
-        update_sheets_data(
-            file_path=file_path,
-            spreadsheet_id=self.spreadsheet_data.get('last_login_report_{}'.format(course_id)),
-            spreadsheet_range_name=self.spreadsheet_range,
-        )
+        return self.write_csv_file(file_path, headers, body_dict)
 
     def upload_file_to_storage(self, course, path_file):
         """
@@ -91,19 +99,18 @@ class LastLoginReportBackend(AbstractBaseReportBackend):
             course: Course string id.
             path_file: CSV report local file path.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket(self.bucket_name)
         now = datetime.now()
 
         print('S3 Uploading file {} to {}'.format(path_file, self.bucket_name))
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            self.bucket_name,
             path_file,
             '{root}/{course}/last_login_report/{date}.csv'.format(
                 root=self.bucket_root_path,
                 course=course,
                 date=now,
-            )
+            ),
         )
 
 
@@ -1,13 +1,9 @@
 """
 Last page accessed reports backend.
 """
-import csv
 from datetime import datetime
 import os
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
 
 
@@ -15,10 +11,11 @@ class LastPageAccessedReportBackend(AbstractBaseReportBackend):
     """
     Backend for last time report accessed.
     """
+    spreadsheet_keys = ('last_page_accessed_table', 'last_page_accessed_bar_char')
 
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
-        super(LastPageAccessedReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(LastPageAccessedReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
 
     def generate_report(self, json_report_data):
@@ -38,81 +35,109 @@ class LastPageAccessedReportBackend(AbstractBaseReportBackend):
             print('No report data...')
             exit()
 
-        if report_data.get('last_page_data'):
-            last_page_data = report_data.get('last_page_data')
-            for course in last_page_data.keys():
-                last_page_report = last_page_accessed_report(course, last_page_data)
-                last_page_report_headers = [
-                    'username',
-                    'user_cohort',
-                    'user_teams',
-                    'last_time_accessed',
-                    'last_page_viewed',
-                ]
-                file_name = '{}-table'.format(course)
+        last_page_data = report_data.get('last_page_data', {})
+        exit_count_data = report_data.get('exit_count_data', {})
+        course_items = []
+
+        for course in last_page_data.keys():
+            course_items.append((course, {
+                'last_page_data': last_page_data.get(course, []),
+                'exit_count_data': exit_count_data.get(course, []) if exit_count_data else None,
+            }))
+
+        course_results = self.process_courses(course_items, self.build_course_csv_files)
+        sheet_updates = []
+
+        for _, csv_files in course_results:
+            for file_name, path_file, spreadsheet_route in csv_files:
+                self.upload_file_to_storage(file_name, path_file)
+                sheet_updates.append((path_file, spreadsheet_route))
+
+        self.update_sheets(sheet_updates)
 
-                self.create_csv_file(
-                    file_name,
-                    last_page_report,
-                    last_page_report_headers,
-                    self.spreadsheet_data.get('last_page_accessed_table_{}'.format(course)),
-                )
-
-        if report_data.get('exit_count_data'):
-            exit_count_data = report_data.get('exit_count_data')
-            for course in last_page_data.keys():
-                exit_count_report_data = exit_count_report(course, exit_count_data)
-                exit_count_report_headers = [
-                    'page_title',
-                    'exit_count',
-                    'position',
-                    'section',
-                ]
-                file_name = '{}-bar-chart'.format(course)
 
+    def build_course_csv_files(self, course, course_data):
+        """
+        Build the last page accessed table and the exit count bar chart csv files of the course.
+
+        Args:
+            course: Course key value.
+            course_data: Dict containing the last page data and the exit count data of the course.
+        Returns:
+            List of (file name, csv file path, spreadsheet route) tuples.
+        """
+        csv_files = []
+        last_page_report = last_page_accessed_report(course, {course: course_data.get('last_page_data', [])})
+        last_page_report_headers = [
+            'username',
+            'user_cohort',
+            'user_teams',
+            'last_time_accessed',
+            'last_page_viewed',
+        ]
+        file_name = '{}-table'.format(course)
+
+        csv_files.append((
+            file_name,
+            self.create_csv_file(
+                file_name,
+                last_page_report,
+                last_page_report_headers,
+            ),
+            self.get_spreadsheet_route('last_page_accessed_table', course),
+        ))
+
+        if course_data.get('exit_count_data') is not None:
+            exit_count_report_data = exit_count_report(course, {course: course_data.get('exit_count_data')})
+            exit_count_report_headers = [
+                'page_title',
+                'exit_count',
+                'position',
+                'section',
+            ]
+            file_name = '{}-bar-chart'.format(course)
+
+            csv_files.append((
+                file_name,
                 self.create_csv_file(
                     file_name,
                     exit_count_report_data,
                     exit_count_report_headers,
-                    self.spreadsheet_data.get('last_page_accessed_bar_char_{}'.format(course))
-                )
+                ),
+                self.get_spreadsheet_route('last_page_accessed_bar_char', course),
+            ))
+
+        return csv_files
 
 
-    def create_csv_file(self, file_name, body_dict, headers, spreadsheet_id):
+    def create_csv_file(self, file_name, body_dict, headers):
         """
         Creates the csv file with the passed arguments, and then save it locally.
+
+        Returns:
+            path_file: Path of the csv file.
         """
         path_file = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
             file_name=file_name
         )
 
-        with open(path_file, mode='w', encoding='utf-8') as csv_file:
-            column_headers = headers
-            writer = csv.DictWriter(csv_file, fieldnames=column_headers)
-
-            writer.writeheader()
-            for row in body_dict:
-                writer.writerow(row)
-
-        self.upload_file_to_storage(file_name, path_file)
-        update_sheets_data(path_file, spreadsheet_id)
+        return self.write_csv_file(path_file, headers, body_dict)
 
 
     def upload_file_to_storage(self, course, path_file):
         """
         Uploads the csv report, to S3 storage.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket('proversity-custom-reports')
         now = datetime.now()
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            'proversity-custom-reports',
             path_file,
             'cabinet/{course}/last_page_accessed/{date}.csv'.format(
                 course=course,
                 date=now
-            )
+            ),
         )
 
 
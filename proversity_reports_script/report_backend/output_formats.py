@@ -0,0 +1,189 @@
+"""
+Columnar output formats of the report files.
+
+The csv file of every report is always written, the Google Sheets updates and the existing
+storage keys use it. The formats of EXTRA_DATA['OUTPUT_FORMATS'] are written next to it,
+from the same pass over the rows:
+
+    parquet: {file name}.parquet, compressed Parquet file.
+    arrow: {file name}.arrow, compressed Arrow IPC file.
+
+The columns keep the json types of the report data (numbers, booleans, strings), and the
+cohort and team columns are dictionary-encoded. pyarrow is only required by these formats.
+"""
+import os
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'arrow')
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+DEFAULT_COMPRESSION = {
+    'parquet': 'zstd',
+    'arrow': 'zstd',
+}
+DEFAULT_DICTIONARY_COLUMNS = (
+    'cohort',
+    'cohorts',
+    'team',
+    'teams',
+    'user_cohort',
+    'user_teams',
+)
+
+
+def parse_output_formats(output_formats):
+    """
+    Return the columnar formats of the EXTRA_DATA['OUTPUT_FORMATS'] value.
+
+    Args:
+        output_formats: List of OUTPUT_FORMATS values, 'csv' is always written.
+    Returns:
+        List of COLUMNAR_FORMATS values.
+    """
+    output_formats = output_formats or []
+    unknown_formats = [output_format for output_format in output_formats if output_format not in OUTPUT_FORMATS]
+
+    if unknown_formats:
+        print('Output formats {} are not supported. Supported formats: {}.'.format(
+            ', '.join(unknown_formats),
+            ', '.join(OUTPUT_FORMATS),
+        ))
+        exit()
+
+    columnar_formats = [output_format for output_format in COLUMNAR_FORMATS if output_format in output_formats]
+
+    if columnar_formats and not is_pyarrow_installed():
+        print('The {} output formats require pyarrow, install it with: pip install pyarrow'.format(
+            ', '.join(columnar_formats),
+        ))
+        exit()
+
+    return columnar_formats
+
+
+def is_pyarrow_installed():
+    """
+    Return True if pyarrow can be imported, without importing it.
+    """
+    from importlib.util import find_spec
+
+    return find_spec('pyarrow') is not None
+
+
+def get_output_file_path(csv_file_path, output_format):
+    """
+    Return the path of the output format file written next to the csv file.
+    """
+    return '{}.{}'.format(os.path.splitext(csv_file_path)[0], output_format)
+
+
+class ColumnarWriter(object):
+    """
+    Collects the report rows by column and writes them into the columnar formats.
+    """
+
+    def __init__(self, headers, output_formats, output_options=None):
+        """
+        Args:
+            headers: List with the column names.
+            output_formats: List of COLUMNAR_FORMATS values.
+            output_options: Dict with the EXTRA_DATA['OUTPUT_OPTIONS'] settings:
+                COMPRESSION: Compression codec, or a dict with the codec per format.
+                DICTIONARY_COLUMNS: Column names to dictionary-encode, case insensitive.
+        """
+        output_options = output_options or {}
+        compression = output_options.get('COMPRESSION', DEFAULT_COMPRESSION)
+        dictionary_columns = output_options.get('DICTIONARY_COLUMNS', DEFAULT_DICTIONARY_COLUMNS)
+        self.headers = list(headers)
+        self.output_formats = output_formats
+        self.compression = {
+            output_format: compression.get(output_format) if isinstance(compression, dict) else compression
+            for output_format in output_formats
+        }
+        self.dictionary_columns = {column.lower() for column in dictionary_columns}
+        self.columns = [[] for _ in self.headers]
+
+    def add_row(self, row):
+        """
+        Add the values of the row dict, the missing columns are null.
+        """
+        for column, header in zip(self.columns, self.headers):
+            column.append(row.get(header))
+
+    def write(self, csv_file_path):
+        """
+        Write the collected rows into the file of every output format, next to the csv file.
+
+        Returns:
+            List of the written file paths.
+        """
+        import pyarrow
+
+        table = pyarrow.Table.from_arrays(
+            [
+                self.build_array(header, column)
+                for header, column in zip(self.headers, self.columns)
+            ],
+            names=[str(header) for header in self.headers],
+        )
+        self.columns = [[] for _ in self.headers]
+        file_paths = []
+
+        for output_format in self.output_formats:
+            file_path = get_output_file_path(csv_file_path, output_format)
+
+            if output_format == 'parquet':
+                write_parquet_file(table, file_path, self.compression[output_format])
+            elif output_format == 'arrow':
+                write_arrow_file(table, file_path, self.compression[output_format])
+
+            file_paths.append(file_path)
+
+        return file_paths
+
+    def build_array(self, header, values):
+        """
+        Return the arrow array of the column values with the inferred type.
+
+        The empty strings of the numeric and boolean columns are null values, and the columns
+        with mixed types fall back to strings.
+        """
+        import pyarrow
+
+        try:
+            array = pyarrow.array(values)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            try:
+                array = pyarrow.array([None if value == '' else value for value in values])
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                array = pyarrow.array(
+                    [None if value is None else str(value) for value in values],
+                    type=pyarrow.string(),
+                )
+
+        if pyarrow.types.is_null(array.type):
+            array = array.cast(pyarrow.string())
+
+        if str(header).lower() in self.dictionary_columns and pyarrow.types.is_string(array.type):
+            array = array.dictionary_encode()
+
+        return array
+
+
+def write_parquet_file(table, file_path, compression):
+    """
+    Write the table into a Parquet file.
+    """
+    import pyarrow.parquet
+
+    pyarrow.parquet.write_table(table, file_path, compression=compression or 'none')
+
+
+def write_arrow_file(table, file_path, compression):
+    """
+    Write the table into an Arrow IPC file.
+    """
+    import pyarrow
+
+    options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+
+    with pyarrow.ipc.new_file(file_path, table.schema, options=options) as writer:
+        writer.write_table(table)
@@ -1,15 +1,10 @@
 """
 Time spent per user report backend.
 """
-import csv
-import functools
 import os
 from collections import OrderedDict
 from datetime import datetime
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
 
 
@@ -17,12 +12,13 @@ class TimeSpentPerUserReportBackend(AbstractBaseReportBackend):
     """
     Backend for time spent per user report.
     """
+    spreadsheet_keys = ('time_spent_sheet_id',)
 
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
         self.bucket_name = extra_data.get('BUCKET_NAME', '')
 
-        super(TimeSpentPerUserReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(TimeSpentPerUserReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
     def generate_report(self, json_report_data):
         """
@@ -43,52 +39,64 @@ class TimeSpentPerUserReportBackend(AbstractBaseReportBackend):
             print('No report data...')
             exit()
 
-        for course_key, course_data in report_data.items():
-            file_name = '{}'.format(course_key)
-
-            if not course_data:
-                continue
+        report_data = self.merge_delta_users(report_data)
+        course_results = self.process_courses(report_data.items(), self.build_course_csv_files)
+        uploads = []
+        sheet_updates = []
+
+        for course_key, csv_files in course_results:
+            for file_path, spreadsheet_range_name, file_name_prefix in csv_files:
+                uploads.append((course_key, file_path, file_name_prefix))
+                sheet_updates.append((
+                    file_path,
+                    self.get_spreadsheet_route('time_spent_sheet_id', course_key, spreadsheet_range_name),
+                ))
+
+        # The user, team and cohort files are uploaded concurrently, and the ranges of every
+        # spreadsheet are written with one batch request.
+        self.upload_files(uploads)
+        self.update_sheets(sheet_updates)
+
+    def build_course_csv_files(self, course_key, course_data):
+        """
+        Build the time spent per user, per team and per cohort csv files of the course.
 
-            time_spent_per_user_report_data = build_time_spent_report_data(course_data)
+        Args:
+            course_key: Course key value.
+            course_data: List with the time spent data per user.
+        Returns:
+            List of (csv file path, spreadsheet range name, file name prefix) tuples.
+        """
+        file_name = '{}'.format(course_key)
+        csv_files = []
 
-            self.create_csv_file(
-                file_name=file_name,
-                body_dict=time_spent_per_user_report_data,
-                course_id=course_key,
-                spreadsheet_range_name='Sheet1',
-            )
+        if not course_data:
+            return csv_files
 
-            time_spent_per_team_report_data = grouping_report_data_by_key(course_data, 'user_teams')
+        # The users and their blocks are walked once for the three files.
+        user_report_data, teams_report_data, cohorts_report_data = build_time_spent_views(course_data)
 
-            self.create_csv_file(
-                file_name='{}-teams'.format(file_name),
-                body_dict=time_spent_per_team_report_data,
-                course_id=course_key,
-                spreadsheet_range_name='Sheet2',
-                file_name_prefix='teams-',
-            )
+        for report_file_name, body_dict, spreadsheet_range_name, file_name_prefix in (
+                (file_name, user_report_data, 'Sheet1', ''),
+                ('{}-teams'.format(file_name), teams_report_data, 'Sheet2', 'teams-'),
+                ('{}-cohorts'.format(file_name), cohorts_report_data, 'Sheet3', 'cohorts-'),
+        ):
+            file_path = self.create_csv_file(file_name=report_file_name, body_dict=body_dict)
 
-            time_spent_per_cohort_report_data = grouping_report_data_by_key(course_data, 'user_cohort')
+            if file_path:
+                csv_files.append((file_path, spreadsheet_range_name, file_name_prefix))
 
-            self.create_csv_file(
-                file_name='{}-cohorts'.format(file_name),
-                body_dict=time_spent_per_cohort_report_data,
-                course_id=course_key,
-                spreadsheet_range_name='Sheet3',
-                file_name_prefix='cohorts-',
-            )
+        return csv_files
 
-    def create_csv_file(self, file_name, body_dict, course_id, spreadsheet_range_name, file_name_prefix=''):
+    def create_csv_file(self, file_name, body_dict):
         """
         Creates the csv file with the passed arguments, and then save it locally.
 
         Args:
             file_name: File string name.
             body_dict: Dict with the data to write the csv file.
-            course_id: Course key value.
-            spreadsheet_range_name: Range name to update the spreadsheet file in A notation:
-            https://developers.google.com/sheets/api/guides/concepts#a1_notation
-            file_name_prefix: Prefix of the file to upload to Amazon S3.
+        Returns:
+            file_path: Path of the csv file, None when there is no data to write.
         """
         file_path = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
@@ -100,20 +108,7 @@ class TimeSpentPerUserReportBackend(AbstractBaseReportBackend):
         except IndexError:
             return None
 
-        with open(file_path, mode='w', encoding='utf-8') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=headers)
-
-            writer.writeheader()
-
-            for row in body_dict:
-                writer.writerow(row)
-
-        self.upload_file_to_storage(course_id, file_path, file_name_prefix)
-        update_sheets_data(
-            file_path,
-            self.spreadsheet_data.get('time_spent_sheet_id_{}'.format(course_id)),
-            spreadsheet_range_name,
-        )
+        return self.write_csv_file(file_path, headers, body_dict)
 
     def upload_file_to_storage(self, course, path_file, file_name_prefix):
         """
@@ -123,38 +118,37 @@ class TimeSpentPerUserReportBackend(AbstractBaseReportBackend):
             course: Course string id.
             path_file: CSV report local file path.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket(self.bucket_name)
         now = datetime.now()
 
         print('S3 Uploading file {} to {}'.format(path_file, self.bucket_name))
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            self.bucket_name,
             path_file,
             'cabinet/{course}/time_spent_per_user_report/{prefix}{date}.csv'.format(
                 course=course,
                 prefix=file_name_prefix,
                 date=now,
-            )
+            ),
         )
 
 
-def build_time_spent_report_data(course_data):
+def build_time_spent_views(course_data):
     """
-    Returns a dict containing the essential data to generate the time spent csv report.
+    Build the time spent per user, per team and per cohort report data in one pass over the users.
+
+    The per team and per cohort report data has a row per block position, with the unit data of the
+    last group (in sorted order) that has the block and the total time spent of every group.
 
     Args:
-        course_data: List with the course structure by subsection data.
+        course_data: List with the time spent data per user.
     Returns:
-        List containing the data to generate the report.
-        [{
-            section: Course section string name.
-            subsection: Course subsection string name.
-            page_views: Total of subsection views.
-            time_on_page: Total of the average time on page.
-        }]
+        Tuple with the per user, the per team and the per cohort lists of report data.
     """
     report_course_data = []
+    # Per grouping key and group: the first block and the total time spent of every block position.
+    group_blocks = {'user_teams': {}, 'user_cohort': {}}
+    group_totals = {'user_teams': {}, 'user_cohort': {}}
 
     for user_data in course_data:
         course_blocks = user_data.get('blocks', [])
@@ -162,107 +156,72 @@ def build_time_spent_report_data(course_data):
         user_report_data['Student'] = user_data.get('username', '')
         user_report_data['Cohort'] = user_data.get('user_cohort', '')
         user_report_data['Teams'] = user_data.get('user_teams', '')
+        user_groups = []
+
+        for grouping_key in ('user_teams', 'user_cohort'):
+            group = user_data.get(grouping_key, '')
+            user_groups.append((
+                group_blocks[grouping_key].setdefault(group, []),
+                group_totals[grouping_key].setdefault(group, []),
+            ))
 
         for course_block_index, course_block in enumerate(course_blocks):
             vertical_name = course_block.get('vertical_name', '')
+            average_time_spent = course_block.get('average_time_spent', 0)
 
             if vertical_name in user_report_data.keys():
                 vertical_name = '{}-{}'.format(vertical_name, course_block_index)
 
             user_report_data.update({
-                vertical_name: course_block.get('average_time_spent', 0),
+                vertical_name: average_time_spent,
             })
 
+            for blocks, totals in user_groups:
+                if course_block_index < len(totals):
+                    totals[course_block_index] += average_time_spent
+                else:
+                    blocks.append(course_block)
+                    totals.append(average_time_spent)
+
         report_course_data.append(user_report_data)
 
-    return report_course_data
+    return (
+        report_course_data,
+        build_group_report_data(group_blocks['user_teams'], group_totals['user_teams']),
+        build_group_report_data(group_blocks['user_cohort'], group_totals['user_cohort']),
+    )
 
 
-def grouping_report_data_by_key(course_data, grouping_key):
+def build_group_report_data(group_blocks, group_totals):
     """
-    Groups the report data by the key provided (user_cohort/user_teams)
-    to obtain the total time spent by all the team/cohort members in each unit.
+    Return the per group report data from the totals of build_time_spent_views.
 
     Args:
-        course_data: List with the course structure by unit data.
-        grouping_key: Name of the key to group the data.
-    Returns:
-        List containing the data to generate the report.
-        [{
-            section_position: Chapter position in the course structure.
-            section: Course chapter string name.
-            subsection_position: Subsection position in the course structure.
-            subsection: Course subsection string name.
-            vertical_position: Unit position in the course structure.
-            vertical_name: Course unit string name.
-            group/cohort name: Value of the time spent by team/cohort members in seconds.
-            ...
-        }]
+        group_blocks: Dict of group to the list of its first block of every block position.
+        group_totals: Dict of group to the list of its total time spent of every block position.
     """
-    course_groups = set([data.get(grouping_key, '') for data in course_data])
     # Sort the list to maintain the order of the groups in the report data.
-    course_groups = sorted(course_groups)
+    course_groups = sorted(group_blocks)
     group_report_data = []
 
-    for group in course_groups:
-        block_groups = []
-
-        # Group identical blocks of the users in the same group.
-        # [
-        #   ({'block': 'A-block'},{'block': 'A-block'},{'block': 'A-block'}),
-        #   ({'block': 'B-block'},{'block': 'B-block'},{'block': 'B-block'}),
-        #   ...
-        # ]
-        for user in course_data:
-            if user.get(grouping_key, '') == group:
-                for index, course_block in enumerate(user.get('blocks', [])):
-                    try:
-                        current = block_groups.pop(index)
-                    except IndexError:
-                        current = ()
-
-                    block_groups.insert(index, current + (course_block, ))
-
-        # Reduce the identical blocks to only one block.
-        for block_group_index, block_group in enumerate(block_groups):
-            course_teams_dict = {course_team: 0 for course_team in course_groups}
-            course_teams_dict = OrderedDict(
-                sorted(
-                    course_teams_dict.items(),
-                    key=lambda g: g[0],
-                )
-            )
-
-            try:
-                current_block = block_group[0]
-            except IndexError:
-                continue
-
-            block_data = OrderedDict()
-            block_data['section_position'] = current_block.get('chapter_position', '')
-            block_data['section'] = current_block.get('chapter_name', '')
-            block_data['subsection_position'] = current_block.get('sequential_position', '')
-            block_data['subsection'] = current_block.get('sequential_name', '')
-            block_data['vertical_position'] = current_block.get('vertical_position', '')
-            block_data['vertical_name'] = current_block.get('vertical_name', '')
-
-            # Sum all the average_time_spent.
-            course_teams_dict[group] = functools.reduce(
-                lambda x, y: x + y,
-                [average.get('average_time_spent', 0) for average in block_group],
-            )
-
-            block_data.update(course_teams_dict)
-
-            # Reduce the course structure to only one structure with the total time spent by team/cohort members.
-            try:
-                current = group_report_data.pop(block_group_index)
-
-                for group_value in course_groups:
-                    block_data[group_value] += current.get(group_value, 0)
-            except IndexError:
-                pass
-
-            group_report_data.insert(block_group_index, block_data)
+    for block_index in range(max([len(blocks) for blocks in group_blocks.values()] or [0])):
+        block_groups = [group for group in course_groups if block_index < len(group_blocks[group])]
+        # The unit data comes from the last group with the block.
+        current_block = group_blocks[block_groups[-1]][block_index]
+
+        block_data = OrderedDict()
+        block_data['section_position'] = current_block.get('chapter_position', '')
+        block_data['section'] = current_block.get('chapter_name', '')
+        block_data['subsection_position'] = current_block.get('sequential_position', '')
+        block_data['subsection'] = current_block.get('sequential_name', '')
+        block_data['vertical_position'] = current_block.get('vertical_position', '')
+        block_data['vertical_name'] = current_block.get('vertical_name', '')
+
+        for group in course_groups:
+            totals = group_totals[group]
+            block_data[group] = totals[block_index] if block_index < len(totals) else 0
+
+        group_report_data.append(block_data)
 
     return group_report_data
+
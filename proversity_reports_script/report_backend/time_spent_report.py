@@ -1,13 +1,9 @@
 """
 Time spent report backend.
 """
-import csv
 from datetime import datetime
 import os
 
-import boto3
-
-from proversity_reports_script.google_apis.sheets_api import update_sheets_data
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
 
 
@@ -15,10 +11,11 @@ class TimeSpentReportBackend(AbstractBaseReportBackend):
     """
     Backend for time spent report.
     """
+    spreadsheet_keys = ('time_spent_sheet_id',)
 
     def __init__(self, *args, **kwargs):
         extra_data = kwargs.get('extra_data', {})
-        super(TimeSpentReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        super(TimeSpentReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
 
     def generate_report(self, json_report_data):
@@ -43,36 +40,57 @@ class TimeSpentReportBackend(AbstractBaseReportBackend):
 
         if report_data.get('time_spent_data'):
             time_spent_data = report_data.get('time_spent_data', {})
-            for course_key, course_data in time_spent_data.items():
-                file_name = '{}'.format(course_key)
+            course_results = self.process_courses(time_spent_data.items(), self.build_course_csv_file)
+            sheet_updates = []
 
-                if not course_data:
+            for course_key, path_file in course_results:
+                if not path_file:
                     continue
 
-                analytics_data = course_data.get('analytics_data', [])
-                course_structure_data = course_data.get('course_structure', [])
-
-                subsection_data = count_analytics_subsections(analytics_data, course_structure_data)
-                report_csv_headers = [
-                    'section_position',
-                    'section',
-                    'subsection_position',
-                    'subsection',
-                    'vertical_position',
-                    'vertical_name',
-                    'time_on_page',
-                    'page_views',
-                ]
-
-                self.create_csv_file(
-                    file_name,
-                    subsection_data,
-                    report_csv_headers,
-                    self.spreadsheet_data.get('time_spent_sheet_id_{}'.format(course_key))
-                )
-
-
-    def create_csv_file(self, file_name, body_dict, headers, spreadsheet_id):
+                self.upload_file_to_storage(course_key, path_file)
+                sheet_updates.append((path_file, self.get_spreadsheet_route('time_spent_sheet_id', course_key)))
+
+            self.update_sheets(sheet_updates)
+
+
+    def build_course_csv_file(self, course_key, course_data):
+        """
+        Build the time spent csv file of the course.
+
+        Args:
+            course_key: Course key value.
+            course_data: Dict containing the analytics data and the course structure.
+        Returns:
+            Path of the csv file, None when there is no course data.
+        """
+        file_name = '{}'.format(course_key)
+
+        if not course_data:
+            return None
+
+        analytics_data = course_data.get('analytics_data', [])
+        course_structure_data = course_data.get('course_structure', [])
+
+        subsection_data = count_analytics_subsections(analytics_data, course_structure_data)
+        report_csv_headers = [
+            'section_position',
+            'section',
+            'subsection_position',
+            'subsection',
+            'vertical_position',
+            'vertical_name',
+            'time_on_page',
+            'page_views',
+        ]
+
+        return self.create_csv_file(
+            file_name,
+            subsection_data,
+            report_csv_headers,
+        )
+
+
+    def create_csv_file(self, file_name, body_dict, headers):
         """
         Creates the csv file with the passed arguments, and then save it locally.
 
@@ -80,22 +98,15 @@ class TimeSpentReportBackend(AbstractBaseReportBackend):
             file_name: File string name.
             body_dict: Dict with the data to write the csv file.
             headers: List with the csv column names.
+        Returns:
+            path_file: Path of the csv file.
         """
         path_file = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
             file_name=file_name
         )
 
-        with open(path_file, mode='w', encoding='utf-8') as csv_file:
-            column_headers = headers
-            writer = csv.DictWriter(csv_file, fieldnames=column_headers)
-
-            writer.writeheader()
-            for row in body_dict:
-                writer.writerow(row)
-
-        self.upload_file_to_storage(file_name, path_file)
-        update_sheets_data(path_file, spreadsheet_id)
+        return self.write_csv_file(path_file, headers, body_dict)
 
 
     def upload_file_to_storage(self, course, path_file):
@@ -106,16 +117,15 @@ class TimeSpentReportBackend(AbstractBaseReportBackend):
             course: Course string id.
             path_file: CSV report local file path.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket('proversity-custom-reports')
         now = datetime.now()
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            'proversity-custom-reports',
             path_file,
             'cabinet/{course}/time_spent_report/{date}.csv'.format(
                 course=course,
                 date=now
-            )
+            ),
         )
 
 
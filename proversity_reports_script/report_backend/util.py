@@ -1,6 +1,8 @@
 """
 Module containing common functions.
 """
+from operator import itemgetter
+
 
 def get_required_activity_dict(user_data):
     """
@@ -35,3 +37,58 @@ def get_required_activity_dict(user_data):
             })
 
     return required_activities_data
+
+
+def compile_required_activity_extractor(user_data):
+    """
+    Return a function that creates the required activity dict of the users of a course.
+
+    The activity keys and the column names are computed only once from the provided user data,
+    since all the users of a course share the same required activities. The returned function
+    falls back to get_required_activity_dict for the users with a different number of activities.
+
+    Args:
+        user_data: Report json data of one user of the course, usually the first one.
+    Returns:
+        Function that receives the user data and returns the same dict as get_required_activity_dict.
+    """
+    total_activities = user_data.get('total_activities', 0)
+    activity_keys = []
+    column_names = []
+
+    if total_activities:
+        for activity_number in range(1, int(total_activities) + 1):
+            required_activity_name = user_data.get('required_activity_{}_name'.format(activity_number), '')
+
+            # Same de-duplication rule of get_required_activity_dict.
+            if required_activity_name in column_names:
+                required_activity_name = '{}-{}'.format(required_activity_name, activity_number)
+
+            activity_keys.append('required_activity_{}'.format(activity_number))
+            column_names.append(required_activity_name)
+
+    column_names = tuple(column_names)
+    activity_keys = tuple(activity_keys)
+    get_activity_values = itemgetter(*activity_keys) if len(activity_keys) > 1 else None
+
+    def extract_required_activities(course_user_data):
+        """
+        Return the required activity dict of the user.
+        """
+        if course_user_data.get('total_activities', 0) != total_activities:
+            return get_required_activity_dict(course_user_data)
+
+        if not get_activity_values:
+            return {
+                column_name: course_user_data.get(activity_key, '')
+                for column_name, activity_key in zip(column_names, activity_keys)
+            }
+
+        try:
+            activity_values = get_activity_values(course_user_data)
+        except KeyError:
+            activity_values = [course_user_data.get(activity_key, '') for activity_key in activity_keys]
+
+        return dict(zip(column_names, activity_values))
+
+    return extract_required_activities
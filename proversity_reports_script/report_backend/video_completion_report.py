@@ -1,16 +1,21 @@
 """
 Video completion report backend.
 """
+import codecs
 import csv
+import functools
+import json
 import os
 from collections import OrderedDict
 from datetime import datetime
 
-import boto3
-
 from proversity_reports_script.report_backend.base import AbstractBaseReportBackend
-from proversity_reports_script.report_backend.util import get_required_activity_dict
+from proversity_reports_script.report_backend.util import compile_required_activity_extractor
 
+USER_LIST_INDEX_FILE_NAME = 'user-list-index.json'
+USER_LIST_REPORT_FILE_NAME = 'user-list-report.csv'
+LAST_MODIFIED_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 class VideoCompletionReportBackend(AbstractBaseReportBackend):
     """
@@ -21,117 +26,180 @@ class VideoCompletionReportBackend(AbstractBaseReportBackend):
         extra_data = kwargs.get('extra_data', {})
         self.bucket_name = extra_data.get('S3_BUCKET_NAME', '')
         self.user_list_report_file_name = extra_data.get('USER_LIST_REPORT_NAME', '')
-        super(VideoCompletionReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}))
+        self.stream_user_list_report = extra_data.get('STREAM_USER_LIST_REPORT', False)
+        super(VideoCompletionReportBackend, self).__init__(extra_data.get('SPREADSHEET_DATA', {}), extra_data)
 
 
     def generate_report(self, json_report_data):
         """
         Main logic to generate the report.
         """
-        user_list_report_path = self.download_and_save_user_list_report()
         self.json_report_to_csv(
             json_report_data=json_report_data,
-            user_list_report_path=user_list_report_path,
+            user_list_data=self.get_user_list_index(),
         )
 
 
     def json_report_to_csv(self, json_report_data, *args, **kwargs):
         """
         Process json data to convert into csv format.
+
+        Keyword args:
+            user_list_data: Set of normalized user emails to include in the report.
+            user_list_report_path: User list file path, used when user_list_data is not provided.
         """
-        user_list_data = get_user_list_report_data(kwargs.get('user_list_report_path', ''))
+        user_list_data = kwargs.get('user_list_data')
+
+        if user_list_data is None:
+            user_list_data = get_user_list_report_data(kwargs.get('user_list_report_path', ''))
 
-        for course, course_data in iter(json_report_data.get('result', {}).items()):
-            csv_data = generate_csv_dict(course_data, user_list_data)
+        course_results = self.process_courses(
+            json_report_data.get('result', {}).items(),
+            functools.partial(self.build_course_csv_file, user_list_data=user_list_data),
+        )
 
-            if not csv_data:
-                continue
+        for course, path_file in course_results:
+            if path_file:
+                self.upload_file_to_storage(course, path_file)
 
-            self.create_csv_file(
-                course,
-                csv_data,
-                csv_data[0].keys(),
-            )
+
+    def build_course_csv_file(self, course, course_data, user_list_data):
+        """
+        Build the video completion csv file of the course.
+
+        Returns:
+            Path of the csv file, None when there is no data to write.
+        """
+        csv_data = generate_csv_dict(course_data, user_list_data)
+
+        if not csv_data:
+            return None
+
+        return self.create_csv_file(
+            course,
+            csv_data,
+            csv_data[0].keys(),
+        )
 
 
     def create_csv_file(self, file_name, body_dict, headers, *args, **kwargs):
         """
         Create the csv file with the passed arguments, and then save it locally.
+
+        Returns:
+            path_file: Path of the csv file.
         """
         path_file = '{parent_folder}/result/{file_name}.csv'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
             file_name=file_name,
         )
 
-        with open(path_file, mode='w', encoding='utf-8') as csv_file:
-            column_headers = headers
-            writer = csv.DictWriter(csv_file, fieldnames=column_headers)
-
-            writer.writeheader()
-
-            for row in body_dict:
-                writer.writerow(row)
-
-        self.upload_file_to_storage(file_name, path_file)
+        return self.write_csv_file(path_file, headers, body_dict)
 
 
     def upload_file_to_storage(self, course, path_file):
         """
         Upload the csv report, to S3 storage.
         """
-        amazon_storage = boto3.resource('s3')
-        reports_bucket = amazon_storage.Bucket(self.bucket_name)
         now = datetime.now()
 
-        reports_bucket.upload_file(
+        self.upload_report_files(
+            self.bucket_name,
             path_file,
             '{course}/video_completion_report/{date}.csv'.format(
                 course=course,
                 date=now,
-            )
+            ),
         )
 
 
-    def download_and_save_user_list_report(self):
+    def get_user_list_index(self):
         """
-        Download the user list report to be filter with the competion report.
-        The video completion report only needs the users that exists in the
-        downloaded report.
+        Return the set of user emails from the user list report.
+
+        The email set is cached in the result folder along with the ETag and Last-Modified
+        values of the S3 object. The user list report is requested with If-None-Match and
+        If-Modified-Since, so it's only downloaded and read again when it changes.
 
         Returns:
-            local_path_name: File name where the report was stored.
+            Frozenset of normalized user emails.
         """
-        amazon_storage = boto3.resource('s3')
-        report_bucket = amazon_storage.Bucket(self.bucket_name)
-        now = datetime.now()
         user_list_file_name = self.user_list_report_file_name
 
         if not user_list_file_name:
             print('User list file name was not provided.')
             exit()
 
-        local_path_name = '{parent_folder}/result/{file_name}.csv'.format(
+        index_path = '{parent_folder}/result/{file_name}'.format(
             parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
-            file_name=now.strftime('%Y-%m-%d'),
+            file_name=USER_LIST_INDEX_FILE_NAME,
+        )
+        user_list_index = load_user_list_index(index_path, user_list_file_name) or {}
+        report_object = self.storage_sink.get_object(
+            self.bucket_name,
+            user_list_file_name,
+            if_none_match=user_list_index.get('etag'),
+            if_modified_since=(
+                datetime.strptime(user_list_index['last_modified'], LAST_MODIFIED_FORMAT)
+                if user_list_index.get('last_modified') else None
+            ),
         )
 
-        print('Downloading user list report {} into {}'.format(user_list_file_name, local_path_name))
+        if report_object is None:
+            print('User list report {} has not changed, using the cached user list.'.format(user_list_file_name))
+            return frozenset(user_list_index.get('emails', []))
+
+        if self.stream_user_list_report:
+            print('Reading user list report {} from S3.'.format(user_list_file_name))
+            user_list_data = read_user_list_emails(
+                codecs.iterdecode(iter_lines(report_object['Body']), 'utf-8'),
+            )
+        else:
+            user_list_data = get_user_list_report_data(
+                self.download_and_save_user_list_report(report_object['Body']),
+            )
 
-        report_bucket.download_file(user_list_file_name, local_path_name)
+        save_user_list_index(index_path, user_list_file_name, report_object, user_list_data)
+
+        return user_list_data
+
+
+    def download_and_save_user_list_report(self, report_body):
+        """
+        Save the user list report to be filter with the competion report.
+        The video completion report only needs the users that exists in the
+        downloaded report.
+
+        Args:
+            report_body: Streaming body of the S3 user list report object.
+        Returns:
+            local_path_name: File name where the report was stored.
+        """
+        local_path_name = '{parent_folder}/result/{file_name}'.format(
+            parent_folder=os.path.join(os.path.dirname(__file__), os.pardir),
+            file_name=USER_LIST_REPORT_FILE_NAME,
+        )
+
+        print('Downloading user list report {} into {}'.format(self.user_list_report_file_name, local_path_name))
+
+        with open(local_path_name, 'wb') as user_list_file:
+            for chunk in iter(lambda: report_body.read(DOWNLOAD_CHUNK_SIZE), b''):
+                user_list_file.write(chunk)
 
         return local_path_name
 
 
-def generate_csv_dict(course_data={}, user_list_data=[]):  # pylint: disable=dangerous-default-value
+def generate_csv_dict(course_data={}, user_list_data=frozenset()):  # pylint: disable=dangerous-default-value
     """
     Return a csv dict to write the csv file.
     """
     csv_data = []
+    extract_required_activities = compile_required_activity_extractor(course_data[0] if course_data else {})
 
     for user_data in course_data:
         email = user_data.get('email', '')
 
-        if not email in user_list_data:
+        if not normalize_email(email) in user_list_data:
             continue
 
         first_name = user_data.get('first_name', '')
@@ -147,7 +215,7 @@ def generate_csv_dict(course_data={}, user_list_data=[]):  # pylint: disable=dan
         dict_writer_data['Email'] = email
         dict_writer_data['Course Is Complete'] = course_is_complete
 
-        dict_writer_data.update(get_required_activity_dict(user_data))
+        dict_writer_data.update(extract_required_activities(user_data))
 
         csv_data.append(dict_writer_data)
 
@@ -156,17 +224,112 @@ def generate_csv_dict(course_data={}, user_list_data=[]):  # pylint: disable=dan
 
 def get_user_list_report_data(file_path):
     """
-    Return the user email list from the report file.
+    Return the user email set from the report file.
 
     Args:
         file_path: User list file path.
     Returns:
-        user_list: List of user emails.
+        user_list: Frozenset of normalized user emails.
     """
-    user_list = []
-
-    with open(file_path) as user_list_file:
-        reader = csv.DictReader(user_list_file)
-        user_list = [row.get('email', '') for row in reader]
+    with open(file_path, newline='') as user_list_file:
+        user_list = read_user_list_emails(user_list_file)
 
     return user_list
+
+
+def read_user_list_emails(user_list_lines):
+    """
+    Return the user email set from the user list report lines.
+
+    The lines are read one by one, so the whole report is never loaded in memory.
+
+    Args:
+        user_list_lines: Iterable of csv lines of the user list report.
+    Returns:
+        Frozenset of normalized user emails.
+    """
+    reader = csv.DictReader(user_list_lines)
+    user_list = frozenset(normalize_email(row.get('email', '')) for row in reader)
+
+    return user_list - {''}
+
+
+def iter_lines(report_body):
+    """
+    Yield the lines of a binary stream, reading it in chunks.
+
+    Args:
+        report_body: Binary stream with a read method.
+    Returns:
+        Yields each line as bytes.
+    """
+    pending = b''
+
+    for chunk in iter(lambda: report_body.read(DOWNLOAD_CHUNK_SIZE), b''):
+        lines = (pending + chunk).splitlines(True)
+        pending = lines.pop() if lines and not lines[-1].endswith((b'\n', b'\r')) else b''
+
+        for line in lines:
+            yield line
+
+    if pending:
+        yield pending
+
+
+def normalize_email(email):
+    """
+    Return the email in the form used to compare the learners with the user list.
+
+    Args:
+        email: Email string.
+    Returns:
+        Lowercase email without surrounding whitespaces.
+    """
+    return (email or '').strip().lower()
+
+
+def load_user_list_index(index_path, user_list_file_name):
+    """
+    Return the cached user list index of the S3 object.
+
+    Args:
+        index_path: Path of the cached user list index.
+        user_list_file_name: S3 key of the user list report.
+    Returns:
+        Dict containing the etag, last_modified and emails values.
+        None: if there is no cached index for the S3 object.
+    """
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path, 'r') as index_file:
+        try:
+            index_data = json.load(index_file)
+        except ValueError:
+            return None
+
+    if index_data.get('key') != user_list_file_name or not index_data.get('etag'):
+        return None
+
+    return index_data
+
+
+def save_user_list_index(index_path, user_list_file_name, report_object, user_list_data):
+    """
+    Store the user email set along with the S3 object version it was built from.
+
+    Args:
+        index_path: Path of the cached user list index.
+        user_list_file_name: S3 key of the user list report.
+        report_object: get_object response of the user list report.
+        user_list_data: Frozenset of normalized user emails.
+    """
+    last_modified = report_object.get('LastModified')
+
+    with open(index_path, 'w') as index_file:
+        json.dump({
+            'key': user_list_file_name,
+            'etag': report_object.get('ETag', ''),
+            'last_modified': last_modified.strftime(LAST_MODIFIED_FORMAT) if last_modified else '',
+            'emails': sorted(user_list_data),
+        }, index_file)
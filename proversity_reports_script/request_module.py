@@ -1,10 +1,531 @@
 """
 Module that contains common functions to perform external request.
+
+Every request goes through the process retry policy: the transient failures (5xx and 429
+responses, timeouts and connection errors) are retried with a capped exponential back-off,
+every host has a circuit breaker, and the retries of the whole run are limited by a retry budget.
+The policy is configured with the REQUEST_RETRY settings, e.g.:
+
+    "REQUEST_RETRY": {
+        "MAX_ATTEMPTS": 5,
+        "BACKOFF_BASE": 1,
+        "BACKOFF_MAX": 60,
+        "RETRY_BUDGET": 200,
+        "CIRCUIT_BREAKER_THRESHOLD": 10,
+        "CIRCUIT_BREAKER_RESET": 60
+    }
+
+Every request has a connect and a read timeout, and it can be bound to a Deadline, e.g. the
+poll task deadline or the whole run deadline. They are configured with the TIMEOUTS settings:
+
+    "TIMEOUTS": {
+        "CONNECT": 10,
+        "READ": 300,
+        "POLL_TASK": 1800,
+        "RUN": 14400
+    }
+
+The requests of every host are limited by endpoint type (GENERATION for the report generation
+requests and STATUS for the task status requests) with a token bucket (RATE requests per second
+with bursts of BURST requests) and a maximum number of concurrent requests. The limits are
+shared by all the threads of the process and configured with the REQUEST_LIMITS settings:
+
+    "REQUEST_LIMITS": {
+        "GENERATION": {"RATE": 0.5, "BURST": 2, "MAX_CONCURRENCY": 2},
+        "STATUS": {"RATE": 10, "BURST": 20, "MAX_CONCURRENCY": 8},
+        "HOSTS": {
+            "lms.example.com": {
+                "STATUS": {"RATE": 5, "MAX_CONCURRENCY": 4}
+            }
+        }
+    }
 """
+import random
+import threading
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
 import requests
 
+from proversity_reports_script.metrics import stage
+
+REQUEST_STAGES = {
+    'POST': 'generation_request',
+    'GET': 'poll',
+}
+ENDPOINT_TYPES = {
+    'POST': 'GENERATION',
+    'GET': 'STATUS',
+}
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+TIMEOUT_STATUS_CODES = (504,)
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+
+
+class ReportRequestError(Exception):
+    """
+    Base exception of the failed requests.
+    """
+
+    def __init__(self, request_url, message):
+        super(ReportRequestError, self).__init__('Request to {} failed: {}'.format(request_url, message))
+        self.request_url = request_url
+
+
+class UnexpectedResponseError(ReportRequestError):
+    """
+    Raised when the response status is not retryable, e.g. 400, 401 or 404,
+    or when the response body is not json, e.g. the HTML error page of a proxy.
+    """
+
+    def __init__(self, request_url, status_code, reason=''):
+        super(UnexpectedResponseError, self).__init__(
+            request_url,
+            'unexpected response {}{}'.format(status_code, ', {}'.format(reason) if reason else ''),
+        )
+        self.status_code = status_code
+
+
+class RequestTimeoutError(ReportRequestError):
+    """
+    Raised when the request times out (read timeout or 504 response) and the timeouts are not retried.
+    """
+
+
+class RetriesExhaustedError(ReportRequestError):
+    """
+    Raised when the request keeps failing after the maximum number of attempts.
+    """
+
+
+class RetryBudgetExhaustedError(ReportRequestError):
+    """
+    Raised when a request fails and the run has no retries left.
+    """
+
+
+class CircuitOpenError(ReportRequestError):
+    """
+    Raised when the circuit breaker of the host is open.
+    """
+
+
+class DeadlineExceededError(ReportRequestError):
+    """
+    Raised when the deadline of the request expires.
+    """
+
+
+class Deadline(object):
+    """
+    Point in time when an operation must be finished, a deadline without seconds never expires.
+    """
+
+    def __init__(self, seconds=None, parent=None):
+        """
+        Args:
+            seconds: Seconds from now until the deadline.
+            parent: Deadline of the enclosing operation, the earliest of both is used.
+        """
+        self.expires_at = monotonic() + seconds if seconds else None
+
+        if parent is not None and parent.expires_at is not None:
+            if self.expires_at is None or parent.expires_at < self.expires_at:
+                self.expires_at = parent.expires_at
+
+    def remaining(self):
+        """
+        Return the seconds until the deadline, None if it never expires.
+        """
+        if self.expires_at is None:
+            return None
+
+        return max(self.expires_at - monotonic(), 0)
+
+    def expired(self):
+        """
+        Return True if the deadline has expired.
+        """
+        return self.remaining() == 0
+
+    def check(self, request_url):
+        """
+        Raises:
+            DeadlineExceededError: When the deadline has expired.
+        """
+        if self.expired():
+            raise DeadlineExceededError(request_url, 'the deadline was exceeded')
+
+
+class RequestLimiter(object):
+    """
+    Token bucket and concurrency limit of the requests of one host and endpoint type.
+    """
+
+    def __init__(self, rate=0, burst=None, max_concurrency=0):
+        """
+        Args:
+            rate: Requests per second, 0 disables the token bucket.
+            burst: Size of the bucket, defaults to max(rate, 1).
+            max_concurrency: Maximum number of requests in flight, 0 disables the limit.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(self.rate, 1))
+        self.tokens = self.burst
+        self.updated_at = monotonic()
+        self.semaphore = threading.BoundedSemaphore(int(max_concurrency)) if max_concurrency else None
+        self.lock = threading.Lock()
+
+    def acquire(self, request_url, deadline):
+        """
+        Wait for a token and a concurrency slot, release() must be called after the request.
+
+        Returns:
+            Seconds waited.
+        Raises:
+            DeadlineExceededError: When the deadline expires while waiting.
+        """
+        start = monotonic()
+
+        while self.rate:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+
+                wait_for = (1 - self.tokens) / self.rate
+
+            remaining = deadline.remaining()
+
+            if remaining is not None and wait_for >= remaining:
+                raise DeadlineExceededError(request_url, 'the deadline expires while waiting for the rate limit')
+
+            sleep(wait_for)
+
+        if self.semaphore and not self.semaphore.acquire(timeout=deadline.remaining()):
+            raise DeadlineExceededError(request_url, 'the deadline expires while waiting for a request slot')
+
+        return monotonic() - start
+
+    def release(self):
+        """
+        Release the concurrency slot.
+        """
+        if self.semaphore:
+            self.semaphore.release()
+
+
+class RequestLimiters(object):
+    """
+    The request limiters of the process, one per host and endpoint type.
+    """
+
+    def __init__(self, limit_settings=None):
+        """
+        Args:
+            limit_settings: Dict with the REQUEST_LIMITS settings.
+        """
+        self.limit_settings = limit_settings or {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def get_limiter(self, request_url, endpoint_type):
+        """
+        Return the limiter of the request host and endpoint type, None when it has no limits.
+        """
+        host = urlparse(request_url).netloc
+
+        with self.lock:
+            if (host, endpoint_type) not in self.limiters:
+                endpoint_settings = self.limit_settings.get('HOSTS', {}).get(host, {}).get(
+                    endpoint_type,
+                    self.limit_settings.get(endpoint_type, {}),
+                )
+                self.limiters[(host, endpoint_type)] = RequestLimiter(
+                    rate=endpoint_settings.get('RATE', 0),
+                    burst=endpoint_settings.get('BURST'),
+                    max_concurrency=endpoint_settings.get('MAX_CONCURRENCY', 0),
+                ) if endpoint_settings else None
+
+            return self.limiters[(host, endpoint_type)]
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of one host.
+
+    The circuit opens after failure_threshold consecutive failures, the requests fail fast while it's open.
+    After reset_timeout seconds the requests are let through again (half open): a success closes
+    the circuit and a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def before_request(self, request_url):
+        """
+        Raises:
+            CircuitOpenError: When the circuit is open.
+        """
+        with self.lock:
+            if self.opened_at is not None and monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError(request_url, 'the circuit breaker of the host is open')
+
+    def record_success(self):
+        """
+        Close the circuit.
+        """
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        """
+        Count the failure, and open the circuit when the threshold is reached.
+        """
+        with self.lock:
+            self.failures += 1
+
+            if self.failure_threshold and self.failures >= self.failure_threshold:
+                self.opened_at = monotonic()
 
-def request_handler(request_url, request_data, request_type, request_headers, query_params):
+
+class RetryPolicy(object):
+    """
+    Retries, back-off, retry budget and circuit breakers of the requests.
+    """
+
+    def __init__(self, retry_settings=None):
+        """
+        Args:
+            retry_settings: Dict with the REQUEST_RETRY settings.
+        """
+        retry_settings = retry_settings or {}
+        self.max_attempts = max(int(retry_settings.get('MAX_ATTEMPTS', 5)), 1)
+        self.backoff_base = float(retry_settings.get('BACKOFF_BASE', 1))
+        self.backoff_max = float(retry_settings.get('BACKOFF_MAX', 60))
+        self.retry_budget = int(retry_settings.get('RETRY_BUDGET', 200))
+        self.circuit_breaker_threshold = int(retry_settings.get('CIRCUIT_BREAKER_THRESHOLD', 10))
+        self.circuit_breaker_reset = float(retry_settings.get('CIRCUIT_BREAKER_RESET', 60))
+        self.circuit_breakers = {}
+        self.lock = threading.Lock()
+
+    def get_circuit_breaker(self, request_url):
+        """
+        Return the circuit breaker of the request host.
+        """
+        host = urlparse(request_url).netloc
+
+        with self.lock:
+            if host not in self.circuit_breakers:
+                self.circuit_breakers[host] = CircuitBreaker(
+                    self.circuit_breaker_threshold,
+                    self.circuit_breaker_reset,
+                )
+
+            return self.circuit_breakers[host]
+
+    def take_retry(self, request_url, failure):
+        """
+        Take one retry from the retry budget.
+
+        Raises:
+            RetryBudgetExhaustedError: When there are no retries left.
+        """
+        with self.lock:
+            if self.retry_budget <= 0:
+                raise RetryBudgetExhaustedError(
+                    request_url,
+                    '{}, and the retry budget is exhausted'.format(failure),
+                )
+
+            self.retry_budget -= 1
+
+    def get_backoff(self, attempt, retry_after=None):
+        """
+        Return the seconds to wait before the next attempt: the Retry-After value of the response
+        or an exponential back-off with full jitter, capped by BACKOFF_MAX.
+        """
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    def send(self, request_function, request_url, request_stage=None, deadline=None, request_limiter=None,
+             retry_timeouts=True):
+        """
+        Send the request, retrying the transient failures.
+
+        Args:
+            request_function: Callable that sends the request with the given (connect, read) timeout
+                              tuple and returns the response.
+            request_url: URL of the request.
+            request_stage: StageMetrics of the request, its retries value is updated.
+            deadline: Deadline of the request, no retry is done after it.
+            request_limiter: RequestLimiter of the request, every attempt waits for it.
+            retry_timeouts: When False, a read timeout or a 504 response raises RequestTimeoutError
+                            without retrying, e.g. to split a request that is too big. The connect
+                            timeouts are always retried.
+        Returns:
+            The successful response.
+        Raises:
+            ReportRequestError: When the request cannot be completed.
+        """
+        circuit_breaker = self.get_circuit_breaker(request_url)
+        deadline = deadline or Deadline()
+        attempt = 0
+
+        while True:
+            deadline.check(request_url)
+            circuit_breaker.before_request(request_url)
+            retry_after = None
+
+            if request_limiter:
+                throttled_seconds = request_limiter.acquire(request_url, deadline)
+
+                if request_stage:
+                    request_stage.labels['throttled_seconds'] = round(
+                        request_stage.labels.get('throttled_seconds', 0) + throttled_seconds,
+                        6,
+                    )
+
+            try:
+                # The limiter may have waited until the deadline, a request without time left is not sent.
+                remaining = deadline.remaining()
+
+                if remaining == 0:
+                    raise DeadlineExceededError(request_url, 'the deadline expired waiting for the request limits')
+
+                request_response = request_function((
+                    _connect_timeout if remaining is None else min(_connect_timeout, remaining),
+                    _read_timeout if remaining is None else min(_read_timeout, remaining),
+                ))
+            except (requests.Timeout, requests.ConnectionError) as error:
+                if deadline.expired():
+                    # The timeouts were reduced to the deadline, it's not a timeout of the request itself.
+                    raise DeadlineExceededError(request_url, '{} at the deadline'.format(type(error).__name__))
+
+                # Only a slow response depends on the size of the request, the connect timeouts and
+                # the connection errors are retried and counted by the circuit breaker.
+                if not retry_timeouts and isinstance(error, requests.ReadTimeout):
+                    raise RequestTimeoutError(request_url, type(error).__name__)
+
+                failure = type(error).__name__
+                request_response = None
+            finally:
+                if request_limiter:
+                    request_limiter.release()
+
+            if request_response is not None:
+                status_code = request_response.status_code
+
+                if status_code in (202, 200):
+                    circuit_breaker.record_success()
+                    return request_response
+
+                if not retry_timeouts and status_code in TIMEOUT_STATUS_CODES:
+                    raise RequestTimeoutError(request_url, 'response {}'.format(status_code))
+
+                if status_code not in RETRYABLE_STATUS_CODES:
+                    # The host answered, so it does not count as a failure of the circuit breaker.
+                    circuit_breaker.record_success()
+                    raise UnexpectedResponseError(request_url, status_code)
+
+                failure = 'response {}'.format(status_code)
+                retry_after = get_retry_after(request_response)
+
+            circuit_breaker.record_failure()
+            attempt += 1
+
+            if attempt >= self.max_attempts:
+                raise RetriesExhaustedError(request_url, '{} after {} attempts'.format(failure, attempt))
+
+            self.take_retry(request_url, failure)
+            backoff = self.get_backoff(attempt, retry_after)
+            remaining = deadline.remaining()
+
+            if remaining is not None and backoff >= remaining:
+                raise DeadlineExceededError(
+                    request_url,
+                    '{}, and the deadline expires before the next attempt'.format(failure),
+                )
+
+            if request_stage:
+                request_stage.retries = attempt
+
+            print('Request to {} failed ({}), retrying in {:.1f} seconds.'.format(request_url, failure, backoff))
+            sleep(backoff)
+
+
+_retry_policy = RetryPolicy()
+_request_limiters = RequestLimiters()
+_connect_timeout = DEFAULT_CONNECT_TIMEOUT
+_read_timeout = DEFAULT_READ_TIMEOUT
+
+
+def configure_retry_policy(retry_settings):
+    """
+    Set the retry policy of the process.
+
+    Args:
+        retry_settings: Dict with the REQUEST_RETRY settings.
+    Returns:
+        The new RetryPolicy.
+    """
+    global _retry_policy  # pylint: disable=global-statement
+
+    _retry_policy = RetryPolicy(retry_settings)
+
+    return _retry_policy
+
+
+def configure_request_limits(limit_settings):
+    """
+    Set the request limiters of the process.
+
+    Args:
+        limit_settings: Dict with the REQUEST_LIMITS settings.
+    """
+    global _request_limiters  # pylint: disable=global-statement
+
+    _request_limiters = RequestLimiters(limit_settings)
+
+
+def configure_request_timeouts(timeout_settings):
+    """
+    Set the connect and read timeouts of the requests of the process.
+
+    Args:
+        timeout_settings: Dict with the TIMEOUTS settings.
+    """
+    global _connect_timeout, _read_timeout  # pylint: disable=global-statement
+
+    timeout_settings = timeout_settings or {}
+    _connect_timeout = float(timeout_settings.get('CONNECT', DEFAULT_CONNECT_TIMEOUT))
+    _read_timeout = float(timeout_settings.get('READ', DEFAULT_READ_TIMEOUT))
+
+
+def get_retry_after(request_response):
+    """
+    Return the seconds of the Retry-After header of the response, None if it's missing or it's a date.
+    """
+    try:
+        return max(float(request_response.headers.get('Retry-After', '')), 0)
+    except ValueError:
+        return None
+
+
+def request_handler(request_url, request_data, request_type, request_headers, query_params, deadline=None,
+                    **kwargs):
     """
     Request the provided data.
 
@@ -14,29 +535,62 @@ def request_handler(request_url, request_data, request_type, request_headers, qu
         request_type: POST or GET request.
         request_headers: Dict that contains the request headers.
         query_params: Dict that contains the query params that will be included in the request.
+        deadline: Deadline of the request, the connect and read timeouts are reduced to the deadline.
+    Keyword args:
+        retry_timeouts: Retry the read timeouts and 504 responses, defaults to True.
+        response_stats: Dict to fill with the 'bytes' and the 'seconds' of the response.
     Returns:
         JSON response.
+    Raises:
+        ReportRequestError: When the request cannot be completed or the response is not json.
     """
-    if request_type == 'POST':
-        request_response = requests.post(
+    if request_type not in REQUEST_STAGES:
+        print('Request type {} not supported.'.format(request_type))
+        exit()
+
+    def send_request(timeout):
+        if request_type == 'POST':
+            return requests.post(
+                request_url,
+                headers=request_headers,
+                json=request_data,
+                params=query_params,
+                timeout=timeout,
+            )
+
+        return requests.get(
             request_url,
             headers=request_headers,
-            json=request_data,
             params=query_params,
+            timeout=timeout,
         )
-    elif request_type == 'GET':
-        request_response = requests.get(request_url, headers=request_headers, params=query_params)
-    else:
-        print('Request type {} not supported.'.format(request_type))
-        exit()
 
-    status_code = request_response.status_code
+    with stage(REQUEST_STAGES[request_type], url=request_url) as request_stage:
+        request_response = _retry_policy.send(
+            send_request,
+            request_url,
+            request_stage,
+            deadline,
+            _request_limiters.get_limiter(request_url, ENDPOINT_TYPES[request_type]),
+            kwargs.get('retry_timeouts', True),
+        )
+        request_stage.bytes = len(request_response.content)
+        request_stage.labels['status_code'] = request_response.status_code
+
+    response_stats = kwargs.get('response_stats')
+
+    if response_stats is not None:
+        response_stats['bytes'] = len(request_response.content)
+        response_stats['seconds'] = request_response.elapsed.total_seconds()
 
-    if status_code in (202, 200):
-        return request_response.json()
+    with stage('json_decode', url=request_url) as decode_stage:
+        decode_stage.bytes = len(request_response.content)
 
-    print('Request to {} got an unexpected response {}'.format(
-        request_url,
-        status_code,
-    ))
-    exit()
+        try:
+            return request_response.json()
+        except ValueError as error:
+            raise UnexpectedResponseError(
+                request_url,
+                request_response.status_code,
+                'the body cannot be parsed into json ({})'.format(error),
+            )
@@ -2,11 +2,36 @@
 Main module to request and polling the report data.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from importlib import import_module
 from time import sleep
 
-from proversity_reports_script.get_settings import get_settings
-from proversity_reports_script.request_module import request_handler
+from proversity_reports_script.course_costs import CourseCostStore
+from proversity_reports_script.delta_store import get_delta_store
+from proversity_reports_script.get_settings import SettingsError, get_settings
+from proversity_reports_script.metrics import configure_metrics, stage
+from proversity_reports_script.profiling import parse_profile_modes
+from proversity_reports_script.sharding import (
+    DEFAULT_QUEUE_BATCH_SIZE,
+    DEFAULT_QUEUE_LEASE_SECONDS,
+    CourseQueue,
+    PartialReportStore,
+    get_default_run_name,
+    get_shard_courses,
+    get_worker_name,
+    parse_shard,
+)
+from proversity_reports_script.sinks.base import DEFAULT_SHEETS_SINK, DEFAULT_STORAGE_SINK
+from proversity_reports_script.request_module import (
+    Deadline,
+    DeadlineExceededError,
+    ReportRequestError,
+    configure_request_limits,
+    configure_request_timeouts,
+    configure_retry_policy,
+    request_handler,
+)
 from proversity_reports_script.report_apis.report_api_v1 import (
     get_report_generation_data as get_report_generation_data_v1,
 )
@@ -17,42 +42,197 @@ class FetchReportData(object):
     Fetch and initialize the report backend.
     """
     def __init__(self, *args, **kwargs):
-        self.settings = get_settings(should_set_environment_settings=True)
+        self.settings = get_settings()
         self.command_extra_arguments = kwargs.pop('extra_arguments', {})
         self.api_version = kwargs.pop('api_version', 'v0')
+        self.failed_courses = {}
+        self.course_pages = {}
 
-        self.courses = self.settings.get('COURSES', [])
+        report_name = kwargs.pop('report_name', '')
+        self.report_name = report_name
 
-        if not self.courses:
-            print('Course id list was not provided.')
+        # A misconfigured report fails here, before any request is sent to the LMS.
+        try:
+            self.settings.validate(report_name)
+        except SettingsError as error:
+            print(error)
             exit()
 
-        report_name = kwargs.pop('report_name', '')
+        self.courses = self.settings.courses
+        self.report_settings = self.settings.get_report_settings(report_name)
+        self.report_backend = get_backend_report(self.report_settings)
+        self.init_sharding()
+        self.course_costs = CourseCostStore(
+            report_name,
+            self.report_settings.get('EXTRA_DATA', {}).get('COURSE_COST_FILE'),
+        )
+        self.delta_store = get_delta_store(report_name, self.report_settings.get('EXTRA_DATA', {}).get('DELTA'))
+        self.run_started_at = datetime.now(timezone.utc).isoformat()
+        self.metrics_recorder = configure_metrics(
+            self.settings.get('METRICS', {}),
+            report_name,
+            metrics_file=getattr(self.command_extra_arguments, 'metrics_file', None),
+        )
+        configure_retry_policy(self.settings.get('REQUEST_RETRY', {}))
+        configure_request_limits(self.settings.get('REQUEST_LIMITS', {}))
+
+        timeout_settings = self.settings.get('TIMEOUTS', {})
+        configure_request_timeouts(timeout_settings)
+        self.poll_task_timeout = timeout_settings.get('POLL_TASK')
+        self.run_deadline = Deadline(timeout_settings.get('RUN'))
+
+    def init_sharding(self):
+        """
+        Initialize the sharded run of the --shard, --work-queue and --merge-shards arguments (see sharding).
 
-        if not report_name in self.settings.get('SUPPORTED_REPORTS', []):
-            print('Report is not configured.')
+        The SHARDING settings of the configuration file are:
+            PARTIAL_DIR: Directory of the partial files of the cross-course reports, shared by the processes.
+            QUEUE_BATCH_SIZE: Number of courses that a process takes from the work queue at once.
+            QUEUE_LEASE_SECONDS: Seconds after which the courses of a process can be taken by the others.
+        """
+        sharding_settings = self.settings.get('SHARDING', {})
+        run_name = getattr(self.command_extra_arguments, 'shard_run', None) or get_default_run_name()
+        work_queue_file = getattr(self.command_extra_arguments, 'work_queue', None)
+        self.shard = parse_shard(getattr(self.command_extra_arguments, 'shard', None))
+        self.merge_shards = getattr(self.command_extra_arguments, 'merge_shards', False)
+        self.course_queue = None
+        self.partial_store = None
+        self.queue_batch_size = int(sharding_settings.get('QUEUE_BATCH_SIZE', DEFAULT_QUEUE_BATCH_SIZE))
+
+        if len([mode for mode in (self.shard, work_queue_file, self.merge_shards) if mode]) > 1:
+            print('The --shard, --work-queue and --merge-shards arguments cannot be combined.')
             exit()
 
-        self.report_settings = self.settings.get(report_name.upper(), {})
+        is_cross_course_report = getattr(self.report_backend, 'cross_course_report', False)
 
-        if not self.report_settings:
-            print('Missing report configuration.')
+        if self.merge_shards and not is_cross_course_report:
+            print('The report files of {} are uploaded by every shard, there is nothing to merge.'.format(
+                self.report_name,
+            ))
             exit()
 
-        self.report_backend = get_backend_report(self.report_settings)
+        if is_cross_course_report and (self.shard or work_queue_file or self.merge_shards):
+            self.partial_store = PartialReportStore(self.report_name, run_name, sharding_settings.get('PARTIAL_DIR'))
+
+        if self.shard:
+            self.courses = get_shard_courses(self.courses, *self.shard)
+            print('Shard {}/{}: {} courses.'.format(self.shard[0], self.shard[1], len(self.courses)))
+
+            if not self.courses:
+                exit()
+
+        if work_queue_file:
+            self.course_queue = CourseQueue(
+                work_queue_file,
+                '{}:{}'.format(self.report_name, run_name),
+                float(sharding_settings.get('QUEUE_LEASE_SECONDS', DEFAULT_QUEUE_LEASE_SECONDS)),
+            )
 
     def init_report_pipeline(self, *args, **kwargs):
         """
         Initialize the report pipeline to fetch the report data
         and then initialize the appropriate report backend.
         """
-        self.init_report_backend(
-            report_data=self.get_report_data(
-                report_generation_request_response=self.get_report_generation_data(),
-                request_headers=self.get_request_headers(),
-            )
+        try:
+            if self.merge_shards:
+                self.merge_shard_report_data()
+            elif self.course_queue:
+                self.run_course_queue()
+            else:
+                self.run_courses()
+        except ReportRequestError as error:
+            print('The report data cannot be obtained. {}'.format(error))
+            exit()
+        finally:
+            if self.metrics_recorder:
+                self.metrics_recorder.export()
+
+        if self.failed_courses:
+            print('The report data of these courses could not be obtained:')
+
+            for course_id, error in self.failed_courses.items():
+                print('    {}: {}'.format(course_id, error))
+        elif self.delta_store and not (self.shard or self.course_queue):
+            # The next delta run requests the changes since the start of this one.
+            self.delta_store.save_run(self.run_started_at)
+
+    def run_courses(self):
+        """
+        Fetch the report data of the courses and generate the report, or save the report data
+        as a partial file when the report is merged from several shards.
+        """
+        report_data = self.get_report_data(
+            report_generation_request_response=self.get_report_generation_data(),
+            request_headers=self.get_request_headers(),
         )
 
+        if self.partial_store:
+            print('Partial report data saved to: {}'.format(
+                self.partial_store.save(
+                    self.courses,
+                    self.failed_courses,
+                    report_data,
+                    course_pages=self.course_pages if self.api_version == 'v1' else None,
+                ),
+            ))
+        else:
+            self.init_report_backend(report_data)
+
+    def run_course_queue(self):
+        """
+        Run the batches of courses of the work queue until it's empty or the run deadline expires.
+
+        The queue is filled with every course of the configuration, the most expensive first,
+        by the first process of the run. A batch that cannot be obtained fails its courses,
+        and the other batches are still run.
+        """
+        worker = get_worker_name()
+        self.course_queue.fill(self.course_costs.sort_by_cost(self.courses))
+
+        while not self.run_deadline.expired():
+            self.courses = self.course_queue.claim(worker, self.queue_batch_size)
+
+            if not self.courses:
+                break
+
+            print('Work queue batch: {}'.format(', '.join(self.courses)))
+
+            try:
+                self.run_courses()
+            except ReportRequestError as error:
+                print('The report data cannot be obtained. {}'.format(error))
+
+                for course_id in self.courses:
+                    self.failed_courses.setdefault(course_id, str(error))
+            except SystemExit:
+                self.course_queue.finish(
+                    self.courses,
+                    {course_id: 'The run was aborted.' for course_id in self.courses},
+                )
+                raise
+
+            self.course_queue.finish(self.courses, self.failed_courses)
+
+        print('Work queue courses: {}'.format(', '.join(
+            '{} {}'.format(count, status) for status, count in sorted(self.course_queue.get_status_counts().items())
+        )))
+
+    def merge_shard_report_data(self):
+        """
+        Generate the cross-course report from the partial files of the shards of the run,
+        the courses without partial report data are added to failed_courses.
+        """
+        report_data, missing_courses = self.partial_store.load(self.courses)
+
+        for course_id in missing_courses:
+            self.failed_courses[course_id] = 'The course is not in the partial files of the shards.'
+
+        if not report_data:
+            print('No partial report data in: {}'.format(self.partial_store.directory))
+            exit()
+
+        self.init_report_backend(report_data)
+
     def get_report_generation_data(self):
         """
         Return the response data from the report generation request.
@@ -100,6 +280,7 @@ class FetchReportData(object):
                 request_type='POST',
                 request_headers=self.get_request_headers(),
                 query_params=extra_request_data.get('query_params', {}),
+                deadline=self.run_deadline,
             )
 
         if self.api_version == 'v1':
@@ -109,6 +290,9 @@ class FetchReportData(object):
                 extra_request_data=extra_request_data,
                 report_settings=self.report_settings,
                 request_headers=self.get_request_headers(),
+                failed_courses=self.failed_courses,
+                deadline=self.run_deadline,
+                course_costs=self.course_costs,
             )
 
     def report_generation_request_data(self):
@@ -120,7 +304,7 @@ class FetchReportData(object):
             request_data: Dict that contains the request body.
         """
         request_url = '{lms_url}{report_url}'.format(
-            lms_url=self.settings.get('LMS_URL', ''),
+            lms_url=self.settings.lms_url,
             report_url=self.report_settings.get('REPORT_URL', ''),
         )
         request_data = {'course_ids': self.courses}
@@ -135,7 +319,17 @@ class FetchReportData(object):
 
         API v0 does not support pagination so, it will return all response data.
         API v1 supports pagination so, it will request all the pages per course, when there is no more
-        pages in any course, it will return all the report data.
+        pages in any course, it will return all the report data. When a page request fails, the course
+        is added to failed_courses and its pages are left out of the report data.
+
+        Every task is polled until TIMEOUTS['POLL_TASK'] and the whole run until TIMEOUTS['RUN'],
+        when the run deadline expires the remaining courses are added to failed_courses,
+        so the report is still generated with the courses that were obtained.
+
+        The pages are polled by EXTRA_DATA['MAX_POLL_WORKERS'] threads (1 by default), the most
+        expensive courses of the previous runs first, and the report data keeps the order of the
+        courses and pages. The payload size of every course is saved into the course cost store,
+        for the generation requests and the scheduling of the next runs.
 
         Args:
             report_generation_request_response: Dict containing the report generation response
@@ -150,6 +344,7 @@ class FetchReportData(object):
             report_data = polling_report_data(
                 report_data_url=report_generation_request_response.get('state_url', ''),
                 request_headers=request_headers,
+                deadline=Deadline(self.poll_task_timeout, parent=self.run_deadline),
             )
         elif self.api_version == 'v1':
             response_data = report_generation_request_response.get('data', {})
@@ -159,17 +354,54 @@ class FetchReportData(object):
                 print('No response data.')
                 exit()
 
-            for course_id in self.courses:
-                for page_url in response_data.get(course_id, []):
-                    report_data.append(
-                        polling_report_data(
-                            report_data_url=page_url,
-                            request_headers=request_headers,
-                        )
-                    )
+            max_poll_workers = int(self.report_settings.get('EXTRA_DATA', {}).get('MAX_POLL_WORKERS', 1))
+
+            with ThreadPoolExecutor(max_workers=max(max_poll_workers, 1)) as executor:
+                # The pages are started largest course first, but they are collected in the course order.
+                course_futures = {
+                    course_id: [
+                        executor.submit(self.poll_page, page_url, request_headers)
+                        for page_url in response_data.get(course_id, [])
+                    ]
+                    for course_id in self.course_costs.sort_by_cost(self.courses)
+                }
+
+                for course_id in self.courses:
+                    try:
+                        course_pages = [page_future.result() for page_future in course_futures[course_id]]
+                    except ReportRequestError as error:
+                        # A partial course would produce an incomplete report, so none of its pages are kept.
+                        print('The report data of {} cannot be obtained. {}'.format(course_id, error))
+                        self.failed_courses[course_id] = str(error)
+                        continue
+
+                    self.course_pages[course_id] = [page_data for page_data, _ in course_pages]
+                    report_data.extend(self.course_pages[course_id])
+
+                    if course_pages:
+                        self.course_costs.update(course_id, sum(page_bytes for _, page_bytes in course_pages))
+
+            self.course_costs.save()
 
         return report_data
 
+    def poll_page(self, page_url, request_headers):
+        """
+        Poll one report page, the poll task deadline starts when the polling starts.
+
+        Returns:
+            Tuple with the page data and its size in bytes.
+        """
+        response_stats = {}
+        page_data = polling_report_data(
+            report_data_url=page_url,
+            request_headers=request_headers,
+            deadline=Deadline(self.poll_task_timeout, parent=self.run_deadline),
+            response_stats=response_stats,
+        )
+
+        return page_data, response_stats.get('bytes', 0)
+
     def init_report_backend(self, report_data):
         """
         Initialize the report backend with the report data and extra data.
@@ -177,8 +409,28 @@ class FetchReportData(object):
         Args:
             report_data: The report data dict object.
         """
-        extra_data = self.report_settings.get('EXTRA_DATA', {})
+        extra_data = dict(self.report_settings.get('EXTRA_DATA', {}))
         extra_data['extra_arguments'] = self.command_extra_arguments
+        extra_data['REPORT_NAME'] = self.report_name
+        extra_data['PROFILE_MODES'] = parse_profile_modes(getattr(self.command_extra_arguments, 'profile', None))
+        extra_data['COURSE_COSTS'] = self.course_costs
+        extra_data['DELTA_SINCE'] = self.get_additional_request_data().get('since')
+        extra_data['RUN_ID'] = self.metrics_recorder.run_id if self.metrics_recorder else None
+
+        if extra_data.get('STORAGE_SINK', DEFAULT_STORAGE_SINK) == DEFAULT_STORAGE_SINK:
+            # The AWS keys of the settings are passed to the S3 client instead of the environment.
+            extra_data['STORAGE_SINK_OPTIONS'] = dict(
+                self.settings.get_storage_credentials(),
+                **(extra_data.get('STORAGE_SINK_OPTIONS') or {})
+            )
+
+        if extra_data.get('SHEETS_SINK', DEFAULT_SHEETS_SINK) == DEFAULT_SHEETS_SINK:
+            # The service account of the settings, when it's the credentials provider of the Google Sheets API.
+            extra_data['SHEETS_SINK_OPTIONS'] = dict(
+                self.settings.get_sheets_credentials(),
+                **(extra_data.get('SHEETS_SINK_OPTIONS') or {})
+            )
+
         report_builder = self.report_backend(extra_data=extra_data)
 
         report_builder.generate_report(report_data)
@@ -193,6 +445,9 @@ class FetchReportData(object):
         you only need to add the command argument with the same name that you defined in the
         configuration file and the extra request data item will be overwritten with the command argument value.
 
+        In delta mode (EXTRA_DATA['DELTA']), an empty 'since' item is set to the start time
+        of the last complete run, so the LMS only returns the users changed since then.
+
         Return:
             request_extra_data: Dict containing the request extra data.
         """
@@ -202,6 +457,9 @@ class FetchReportData(object):
         for item, value in extra_request_data_from_settings.items():
             extra_request_data[item] = getattr(self.command_extra_arguments, item, value)
 
+        if self.delta_store and 'since' in extra_request_data and not extra_request_data['since']:
+            extra_request_data['since'] = self.delta_store.get_last_run() or ''
+
         return extra_request_data
 
     def get_request_headers(self):
@@ -217,53 +475,77 @@ class FetchReportData(object):
         }
 
 
-def polling_report_data(report_data_url, request_headers):
+def polling_report_data(report_data_url, request_headers, deadline=None, response_stats=None):
     """
     Polling the report data in some configured unit times.
 
+    The whole polling is recorded as the poll_task stage, the retries value
+    is the number of polls after the first request.
+
     Args:
         report_data_url: API url endpoint to request the report data.
         request_headers: Dict that contains the request headers.
+        deadline: Deadline of the task, its requests and waits are bound to it.
+        response_stats: Dict to fill with the 'bytes' and the 'seconds' of the last response.
     Returns:
         report_data: Report data response.
+    Raises:
+        ReportRequestError: When the task cannot be polled, e.g. DeadlineExceededError.
     """
-    polling_count = 0
-    report_data = request_handler(
-        request_url=report_data_url,
-        request_data={},
-        request_type='GET',
-        request_headers=request_headers,
-        query_params={},
-    )
-
-    while(report_data.get('status', '') != 'SUCCESS'):
-        polling_count += 1
-        sleep_for = 2 # every 2 seconds for 10 seconds
-
-        if polling_count >= 5:
-            sleep_for = 5 # then every 5 seconds for 20 seconds
-
-        if polling_count >= 9:
-            sleep_for = 15 # then every 15 seconds for for a minute
-
-        if polling_count >= 13:
-            sleep_for = 60 # then once a minute for 3
-
-        if polling_count >= 16 or report_data.get('status') == 'FAILURE': # then stop
-            print('Status failed to become success.')
-            print('Failed task URL: {}'.format(report_data_url))
-            return {}
-
-        sleep(sleep_for)
-        print('waitig for... {}'.format(sleep_for))
+    deadline = deadline or Deadline()
+
+    with stage('poll_task', url=report_data_url) as poll_stage:
+        polling_count = 0
         report_data = request_handler(
             request_url=report_data_url,
             request_data={},
             request_type='GET',
             request_headers=request_headers,
             query_params={},
+            deadline=deadline,
+            response_stats=response_stats,
         )
 
+        while(report_data.get('status', '') != 'SUCCESS'):
+            polling_count += 1
+            sleep_for = 2 # every 2 seconds for 10 seconds
+
+            if polling_count >= 5:
+                sleep_for = 5 # then every 5 seconds for 20 seconds
+
+            if polling_count >= 9:
+                sleep_for = 15 # then every 15 seconds for for a minute
+
+            if polling_count >= 13:
+                sleep_for = 60 # then once a minute for 3
+
+            if polling_count >= 16 or report_data.get('status') == 'FAILURE': # then stop
+                poll_stage.labels['status'] = report_data.get('status', '')
+                print('Status failed to become success.')
+                print('Failed task URL: {}'.format(report_data_url))
+                return {}
+
+            remaining = deadline.remaining()
+
+            if remaining is not None and sleep_for >= remaining:
+                poll_stage.labels['status'] = report_data.get('status', '')
+                raise DeadlineExceededError(report_data_url, 'the task did not finish before the deadline')
+
+            sleep(sleep_for)
+            poll_stage.retries = polling_count
+            print('Waiting for... {} seconds'.format(sleep_for))
+            report_data = request_handler(
+                request_url=report_data_url,
+                request_data={},
+                request_type='GET',
+                request_headers=request_headers,
+                query_params={},
+                deadline=deadline,
+                response_stats=response_stats,
+            )
+
+        poll_stage.labels['status'] = 'SUCCESS'
+
     print('Report data obtained from: {}'.format(report_data_url))
     return report_data
 
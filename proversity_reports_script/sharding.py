@@ -0,0 +1,329 @@
+"""
+Sharded runs of the course list, to split the courses of a report between several processes or hosts.
+
+    --shard i/N: The process only runs the courses of the shard i (1 to N). The courses are assigned
+                 with consistent (rendezvous) hashing of the course ids, so adding a course or a shard
+                 only moves the courses of one shard.
+    --work-queue FILE: The processes take batches of courses from a SQLite queue until it's empty,
+                       the most expensive courses first. The courses of a process that stops are taken
+                       by the other processes when their lease expires.
+
+Every process uploads the files of its own courses. The cross-course reports (e.g. enrollment per site)
+only save the report data of their courses as partial files, and the --merge-shards run builds and
+uploads the report from the partial files of every process.
+"""
+from contextlib import closing
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+from time import time
+import uuid
+
+DEFAULT_PARTIAL_DIR = os.path.join(os.path.dirname(__file__), 'result', 'shards')
+DEFAULT_QUEUE_BATCH_SIZE = 5
+DEFAULT_QUEUE_LEASE_SECONDS = 3600
+QUEUE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS queue_courses (
+        queue TEXT NOT NULL,
+        course_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        worker TEXT,
+        claimed_at REAL,
+        error TEXT,
+        PRIMARY KEY (queue, course_id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS queue_courses_status ON queue_courses (queue, status, position)',
+)
+
+
+def parse_shard(shard):
+    """
+    Return the (shard index, shard count) tuple of the --shard argument, None if it's not set.
+
+    Args:
+        shard: String in the i/N format, e.g. '2/4'.
+    """
+    if not shard:
+        return None
+
+    try:
+        shard_index, shard_count = [int(value) for value in shard.split('/')]
+    except ValueError:
+        shard_index, shard_count = 0, 0
+
+    if not 1 <= shard_index <= shard_count:
+        print('The shard {} is not valid, the format is i/N with i from 1 to N.'.format(shard))
+        exit()
+
+    return shard_index, shard_count
+
+
+def get_course_shard(course_id, shard_count):
+    """
+    Return the shard, from 1 to shard_count, of the course: the shard with the highest hash for the course.
+    """
+    return max(
+        range(1, shard_count + 1),
+        key=lambda shard_index: hashlib.sha1('{}:{}'.format(shard_index, course_id).encode('utf-8')).digest(),
+    )
+
+
+def get_shard_courses(courses, shard_index, shard_count):
+    """
+    Return the courses of the shard, in the same order.
+    """
+    return [course_id for course_id in courses if get_course_shard(course_id, shard_count) == shard_index]
+
+
+def get_default_run_name():
+    """
+    Return the default name of the sharded run: the current UTC date, shared by the processes of a nightly run.
+    """
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def get_worker_name():
+    """
+    Return a name that identifies the current process in the queue.
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class CourseQueue(object):
+    """
+    Queue of the courses of one run in a SQLite file, shared by the processes of the run.
+
+    The connections are opened per operation and the claims are done in immediate transactions,
+    so a course is only claimed by one process at a time.
+    """
+
+    def __init__(self, file_path, queue_name, lease_seconds=DEFAULT_QUEUE_LEASE_SECONDS):
+        """
+        Args:
+            file_path: Path of the SQLite file.
+            queue_name: Name of the queue, the report name and the run name.
+            lease_seconds: Seconds after which a claimed course that is not finished can be claimed again.
+        """
+        self.file_path = file_path
+        self.queue_name = queue_name
+        self.lease_seconds = lease_seconds
+
+        with closing(self.connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+
+            for statement in QUEUE_SCHEMA:
+                connection.execute(statement)
+
+    def connect(self):
+        """
+        Return a new connection to the queue, in autocommit mode.
+        """
+        return sqlite3.connect(self.file_path, timeout=60, isolation_level=None)
+
+    def fill(self, course_ids):
+        """
+        Add the courses to the queue in the given order, the courses already in the queue are kept.
+        """
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'INSERT OR IGNORE INTO queue_courses (queue, course_id, position, status) VALUES (?, ?, ?, ?)',
+                (
+                    (self.queue_name, course_id, position, 'pending')
+                    for position, course_id in enumerate(course_ids)
+                ),
+            )
+            connection.execute('COMMIT')
+
+    def claim(self, worker, count):
+        """
+        Claim the next pending courses, or the claimed courses with an expired lease.
+
+        Args:
+            worker: Name of the process, see get_worker_name.
+            count: Maximum number of courses.
+        Returns:
+            List of course ids, empty when there are no courses left.
+        """
+        now = time()
+
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            course_ids = [
+                course_id for course_id, in connection.execute(
+                    '''
+                    SELECT course_id FROM queue_courses
+                    WHERE queue = ? AND (status = 'pending' OR (status = 'claimed' AND claimed_at < ?))
+                    ORDER BY position
+                    LIMIT ?
+                    ''',
+                    (self.queue_name, now - self.lease_seconds, count),
+                )
+            ]
+            connection.executemany(
+                "UPDATE queue_courses SET status = 'claimed', worker = ?, claimed_at = ? "
+                'WHERE queue = ? AND course_id = ?',
+                ((worker, now, self.queue_name, course_id) for course_id in course_ids),
+            )
+            connection.execute('COMMIT')
+
+        return course_ids
+
+    def finish(self, course_ids, failed_courses):
+        """
+        Mark the courses as done, or as failed with their error.
+
+        Args:
+            course_ids: List of the claimed course ids.
+            failed_courses: Dict of course id to error message.
+        """
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(
+                'UPDATE queue_courses SET status = ?, error = ? WHERE queue = ? AND course_id = ?',
+                (
+                    (
+                        'failed' if course_id in failed_courses else 'done',
+                        failed_courses.get(course_id),
+                        self.queue_name,
+                        course_id,
+                    )
+                    for course_id in course_ids
+                ),
+            )
+            connection.execute('COMMIT')
+
+    def get_status_counts(self):
+        """
+        Return a dict with the number of courses of every status.
+        """
+        with closing(self.connect()) as connection:
+            return dict(connection.execute(
+                'SELECT status, COUNT(*) FROM queue_courses WHERE queue = ? GROUP BY status',
+                (self.queue_name,),
+            ))
+
+
+class PartialReportStore(object):
+    """
+    Report data of the processes of a sharded run, one json file per run of the pipeline.
+    """
+
+    def __init__(self, report_name, run_name, directory=None):
+        """
+        Args:
+            report_name: Name of the report.
+            run_name: Name of the sharded run, the partial files of other runs are not merged.
+            directory: Parent directory of the partial files, defaults to result/shards.
+        """
+        self.directory = os.path.join(directory or DEFAULT_PARTIAL_DIR, report_name, run_name)
+
+    def save(self, course_ids, failed_courses, report_data, course_pages=None):
+        """
+        Write the report data of the courses into a new partial file.
+
+        Args:
+            course_ids: List of the course ids of the report data.
+            failed_courses: Dict of course id to error message, the courses without report data.
+            report_data: Report data of the pipeline.
+            course_pages: Dict of course id to its list of API v1 pages, so the merged
+                          pages keep the order of the courses.
+        Returns:
+            Path of the partial file.
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        file_path = os.path.join(self.directory, '{}.json'.format(uuid.uuid4().hex))
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix='.partial-')
+
+        course_ids = [course_id for course_id in course_ids if course_id not in failed_courses]
+
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as partial_file:
+            json.dump(
+                {
+                    'courses': course_ids,
+                    'report_data': None if course_pages is not None else report_data,
+                    'course_pages': None if course_pages is None else {
+                        course_id: course_pages.get(course_id, []) for course_id in course_ids
+                    },
+                },
+                partial_file,
+            )
+
+        # The merge step never reads a partial file that is still being written.
+        os.replace(temporary_path, file_path)
+
+        return file_path
+
+    def load(self, course_ids):
+        """
+        Return the report data of the partial files merged in the order of the courses.
+
+        Args:
+            course_ids: List of the course ids of the report.
+        Returns:
+            Tuple with the merged report data and the list of course ids without report data.
+        """
+        partials = []
+
+        if os.path.isdir(self.directory):
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith('.json') or file_name.startswith('.'):
+                    continue
+
+                with open(os.path.join(self.directory, file_name), 'r', encoding='utf-8') as partial_file:
+                    partials.append(json.load(partial_file))
+
+        merged_courses = set()
+        course_pages = {}
+
+        for partial in partials:
+            merged_courses.update(partial['courses'])
+            course_pages.update(partial.get('course_pages') or {})
+
+        missing_courses = [course_id for course_id in course_ids if course_id not in merged_courses]
+
+        if partials and all(partial.get('course_pages') is not None for partial in partials):
+            return [page for course_id in course_ids for page in course_pages.get(course_id, [])], missing_courses
+
+        course_positions = {course_id: position for position, course_id in enumerate(course_ids)}
+        partials.sort(key=lambda partial: min(
+            [course_positions.get(course_id, len(course_ids)) for course_id in partial['courses']] or [len(course_ids)]
+        ))
+
+        return merge_report_data([partial['report_data'] for partial in partials]), missing_courses
+
+
+def merge_report_data(report_data_list):
+    """
+    Merge the report data of several runs of the pipeline.
+
+    The API v1 page lists are concatenated, and the API v0 dicts are merged key by key,
+    e.g. the 'result' dicts of course id to course data.
+    """
+    report_data_list = [report_data for report_data in report_data_list if report_data]
+
+    if not report_data_list:
+        return []
+
+    if all(isinstance(report_data, list) for report_data in report_data_list):
+        return [page_data for report_data in report_data_list for page_data in report_data]
+
+    merged_report_data = {}
+
+    for report_data in report_data_list:
+        for key, value in report_data.items():
+            if isinstance(value, dict) and isinstance(merged_report_data.get(key), dict):
+                merged_report_data[key] = merge_report_data([merged_report_data[key], value])
+            else:
+                merged_report_data[key] = value
+
+    return merged_report_data
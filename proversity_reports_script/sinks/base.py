@@ -0,0 +1,119 @@
+"""
+Abstract base classes of the report sinks.
+
+The report backends upload the report files to a storage sink (S3 by default) and
+the report data to a sheets sink (Google Sheets by default). Both sinks can be replaced
+from the report EXTRA_DATA, e.g. with the fake sinks to run the pipeline offline:
+
+    "EXTRA_DATA": {
+        "STORAGE_SINK": "proversity_reports_script.sinks.fake:FakeStorageSink",
+        "STORAGE_SINK_OPTIONS": {"latency": 0.1},
+        "SHEETS_SINK": "proversity_reports_script.sinks.fake:FakeSheetsSink",
+        "SHEETS_SINK_OPTIONS": {"latency": 0.3, "requests_per_minute": 60}
+    }
+"""
+import abc
+from importlib import import_module
+
+DEFAULT_STORAGE_SINK = 'proversity_reports_script.sinks.s3:S3StorageSink'
+DEFAULT_SHEETS_SINK = 'proversity_reports_script.sinks.google_sheets:GoogleSheetsSink'
+
+
+class AbstractStorageSink(object):
+    """
+    Abstract Base Class for the report file storages.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def upload_file(self, bucket_name, file_path, key):
+        """
+        Upload the local file to the bucket with the provided key.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def get_object(self, bucket_name, key, if_none_match=None, if_modified_since=None):
+        """
+        Return a dict with the Body, ETag and LastModified values of the stored object.
+        Return None if the object matches if_none_match or was not modified since if_modified_since.
+        """
+        raise NotImplementedError()
+
+
+class AbstractSheetsSink(object):
+    """
+    Abstract Base Class for the spreadsheet services.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractmethod
+    def clear_values(self, spreadsheet_id, range_name):
+        """
+        Clear the values of the spreadsheet range.
+        """
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def update_values(self, spreadsheet_id, range_name, values, value_input_option='USER_ENTERED'):
+        """
+        Write the list of rows into the spreadsheet range.
+        """
+        raise NotImplementedError()
+
+    def batch_update_values(self, spreadsheet_id, data, value_input_option='USER_ENTERED'):
+        """
+        Write the list of rows of every range.
+
+        The sinks with a batch request should override it, by default every range is written
+        with its own request.
+
+        Args:
+            spreadsheet_id: Spreadsheet id.
+            data: List of (range name, list of rows) tuples.
+            value_input_option: How the values are interpreted.
+        """
+        for range_name, values in data:
+            self.update_values(spreadsheet_id, range_name, values, value_input_option)
+
+    def batch_clear_values(self, spreadsheet_id, range_names):
+        """
+        Clear the values of every range.
+
+        The sinks with a batch request should override it, by default every range is cleared
+        with its own request.
+        """
+        for range_name in range_names:
+            self.clear_values(spreadsheet_id, range_name)
+
+    def add_sheets(self, spreadsheet_id, sheet_titles):
+        """
+        Add the sheets (tabs) that do not exist yet in the spreadsheet.
+
+        The sinks that create the sheets of the written ranges on their own don't need to override it.
+        """
+        pass
+
+
+class SinkError(Exception):
+    """
+    Exception class raised when a sink cannot complete a request.
+    """
+    pass
+
+
+def load_sink(sink_path, default_sink_path, sink_options=None):
+    """
+    Return a new sink instance from its 'module:ClassName' path.
+
+    Args:
+        sink_path: Configured sink path, the default sink is used when it's empty.
+        default_sink_path: Default sink path.
+        sink_options: Dict with the keyword arguments of the sink class.
+    Returns:
+        Sink instance.
+    """
+    module_name, class_name = (sink_path or default_sink_path).split(':')
+    sink_class = getattr(import_module(module_name), class_name)
+
+    return sink_class(**(sink_options or {}))
@@ -0,0 +1,287 @@
+"""
+In-process fake sinks to run and profile the report pipeline without Amazon S3 or Google Sheets.
+
+They model the per-request latency, the request quotas and the payload size limits of the
+real services, and keep counters of the requests and the uploaded bytes.
+"""
+from datetime import datetime
+import hashlib
+import io
+import json
+import os
+import threading
+from time import monotonic, sleep
+
+from proversity_reports_script.metrics import stage
+from proversity_reports_script.sinks.base import AbstractSheetsSink, AbstractStorageSink, SinkError
+
+
+class RequestQuota(object):
+    """
+    Sliding window of the requests done in the last minute.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.request_times = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Every process has its own window, only the quota is sent to the worker processes.
+        return {'requests_per_minute': self.requests_per_minute}
+
+    def __setstate__(self, state):
+        self.__init__(state['requests_per_minute'])
+
+    def acquire(self, wait):
+        """
+        Register a new request.
+
+        Args:
+            wait: Wait until the request fits into the quota instead of raising an error.
+        Raises:
+            SinkError: When the quota is exceeded and wait is False.
+        """
+        if not self.requests_per_minute:
+            return
+
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.request_times = [
+                    request_time for request_time in self.request_times if now - request_time < 60
+                ]
+
+                if len(self.request_times) < self.requests_per_minute:
+                    self.request_times.append(now)
+                    return
+
+                wait_for = 60 - (now - self.request_times[0])
+
+            if not wait:
+                raise SinkError('Quota exceeded: {} requests per minute.'.format(self.requests_per_minute))
+
+            sleep(wait_for)
+
+
+class FakeSinkMixin(object):
+    """
+    Common latency, quota and counters of the fake sinks.
+    """
+
+    def setup_fake_sink(self, latency=0, requests_per_minute=0, wait_for_quota=False):
+        """
+        Set the common fake sink options.
+
+        Args:
+            latency: Seconds added to every request.
+            requests_per_minute: Maximum number of requests per minute, 0 disables the quota.
+            wait_for_quota: Block until the quota allows the request instead of raising an error.
+        """
+        self.latency = latency
+        self.quota = RequestQuota(requests_per_minute)
+        self.wait_for_quota = wait_for_quota
+        self.stats = {
+            'requests': 0,
+            'bytes': 0,
+        }
+        self.stats_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('stats_lock', None)
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stats_lock = threading.Lock()
+
+    def fake_request(self, payload_bytes=0):
+        """
+        Apply the quota and the latency of one request, and update the counters.
+        """
+        self.quota.acquire(self.wait_for_quota)
+
+        if self.latency:
+            sleep(self.latency)
+
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['bytes'] += payload_bytes
+
+
+class FakeStorageSink(FakeSinkMixin, AbstractStorageSink):
+    """
+    Storage sink that keeps the uploaded files in memory.
+    """
+
+    def __init__(self, latency=0, requests_per_minute=0, max_object_size=5 * 1024 ** 3, **kwargs):
+        """
+        Args:
+            latency: Seconds added to every request.
+            requests_per_minute: Maximum number of requests per minute, 0 disables the quota.
+            max_object_size: Maximum size in bytes of an uploaded file, S3 single PUT limit by default.
+        Keyword args:
+            wait_for_quota: Block until the quota allows the request instead of raising an error.
+            keep_contents: Keep the uploaded file contents in memory, defaults to True.
+            objects: Dict of 'bucket/key' to local file path, the objects returned by get_object.
+        """
+        self.setup_fake_sink(latency, requests_per_minute, kwargs.get('wait_for_quota', False))
+        self.max_object_size = max_object_size
+        self.keep_contents = kwargs.get('keep_contents', True)
+        self.objects = {}
+
+        for object_path, file_path in kwargs.get('objects', {}).items():
+            with open(file_path, 'rb') as object_file:
+                self.objects[object_path] = object_file.read()
+
+    def upload_file(self, bucket_name, file_path, key):
+        """
+        Store the file contents in memory.
+        """
+        file_size = os.path.getsize(file_path)
+
+        if file_size > self.max_object_size:
+            raise SinkError('The file {} exceeds the maximum object size.'.format(file_path))
+
+        with stage('s3_upload', key=key) as upload_stage:
+            upload_stage.bytes = file_size
+            self.fake_request(file_size)
+
+        if self.keep_contents:
+            with open(file_path, 'rb') as upload_file:
+                self.objects['{}/{}'.format(bucket_name, key)] = upload_file.read()
+
+    def get_object(self, bucket_name, key, if_none_match=None, if_modified_since=None):  # pylint: disable=unused-argument
+        """
+        Return the stored object, or None when its ETag matches if_none_match.
+        """
+        self.fake_request()
+        contents = self.objects.get('{}/{}'.format(bucket_name, key))
+
+        if contents is None:
+            raise SinkError('The object {}/{} does not exist.'.format(bucket_name, key))
+
+        etag = '"{}"'.format(hashlib.md5(contents).hexdigest())
+
+        if if_none_match == etag:
+            return None
+
+        return {
+            'Body': io.BytesIO(contents),
+            'ETag': etag,
+            'LastModified': datetime.utcnow(),
+        }
+
+
+class FakeSheetsSink(FakeSinkMixin, AbstractSheetsSink):
+    """
+    Sheets sink that keeps the spreadsheet values in memory.
+    """
+
+    def __init__(self, latency=0, requests_per_minute=0, max_payload_bytes=10 * 1024 ** 2, max_cells=5000000, **kwargs):
+        """
+        Args:
+            latency: Seconds added to every request.
+            requests_per_minute: Maximum number of requests per minute, 0 disables the quota.
+            max_payload_bytes: Maximum size of the json body of a request.
+            max_cells: Maximum number of cells of a spreadsheet.
+        Keyword args:
+            wait_for_quota: Block until the quota allows the request instead of raising an error.
+            keep_values: Keep the written values in memory, defaults to True.
+        """
+        self.setup_fake_sink(latency, requests_per_minute, kwargs.get('wait_for_quota', False))
+        self.max_payload_bytes = max_payload_bytes
+        self.max_cells = max_cells
+        self.keep_values = kwargs.get('keep_values', True)
+        self.values = {}
+        self.cells = {}
+        self.sheets = {}
+
+    def clear_values(self, spreadsheet_id, range_name):
+        """
+        Remove the stored values of the range.
+        """
+        self.fake_request()
+        self.values.pop((spreadsheet_id, range_name), None)
+        self.cells.pop((spreadsheet_id, range_name), None)
+
+    def batch_clear_values(self, spreadsheet_id, range_names):
+        """
+        Remove the stored values of every range with one request.
+        """
+        self.fake_request()
+
+        for range_name in range_names:
+            self.values.pop((spreadsheet_id, range_name), None)
+            self.cells.pop((spreadsheet_id, range_name), None)
+
+    def add_sheets(self, spreadsheet_id, sheet_titles):
+        """
+        Add the new sheet titles of the spreadsheet, with one request to read them and one to add the new ones.
+        """
+        self.fake_request()
+        spreadsheet_sheets = self.sheets.setdefault(spreadsheet_id, set())
+        new_titles = set(sheet_titles) - spreadsheet_sheets
+
+        if new_titles:
+            self.fake_request(len(json.dumps(sorted(new_titles))))
+            spreadsheet_sheets.update(new_titles)
+
+    def update_values(self, spreadsheet_id, range_name, values, value_input_option='USER_ENTERED'):
+        """
+        Store the values of the range.
+        """
+        payload_bytes = len(json.dumps({'values': values}))
+
+        if payload_bytes > self.max_payload_bytes:
+            raise SinkError('The request payload exceeds {} bytes.'.format(self.max_payload_bytes))
+
+        range_cells = sum(len(row) for row in values)
+        spreadsheet_cells = sum(
+            cells for (cells_spreadsheet_id, cells_range), cells in self.cells.items()
+            if cells_spreadsheet_id == spreadsheet_id and cells_range != range_name
+        )
+
+        if spreadsheet_cells + range_cells > self.max_cells:
+            raise SinkError('The spreadsheet {} exceeds {} cells.'.format(spreadsheet_id, self.max_cells))
+
+        self.fake_request(payload_bytes)
+        self.cells[(spreadsheet_id, range_name)] = range_cells
+
+        if self.keep_values:
+            self.values[(spreadsheet_id, range_name)] = values
+
+    def batch_update_values(self, spreadsheet_id, data, value_input_option='USER_ENTERED'):
+        """
+        Store the values of every range with one request, the ranges overwrite the stored ones.
+        """
+        payload_bytes = len(json.dumps({
+            'data': [{'range': range_name, 'values': values} for range_name, values in data],
+        }))
+
+        if payload_bytes > self.max_payload_bytes:
+            raise SinkError('The request payload exceeds {} bytes.'.format(self.max_payload_bytes))
+
+        range_cells = {}
+
+        for range_name, values in data:
+            range_cells[range_name] = sum(len(row) for row in values)
+
+        spreadsheet_cells = sum(
+            cells for (cells_spreadsheet_id, cells_range), cells in self.cells.items()
+            if cells_spreadsheet_id == spreadsheet_id and cells_range not in range_cells
+        )
+
+        if spreadsheet_cells + sum(range_cells.values()) > self.max_cells:
+            raise SinkError('The spreadsheet {} exceeds {} cells.'.format(spreadsheet_id, self.max_cells))
+
+        self.fake_request(payload_bytes)
+
+        for range_name, cells in range_cells.items():
+            self.cells[(spreadsheet_id, range_name)] = cells
+
+        if self.keep_values:
+            for range_name, values in data:
+                self.values[(spreadsheet_id, range_name)] = values
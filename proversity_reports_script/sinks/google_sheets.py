@@ -0,0 +1,118 @@
+"""
+Google Sheets sink.
+"""
+from proversity_reports_script.sinks.base import AbstractSheetsSink, SinkError
+
+
+class GoogleSheetsSink(AbstractSheetsSink):
+    """
+    Sheets sink that writes the report data with the Google Sheets API.
+    """
+
+    def __init__(
+        self,
+        credentials_provider='oauth',
+        credentials_file=None,
+        **kwargs
+    ):  # pylint: disable=unused-argument
+        """
+        Keyword args:
+            credentials_provider: 'oauth' or 'service_account', see google_apis.credentials.
+            credentials_file: Path of the oAuth credentials file or of the service account key file,
+                              the oAuth file defaults to the --oauth-config-file argument.
+        """
+        self.credentials_provider = credentials_provider
+        self.credentials_file = credentials_file
+        self._service = None
+
+    def __getstate__(self):
+        # The Google API service cannot be sent to the worker processes.
+        state = self.__dict__.copy()
+        state['_service'] = None
+
+        return state
+
+    @property
+    def service(self):
+        """
+        Return the spreadsheets() service, it's built on the first use and reused for the next requests.
+        """
+        if self._service is None:
+            # Imported here since sheets_api uses this sink as its default one.
+            from proversity_reports_script.google_apis.sheets_api import get_sheets_api_service
+
+            self._service = get_sheets_api_service(self.credentials_provider, self.credentials_file)
+
+            if not self._service:
+                raise SinkError('Unable to obtain the Google Sheets API service.')
+
+        return self._service
+
+    def clear_values(self, spreadsheet_id, range_name):
+        """
+        Clear the values of the spreadsheet range.
+        """
+        self.service.values().clear(
+            spreadsheetId=spreadsheet_id,
+            range=range_name,
+        ).execute()
+
+    def update_values(self, spreadsheet_id, range_name, values, value_input_option='USER_ENTERED'):
+        """
+        Write the list of rows into the spreadsheet range.
+        """
+        self.service.values().update(
+            spreadsheetId=spreadsheet_id,
+            range=range_name,
+            valueInputOption=value_input_option,
+            body={
+                'values': values,
+            },
+        ).execute()
+
+    def batch_clear_values(self, spreadsheet_id, range_names):
+        """
+        Clear the values of every range with one request.
+        """
+        self.service.values().batchClear(
+            spreadsheetId=spreadsheet_id,
+            body={
+                'ranges': list(range_names),
+            },
+        ).execute()
+
+    def add_sheets(self, spreadsheet_id, sheet_titles):
+        """
+        Add the sheets that do not exist yet with one request.
+        """
+        spreadsheet = self.service.get(spreadsheetId=spreadsheet_id, fields='sheets.properties.title').execute()
+        existing_titles = {sheet['properties']['title'] for sheet in spreadsheet.get('sheets', [])}
+        new_titles = [title for title in dict.fromkeys(sheet_titles) if title not in existing_titles]
+
+        if not new_titles:
+            return
+
+        self.service.batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                'requests': [{'addSheet': {'properties': {'title': title}}} for title in new_titles],
+            },
+        ).execute()
+
+    def batch_update_values(self, spreadsheet_id, data, value_input_option='USER_ENTERED'):
+        """
+        Write the list of rows of every range with one request.
+        """
+        self.service.values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={
+                'valueInputOption': value_input_option,
+                'data': [
+                    {
+                        'range': range_name,
+                        'values': values,
+                    }
+                    for range_name, values in data
+                ],
+            },
+        ).execute()
@@ -0,0 +1,72 @@
+"""
+Amazon S3 storage sink.
+"""
+import os
+import threading
+
+from proversity_reports_script.metrics import stage
+from proversity_reports_script.sinks.base import AbstractStorageSink
+
+# boto3 clients are thread-safe, but their creation from the default session is not.
+_client_lock = threading.Lock()
+
+
+class S3StorageSink(AbstractStorageSink):
+    """
+    Storage sink that uploads the report files to Amazon S3.
+    """
+
+    def __init__(self, **kwargs):
+        self.client_kwargs = kwargs
+        self._client = None
+
+    def __getstate__(self):
+        # The boto3 client cannot be sent to the worker processes.
+        state = self.__dict__.copy()
+        state['_client'] = None
+
+        return state
+
+    @property
+    def client(self):
+        """
+        Return the S3 client, it's created on the first use.
+        """
+        with _client_lock:
+            if self._client is None:
+                # boto3 takes a long time to import, it's loaded on the first S3 request.
+                import boto3
+
+                self._client = boto3.client('s3', **self.client_kwargs)
+
+        return self._client
+
+    def upload_file(self, bucket_name, file_path, key):
+        """
+        Upload the local file to the S3 bucket.
+        """
+        with stage('s3_upload', key=key) as upload_stage:
+            upload_stage.bytes = os.path.getsize(file_path)
+            self.client.upload_file(file_path, bucket_name, key)
+
+    def get_object(self, bucket_name, key, if_none_match=None, if_modified_since=None):
+        """
+        Return the S3 get_object response, or None when the object was not modified.
+        """
+        from botocore.exceptions import ClientError
+
+        conditional_args = {}
+
+        if if_none_match:
+            conditional_args['IfNoneMatch'] = if_none_match
+
+        if if_modified_since:
+            conditional_args['IfModifiedSince'] = if_modified_since
+
+        try:
+            return self.client.get_object(Bucket=bucket_name, Key=key, **conditional_args)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return None
+
+            raise
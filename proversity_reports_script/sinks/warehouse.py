@@ -0,0 +1,114 @@
+"""
+SQLite warehouse sink.
+
+It keeps the rows of every report file of every run in a local SQLite file, so the report
+history can be queried without downloading the csv files from the storage (see query_warehouse.py).
+The rows are stored as json objects with the values of the report data, e.g.:
+
+    SELECT runs.started_at, AVG(json_extract(report_rows.data, '$."Unit 1"'))
+    FROM report_rows JOIN runs USING (run_id)
+    WHERE report_rows.report = 'time_spent_per_user_report' AND report_rows.course_id = 'course-v1:...'
+    GROUP BY runs.run_id ORDER BY runs.started_at
+"""
+from contextlib import closing
+from datetime import datetime, timezone
+import json
+import os
+import sqlite3
+
+from proversity_reports_script.metrics import stage
+
+DEFAULT_WAREHOUSE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'result', 'warehouse.sqlite3')
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        report TEXT NOT NULL,
+        started_at TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS report_rows (
+        run_id TEXT NOT NULL,
+        report TEXT NOT NULL,
+        course_id TEXT NOT NULL,
+        table_name TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        data TEXT NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS runs_report ON runs (report, started_at)',
+    'CREATE INDEX IF NOT EXISTS report_rows_run ON report_rows (run_id)',
+    'CREATE INDEX IF NOT EXISTS report_rows_report_course ON report_rows (report, course_id, table_name, run_id)',
+)
+
+
+class SQLiteWarehouseSink(object):
+    """
+    Warehouse sink that writes the report rows into a SQLite file in WAL mode.
+
+    The connections are opened per write so the sink can be sent to the worker processes,
+    the WAL mode lets them write while the warehouse is queried.
+    """
+
+    def __init__(self, file_path=None, batch_size=5000, **kwargs):  # pylint: disable=unused-argument
+        """
+        Args:
+            file_path: Path of the SQLite file, defaults to result/warehouse.sqlite3.
+            batch_size: Number of rows of every executemany call.
+        """
+        self.file_path = file_path or DEFAULT_WAREHOUSE_FILE
+        self.batch_size = batch_size
+
+        with closing(self.connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+
+    def connect(self):
+        """
+        Return a new connection to the warehouse.
+        """
+        connection = sqlite3.connect(self.file_path, timeout=60)
+        connection.execute('PRAGMA synchronous=NORMAL')
+
+        return connection
+
+    def start_run(self, run_id, report_name):
+        """
+        Register a new run of the report.
+        """
+        with closing(self.connect()) as connection:
+            with connection:
+                connection.execute(
+                    'INSERT OR IGNORE INTO runs (run_id, report, started_at) VALUES (?, ?, ?)',
+                    (run_id, report_name, datetime.now(timezone.utc).isoformat()),
+                )
+
+    def write_rows(self, run_id, report_name, course_id, table_name, rows):
+        """
+        Write the rows of one report file in one transaction.
+
+        Args:
+            run_id: Id of the run.
+            report_name: Name of the report.
+            course_id: Course of the rows, empty for the reports that are not per course.
+            table_name: Name of the report file, without extension.
+            rows: List of row dicts.
+        """
+        with stage('warehouse_write', table=table_name) as warehouse_stage:
+            with closing(self.connect()) as connection:
+                with connection:
+                    for start in range(0, len(rows), self.batch_size):
+                        connection.executemany(
+                            'INSERT INTO report_rows (run_id, report, course_id, table_name, position, data) '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            [
+                                (run_id, report_name, course_id, table_name, position, json.dumps(row, default=str))
+                                for position, row in enumerate(rows[start:start + self.batch_size], start)
+                            ],
+                        )
+
+            warehouse_stage.rows = len(rows)
@@ -0,0 +1,121 @@
+"""
+Routing of the report files to their spreadsheet ranges.
+
+The SPREADSHEET_DATA of a report is parsed once into a table of (spreadsheet key, course id) to
+(spreadsheet id, range). The spreadsheet keys are the names used by the report backends, e.g.
+completion_sheet_id, and the destinations can be set per course or with a default for every course:
+
+    "SPREADSHEET_DATA": {
+        "completion_sheet_id_<course_id>": "spreadsheet id",
+        "completion_sheet_id": {
+            "<course_id>": "spreadsheet id",
+            "<course_id>": {"spreadsheet_id": "spreadsheet id", "range": "Completion"},
+            "*": {"spreadsheet_id": "shared spreadsheet id", "range": "{course}"}
+        }
+    }
+
+The spreadsheet id can also be set directly to the spreadsheet key, e.g. "enrollment_per_site": "id",
+as the default of every course.
+
+The range can use the {course} and {range} placeholders (the course id and the range name of the
+report file, e.g. Sheet2), then every course gets its own tab, which is added when it does not exist.
+The default routes of the courses without a range use one tab per course and report file: '{course} {range}'.
+"""
+from collections import namedtuple
+
+DEFAULT_ROUTE_KEY = '*'
+DEFAULT_SHARED_RANGE = '{course} {range}'
+# Maximum length of a sheet title.
+MAX_SHEET_TITLE_LENGTH = 100
+
+SpreadsheetRoute = namedtuple('SpreadsheetRoute', ['spreadsheet_id', 'range_name', 'sheet_title'])
+
+
+class SpreadsheetRouter(object):
+    """
+    Routing table of the spreadsheet keys of a report backend.
+    """
+
+    def __init__(self, spreadsheet_data, spreadsheet_keys):
+        """
+        Args:
+            spreadsheet_data: SPREADSHEET_DATA dict of the report.
+            spreadsheet_keys: Spreadsheet keys of the report backend, the flat '<key>_<course id>'
+                              keys are split with them.
+        """
+        self.routes = {}
+        self.default_routes = {}
+        # The longest keys first, so a key is never split with a shorter key that is its prefix.
+        spreadsheet_keys = sorted(spreadsheet_keys, key=len, reverse=True)
+
+        for data_key, value in (spreadsheet_data or {}).items():
+            if data_key in spreadsheet_keys:
+                if isinstance(value, dict) and 'spreadsheet_id' not in value:
+                    for course_id, course_value in value.items():
+                        self.add_route(data_key, course_id, course_value)
+                else:
+                    self.add_route(data_key, DEFAULT_ROUTE_KEY, value)
+
+                continue
+
+            for spreadsheet_key in spreadsheet_keys:
+                if data_key.startswith('{}_'.format(spreadsheet_key)):
+                    self.add_route(spreadsheet_key, data_key[len(spreadsheet_key) + 1:], value)
+                    break
+
+    def add_route(self, spreadsheet_key, course_id, value):
+        """
+        Add the route of a SPREADSHEET_DATA value: a spreadsheet id or a dict with the spreadsheet_id and the range.
+        """
+        if isinstance(value, dict):
+            spreadsheet_id, range_name = value.get('spreadsheet_id'), value.get('range')
+        else:
+            spreadsheet_id, range_name = value, None
+
+        if not spreadsheet_id:
+            return
+
+        if course_id == DEFAULT_ROUTE_KEY:
+            self.default_routes[spreadsheet_key] = (spreadsheet_id, range_name)
+        else:
+            self.routes[(spreadsheet_key, course_id)] = (spreadsheet_id, range_name)
+
+    def get_route(self, spreadsheet_key, course_id='', range_name='Sheet1'):
+        """
+        Return the SpreadsheetRoute of the report file, None when it has no spreadsheet.
+
+        Args:
+            spreadsheet_key: Spreadsheet key of the report file, e.g. completion_sheet_id.
+            course_id: Course of the report file, empty for the reports that are not per course.
+            range_name: Range name of the report file when the route does not set one.
+        """
+        route = self.routes.get((spreadsheet_key, course_id))
+
+        if route is None:
+            route = self.default_routes.get(spreadsheet_key)
+
+            if not route:
+                return None
+
+            if not route[1] and course_id:
+                # The courses that share the spreadsheet get a tab per course and report file.
+                route = (route[0], DEFAULT_SHARED_RANGE)
+
+        spreadsheet_id, route_range_name = route
+
+        if not route_range_name:
+            return SpreadsheetRoute(spreadsheet_id, range_name, None)
+
+        if '{' not in route_range_name:
+            return SpreadsheetRoute(spreadsheet_id, route_range_name, None)
+
+        sheet_title = route_range_name.format(course=course_id, range=range_name)[:MAX_SHEET_TITLE_LENGTH]
+
+        return SpreadsheetRoute(spreadsheet_id, quote_sheet_title(sheet_title), sheet_title)
+
+
+def quote_sheet_title(sheet_title):
+    """
+    Return the sheet title in A1 notation, quoted since the course ids have special characters.
+    """
+    return "'{}'".format(sheet_title.replace("'", "''"))
@@ -0,0 +1,112 @@
+"""
+Query the report history of the SQLite warehouse sink.
+
+    python3 ./query_warehouse.py --warehouse-file result/warehouse.sqlite3 runs --report time_spent_per_user_report
+    python3 ./query_warehouse.py tables --report completion_report --course "course-v1:..."
+    python3 ./query_warehouse.py trend --report time_spent_per_user_report --course "course-v1:..." \\
+        --table report --column "Unit 1" --since 2019-05-01
+    python3 ./query_warehouse.py sql "SELECT report, COUNT(*) FROM report_rows GROUP BY report"
+"""
+from argparse import ArgumentParser
+from contextlib import closing
+import sqlite3
+
+from proversity_reports_script.sinks.warehouse import DEFAULT_WAREHOUSE_FILE
+
+
+def print_rows(cursor):
+    """
+    Print the rows of the cursor as tab separated values, with a header line.
+    """
+    print('\t'.join(column[0] for column in cursor.description))
+
+    for row in cursor:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def main():
+    """
+    Run the query of the subcommand and print the results.
+    """
+    parser = ArgumentParser()
+    parser.add_argument('--warehouse-file', default=DEFAULT_WAREHOUSE_FILE, help='Path to the warehouse file.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    runs_parser = subparsers.add_parser('runs', help='List the runs and their number of rows.')
+    runs_parser.add_argument('--report', help='Report name.')
+
+    tables_parser = subparsers.add_parser('tables', help='List the tables of the report and their columns.')
+    tables_parser.add_argument('--report', required=True, help='Report name.')
+    tables_parser.add_argument('--course', default='', help='Course id.')
+
+    trend_parser = subparsers.add_parser('trend', help='Aggregate a column of a report table per run.')
+    trend_parser.add_argument('--report', required=True, help='Report name.')
+    trend_parser.add_argument('--course', default='', help='Course id.')
+    trend_parser.add_argument('--table', default='report', help='Table name, see the tables command.')
+    trend_parser.add_argument('--column', required=True, help='Column name.')
+    trend_parser.add_argument('--since', help='Only the runs started since this ISO date.')
+
+    sql_parser = subparsers.add_parser('sql', help='Run a SQL query, the tables are runs and report_rows.')
+    sql_parser.add_argument('query')
+
+    args = parser.parse_args()
+
+    with closing(sqlite3.connect('file:{}?mode=ro'.format(args.warehouse_file), uri=True)) as connection:
+        if args.command == 'runs':
+            cursor = connection.execute(
+                '''
+                SELECT runs.run_id, runs.report, runs.started_at,
+                    (SELECT COUNT(*) FROM report_rows WHERE report_rows.run_id = runs.run_id) AS rows
+                FROM runs
+                WHERE ? IS NULL OR runs.report = ?
+                ORDER BY runs.started_at
+                ''',
+                (args.report, args.report),
+            )
+        elif args.command == 'tables':
+            cursor = connection.execute(
+                '''
+                SELECT table_name, COUNT(DISTINCT run_id) AS runs,
+                    (SELECT GROUP_CONCAT(key, ', ') FROM json_each(data)) AS columns
+                FROM report_rows
+                WHERE report = ? AND course_id = ? AND position = 0
+                GROUP BY table_name
+                ''',
+                (args.report, args.course),
+            )
+        elif args.command == 'trend':
+            column_path = '$."{}"'.format(args.column.replace('"', '\\"'))
+            cursor = connection.execute(
+                '''
+                SELECT runs.started_at, COUNT(*) AS rows,
+                    AVG(json_extract(report_rows.data, ?)) AS average,
+                    MIN(json_extract(report_rows.data, ?)) AS minimum,
+                    MAX(json_extract(report_rows.data, ?)) AS maximum,
+                    SUM(json_extract(report_rows.data, ?)) AS total
+                FROM report_rows JOIN runs USING (run_id)
+                WHERE report_rows.report = ? AND report_rows.course_id = ? AND report_rows.table_name = ?
+                    AND (? IS NULL OR runs.started_at >= ?)
+                GROUP BY runs.run_id
+                ORDER BY runs.started_at
+                ''',
+                (
+                    column_path,
+                    column_path,
+                    column_path,
+                    column_path,
+                    args.report,
+                    args.course,
+                    args.table,
+                    args.since,
+                    args.since,
+                ),
+            )
+        else:
+            cursor = connection.execute(args.query)
+
+        print_rows(cursor)
+
+
+if __name__ == '__main__':
+    main()